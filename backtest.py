@@ -0,0 +1,290 @@
+import argparse
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from notify_discord import COURSE_CODE_MAP
+from race_results_collect import RESULT_FILE_SUFFIX
+
+# ==============================
+# バックテスト
+# ==============================
+# 使い方:
+#   python backtest.py --start 20250105 --end 20251228
+#   python backtest.py --start 20251207 --end 20251207 --source baseline --out backtest.json
+#
+# race_data_YYYYMMDD/ に保存済みの *_aiready.csv・予測 json・*_result.json を日単位で
+# プロセスプールに読み込み、(レース, 馬) の配列にまとめて指標をベクトル計算する。
+#   source=stored   : 保存済みの予測 json（LLM / アンサンブル / 代替予測）を評価
+#   source=baseline : aiready 特徴量からベースライン予測を再計算して評価
+#                     （feature_registry.py の格付け・特徴量の変更を LLM なしで比較できる）
+
+SOURCES = ("stored", "baseline")
+
+GROUP_KEYS = ("venue", "surface", "distance_band")
+
+# 距離帯（上限 m, 名称）
+DISTANCE_BANDS = [(1400, "短距離"), (1800, "マイル"), (2200, "中距離"), (None, "長距離")]
+
+TOP_K = (1, 2, 3)
+
+BET_YEN = 100
+
+_EPS = 1e-6
+
+
+def distance_band(distance) -> str:
+    try:
+        d = int(float(distance))
+    except (TypeError, ValueError):
+        return "不明"
+    if d < 100:
+        d *= 100
+    for limit, name in DISTANCE_BANDS:
+        if limit is None or d <= limit:
+            return name
+    return "不明"
+
+
+def list_day_dirs(root: str, start: str, end: str) -> list:
+    days = []
+    for path in glob.glob(os.path.join(root, "race_data_*")):
+        m = re.fullmatch(r"race_data_(\d{8})", os.path.basename(path))
+        if m and start <= m.group(1) <= end and os.path.isdir(path):
+            days.append(path)
+    return sorted(days)
+
+
+# =========================
+# 日単位の読み込み（ワーカープロセス）
+# =========================
+def _load_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _race_id(csv_path: str) -> str:
+    m = re.match(r"(\d{12})_", os.path.basename(csv_path))
+    return m.group(1) if m else ""
+
+
+def _stored_rates(csv_path: str, numbers: np.ndarray):
+    json_path = csv_path[:-len(".csv")] + ".json"
+    if not os.path.exists(json_path):
+        return None
+    by_number = {int(p["horse_number"]): p for p in _load_json(json_path)}
+    rates = np.zeros((len(numbers), 2))
+    for i, n in enumerate(numbers):
+        p = by_number.get(int(n))
+        if p is not None:
+            rates[i] = (p.get("win_rate", 0) or 0, p.get("top3_rate", 0) or 0)
+    return rates
+
+
+def _baseline_rates(dfs: list) -> list:
+    """その日の全レースをまとめてベースライン予測（1回のバッチ計算）"""
+    from baseline_predictor import predict_batch, race_features, stack_races
+
+    races = [race_features(df) for df in dfs]
+    probs = predict_batch(stack_races(races))
+    out = []
+    for race, p in zip(races, probs):
+        n = len(race["horse_number"])
+        out.append(np.stack([p[:n, 0], p[:n, 2]], axis=1) * 100.0)
+    return out
+
+
+def _payout_by_number(payouts: list, numbers: np.ndarray) -> np.ndarray:
+    yen = {str(p["numbers"]): p["yen"] for p in payouts or []}
+    return np.array([yen.get(str(int(n)), 0) for n in numbers], dtype=float)
+
+
+def load_day(day_dir: str, source: str = "stored") -> list:
+    """
+    1日分のレースを評価用レコードにする。結果・予測が揃わないレースは除外。
+    レコードは馬番順の小さな配列のみ持ち、親プロセスへの転送量を抑える。
+    """
+    import pandas as pd
+
+    rows = []
+    for csv_path in sorted(glob.glob(os.path.join(day_dir, "*_aiready.csv"))):
+        race_id = _race_id(csv_path)
+        result_file = os.path.join(day_dir, f"{race_id}{RESULT_FILE_SUFFIX}")
+        if not race_id or not os.path.exists(result_file):
+            continue
+        df = pd.read_csv(csv_path)
+        if df.empty or "horse_number" not in df.columns:
+            continue
+        rows.append((race_id, csv_path, df, _load_json(result_file)))
+
+    if source == "baseline":
+        rates_list = _baseline_rates([df for _, _, df, _ in rows])
+    else:
+        rates_list = [_stored_rates(csv_path, df["horse_number"].to_numpy()) for _, csv_path, df, _ in rows]
+
+    records = []
+    for (race_id, _, df, result), rates in zip(rows, rates_list):
+        if rates is None:
+            continue
+        numbers = df["horse_number"].to_numpy()
+        rank_by_number = {int(r["horse_number"]): r["rank"] or 0 for r in result.get("order", [])}
+        ranks = np.array([rank_by_number.get(int(n), 0) for n in numbers], dtype=np.int16)
+        if not (ranks == 1).any():
+            continue
+
+        payouts = result.get("payouts", {})
+        first = df.iloc[0]
+        records.append({
+            "race_id": race_id,
+            "venue": COURSE_CODE_MAP.get(race_id[8:10], "UNKNOWN"),
+            "surface": str(first.get("surface", "") or "不明"),
+            "distance_band": distance_band(first.get("distance")),
+            "win": rates[:, 0] / 100.0,
+            "top3": rates[:, 1] / 100.0,
+            "rank": ranks,
+            "win_yen": _payout_by_number(payouts.get("win"), numbers),
+            "place_yen": _payout_by_number(payouts.get("place"), numbers),
+        })
+    return records
+
+
+def load_days(day_dirs: list, source: str, workers: int = None) -> list:
+    if workers == 1 or len(day_dirs) <= 1:
+        per_day = [load_day(d, source) for d in day_dirs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            per_day = list(pool.map(load_day, day_dirs, [source] * len(day_dirs)))
+    return [r for day in per_day for r in day]
+
+
+# =========================
+# 指標（ベクトル計算）
+# =========================
+def stack_records(records: list) -> dict:
+    """(レース数, 最大頭数) にパディング。mask=False の位置は確率 0・着順 0"""
+    n_races = len(records)
+    width = max(len(r["rank"]) for r in records)
+    batch = {
+        "mask": np.zeros((n_races, width), dtype=bool),
+        "win": np.zeros((n_races, width)),
+        "top3": np.zeros((n_races, width)),
+        "rank": np.zeros((n_races, width), dtype=np.int16),
+        "win_yen": np.zeros((n_races, width)),
+        "place_yen": np.zeros((n_races, width)),
+    }
+    for i, r in enumerate(records):
+        n = len(r["rank"])
+        batch["mask"][i, :n] = True
+        for key in ("win", "top3", "rank", "win_yen", "place_yen"):
+            batch[key][i, :n] = r[key]
+    return batch
+
+
+def race_metrics(b: dict) -> dict:
+    """レースごとの指標 (レース数,) を返す。集計は group_means で行う"""
+    mask = b["mask"]
+    win = np.where(mask, b["win"], 0.0)
+    total = win.sum(axis=1, keepdims=True)
+    win = np.divide(win, total, out=np.full_like(win, 0.0), where=total > 0)
+
+    y_win = (b["rank"] == 1) & mask
+    y_top3 = (b["rank"] >= 1) & (b["rank"] <= 3) & mask
+    top3 = np.clip(np.where(mask, b["top3"], 0.0), 0.0, 1.0)
+
+    p_winner = (win * y_win).sum(axis=1)
+    metrics = {
+        "log_loss": -np.log(np.clip(p_winner, _EPS, 1.0)),
+        "brier_win": ((win - y_win) ** 2 * mask).sum(axis=1),
+        "brier_top3": ((top3 - y_top3) ** 2 * mask).sum(axis=1) / mask.sum(axis=1),
+    }
+
+    # 勝ち馬より高い確率を付けた頭数 = 勝ち馬の予測順位 - 1
+    above = ((win > p_winner[:, None]) & mask).sum(axis=1)
+    for k in TOP_K:
+        metrics[f"hit_top{k}"] = (above < k).astype(float)
+
+    # 予測1位の単勝・複勝を 100 円ずつ購入
+    pick = np.argmax(np.where(mask, win, -1.0), axis=1)
+    rows = np.arange(len(pick))
+    metrics["roi_win"] = b["win_yen"][rows, pick] * y_win[rows, pick] / BET_YEN
+    metrics["roi_place"] = b["place_yen"][rows, pick] * y_top3[rows, pick] / BET_YEN
+    return metrics
+
+
+def group_means(metrics: dict, labels: list) -> dict:
+    names, codes = np.unique(np.asarray(labels), return_inverse=True)
+    counts = np.bincount(codes, minlength=len(names))
+    out = {}
+    for g, name in enumerate(names):
+        out[str(name)] = {"races": int(counts[g])}
+    for key, values in metrics.items():
+        sums = np.bincount(codes, weights=values, minlength=len(names))
+        for g, name in enumerate(names):
+            out[str(name)][key] = float(sums[g] / counts[g])
+    return out
+
+
+def evaluate(records: list) -> dict:
+    metrics = race_metrics(stack_records(records))
+    report = {"overall": group_means(metrics, ["ALL"] * len(records))["ALL"]}
+    for key in GROUP_KEYS:
+        report[key] = group_means(metrics, [r[key] for r in records])
+    return report
+
+
+# =========================
+# 表示
+# =========================
+METRIC_COLUMNS = ["races", "log_loss", "brier_win", "brier_top3", "hit_top1", "hit_top3", "roi_win", "roi_place"]
+
+
+def format_report(report: dict) -> str:
+    header = f"  {'':<12}" + "".join(f"{c:>11}" for c in METRIC_COLUMNS)
+
+    def row(name, m):
+        cells = [f"{m['races']:>11d}"] + [f"{m[c]:>11.3f}" for c in METRIC_COLUMNS[1:]]
+        return f"  {name:<12}" + "".join(cells)
+
+    lines = ["=== バックテスト ===", header, row("全体", report["overall"])]
+    for key in GROUP_KEYS:
+        lines.append(f"--- {key} ---")
+        for name, m in report[key].items():
+            lines.append(row(name, m))
+    return "\n".join(lines)
+
+
+def main(root: str, start: str, end: str, source: str = "stored", workers: int = None, out_path: str = None):
+    day_dirs = list_day_dirs(root, start, end)
+    if not day_dirs:
+        raise FileNotFoundError(f"{root} に {start}〜{end} の race_data_YYYYMMDD がありません")
+
+    records = load_days(day_dirs, source, workers)
+    if not records:
+        raise RuntimeError("結果と予測が揃ったレースがありません（race_results_collect.py を実行してください）")
+
+    report = evaluate(records)
+    report["meta"] = {"start": start, "end": end, "source": source, "days": len(day_dirs)}
+    print(format_report(report))
+
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[OK] バックテスト結果出力: {out_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="保存済みの予測と確定結果でバックテスト")
+    parser.add_argument("--start", required=True, help="YYYYMMDD")
+    parser.add_argument("--end", required=True, help="YYYYMMDD")
+    parser.add_argument("--root", default=".", help="race_data_YYYYMMDD を含むディレクトリ")
+    parser.add_argument("--source", choices=SOURCES, default="stored")
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数（既定: CPU 数）")
+    parser.add_argument("--out", default=None, help="結果を JSON で保存")
+    args = parser.parse_args()
+
+    main(args.root, args.start, args.end, args.source, args.workers, args.out)
@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from feature_registry import NUM_PREV, normalize_distance
+from predict_race_ai import build_base_name, detect_venue, load_csv
+from placement_probs import placement_probs
+
+# =========================
+# 設定
+# =========================
+
+# 場別の重み（先行力, 上がり）: build_prompt の場別ロジックに対応
+VENUE_WEIGHTS = {
+    "東京": (0.10, 0.45),
+    "中山": (0.40, 0.10),
+    "京都": (0.15, 0.30),
+    "阪神": (0.20, 0.20),
+    "中京": (0.10, 0.35),
+    "新潟": (0.05, 0.50),
+    "福島": (0.45, 0.05),
+    "小倉": (0.30, 0.10),
+    "札幌": (0.30, 0.10),
+    "函館": (0.45, 0.05),
+}
+DEFAULT_VENUE_WEIGHTS = (0.20, 0.20)
+
+HEAVY_CONDITIONS = ("重", "不", "不良", "稍")
+
+# 勝率分布の鋭さ（小さいほど上位集中）
+SOFTMAX_TEMPERATURE = 0.6
+
+
+# =========================
+# 特徴量抽出（1レース分）
+# =========================
+def _numeric(df: pd.DataFrame, col: str) -> np.ndarray:
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+
+def _kankaku_weeks(df: pd.DataFrame) -> np.ndarray:
+    if "kankaku" not in df.columns:
+        return np.full(len(df), np.nan)
+    s = df["kankaku"].astype(str)
+    weeks = pd.to_numeric(s.str.extract(r"(\d+)")[0], errors="coerce")
+    weeks = weeks.mask(s.str.contains("連闘"), 0)
+    return weeks.to_numpy(dtype=float)
+
+
+def _stat_ratio(df: pd.DataFrame, prefix: str) -> np.ndarray:
+    # {prefix}_win / 出走数（win + place2 + place3 + other）
+    cols = [f"{prefix}_win", f"{prefix}_place2", f"{prefix}_place3", f"{prefix}_other"]
+    vals = np.stack([_numeric(df, c) for c in cols], axis=-1)
+    runs = np.nansum(vals, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(runs > 0, vals[:, 0] / runs, np.nan)
+
+
+def race_features(df: pd.DataFrame) -> dict:
+    first = df.iloc[0] if len(df) else {}
+
+    def common(col, default=None):
+        return first[col] if col in df.columns else default
+
+    distance = normalize_distance(common("distance", np.nan))
+    condition = str(common("track_condition", ""))
+
+    prev_margin = np.stack([_numeric(df, f"prev{i}_margin") for i in range(1, NUM_PREV + 1)], axis=-1)
+    prev_distance = np.stack([_numeric(df, f"prev{i}_distance") for i in range(1, NUM_PREV + 1)], axis=-1)
+    prev_distance = np.where(prev_distance < 100, prev_distance * 100, prev_distance)
+    prev_agari = np.stack([_numeric(df, f"prev{i}_agari") for i in range(1, NUM_PREV + 1)], axis=-1)
+    prev_grade = np.stack([_numeric(df, f"prev{i}_grade") for i in range(1, NUM_PREV + 1)], axis=-1)
+    prev_heavy = np.stack([
+        df[f"prev{i}_condition"].isin(["重", "不"]).to_numpy()
+        if f"prev{i}_condition" in df.columns else np.zeros(len(df), dtype=bool)
+        for i in range(1, NUM_PREV + 1)
+    ], axis=-1)
+
+    return {
+        "horse_number": _numeric(df, "horse_number"),
+        "horse_name": df["horse_name"].astype(str).tolist() if "horse_name" in df.columns else [""] * len(df),
+        "running_style": _numeric(df, "running_style_score_0to1"),
+        "jockey_rate": _numeric(df, "jockey_course_win_rate") / 100.0,
+        "father_rate": _numeric(df, "father_course_win_rate") / 100.0,
+        "dist_ratio": _stat_ratio(df, "dist"),
+        "course_ratio": _stat_ratio(df, "course"),
+        "surface_ratio": _stat_ratio(df, "surface"),
+        "kankaku_weeks": _kankaku_weeks(df),
+        "prev_margin": prev_margin,
+        "prev_distance": prev_distance,
+        "prev_agari": prev_agari,
+        "prev_grade": prev_grade,
+        "prev_heavy": prev_heavy,
+        "distance": float(distance) if pd.notna(distance) else 1600.0,
+        "is_dirt": common("surface", "") == "ダ",
+        "is_heavy": condition in HEAVY_CONDITIONS,
+        "venue": detect_venue(common("date_info", "")),
+    }
+
+
+# =========================
+# 複数レースを (レース数, 最大頭数) に整列
+# =========================
+HORSE_KEYS = [
+    "horse_number", "running_style", "jockey_rate", "father_rate",
+    "dist_ratio", "course_ratio", "surface_ratio", "kankaku_weeks",
+]
+PREV_KEYS = ["prev_margin", "prev_distance", "prev_agari", "prev_grade", "prev_heavy"]
+
+
+def stack_races(races: list) -> dict:
+    n_races = len(races)
+    width = max(len(r["horse_number"]) for r in races)
+
+    batch = {"mask": np.zeros((n_races, width), dtype=bool)}
+    for key in HORSE_KEYS:
+        batch[key] = np.full((n_races, width), np.nan)
+    for key in PREV_KEYS:
+        fill = False if key == "prev_heavy" else np.nan
+        batch[key] = np.full((n_races, width, NUM_PREV), fill, dtype=races[0][key].dtype)
+
+    for r, race in enumerate(races):
+        n = len(race["horse_number"])
+        batch["mask"][r, :n] = True
+        for key in HORSE_KEYS + PREV_KEYS:
+            batch[key][r, :n] = race[key]
+
+    venue_w = np.array([VENUE_WEIGHTS.get(r["venue"], DEFAULT_VENUE_WEIGHTS) for r in races])
+    batch["style_weight"] = venue_w[:, 0]
+    batch["agari_weight"] = venue_w[:, 1]
+    batch["distance"] = np.array([r["distance"] for r in races], dtype=float)
+    batch["is_dirt"] = np.array([r["is_dirt"] for r in races], dtype=bool)
+    batch["is_heavy"] = np.array([r["is_heavy"] for r in races], dtype=bool)
+    return batch
+
+
+# =========================
+# スコア計算（全レース一括）
+# =========================
+def _field_zscore(x: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # 出走馬内で標準化。欠損は 0（平均扱い）
+    valid = mask & ~np.isnan(x)
+    cnt = valid.sum(axis=1, keepdims=True)
+    xs = np.where(valid, x, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = xs.sum(axis=1, keepdims=True) / cnt
+        var = (np.where(valid, x - mean, 0.0) ** 2).sum(axis=1, keepdims=True) / cnt
+        z = (x - mean) / np.sqrt(var)
+    return np.where(valid & (var > 0), z, 0.0)
+
+
+def score_batch(b: dict) -> np.ndarray:
+    mask = b["mask"]
+    dist = b["distance"][:, None]
+    margin = np.clip(b["prev_margin"], -1.0, 3.0)
+    has_margin = ~np.isnan(margin)
+
+    # --- 基準能力: 今回距離±200m の最小着差 → なければ prev1 ---
+    dist_match = has_margin & (np.abs(b["prev_distance"] - dist[..., None]) <= 200)
+    matched = np.where(dist_match, margin, np.inf).min(axis=-1)
+    base_margin = np.where(np.isfinite(matched), matched, margin[..., 0])
+    has_base = ~np.isnan(base_margin)
+    ability = np.where(has_base, -base_margin, 0.0)
+    ability = np.where(has_base, ability, _masked_mean(ability, has_base & mask))
+
+    # --- トレンド補正: 過去走平均より prev1 が良ければ加点 ---
+    older = _nanmean_last(margin[..., 1:])
+    trend = np.where(has_margin[..., 0] & ~np.isnan(older), np.clip(older - margin[..., 0], -1.0, 1.0), 0.0)
+
+    # --- 統計補正（基準能力が無い馬ほど重視） ---
+    stat_weight = np.where(has_base, 1.0, 2.0)
+    stats = (
+        0.30 * _field_zscore(b["jockey_rate"], mask)
+        + 0.15 * _field_zscore(b["father_rate"], mask)
+        + 0.10 * _field_zscore(b["dist_ratio"], mask)
+        + 0.10 * _field_zscore(b["course_ratio"], mask)
+        + 0.10 * _field_zscore(b["surface_ratio"], mask)
+    ) * stat_weight
+
+    # --- 場別: 先行力 / 上がり ---
+    style = _field_zscore(b["running_style"], mask)
+    agari = -_field_zscore(_nanmean_last(b["prev_agari"]), mask)
+    venue = b["style_weight"][:, None] * style + b["agari_weight"][:, None] * agari
+
+    # --- 表面・距離・馬場状態 ---
+    short = (dist <= 1400)
+    dirt = b["is_dirt"][:, None]
+    condition = np.zeros_like(ability)
+    condition += np.where(dirt & short & (b["running_style"] >= 0.6), 0.25, 0.0)
+    condition += np.where(dirt & short & (b["horse_number"] >= 12), 0.05, 0.0)
+    stamina = (has_margin & (b["prev_distance"] >= dist[..., None])).any(axis=-1)
+    condition += np.where(dirt & ~short & stamina, 0.15, 0.0)
+    condition += np.where(~dirt & short, 0.20 * agari, 0.0)
+    condition += np.where(~dirt & ~short, 0.20 * _field_zscore(b["jockey_rate"], mask), 0.0)
+    heavy_good = (b["prev_heavy"] & has_margin & (margin <= 0.6)).any(axis=-1)
+    condition += np.where(b["is_heavy"][:, None] & heavy_good, 0.35, 0.0)
+
+    # --- グレード補正: 上位グレードでの善戦は下げない ---
+    g1 = np.nan_to_num(b["prev_grade"][..., 0])
+    m1 = margin[..., 0]
+    grade = np.where(has_margin[..., 0] & (m1 <= 1.0), g1 * (1.0 - np.clip(m1, 0.0, 1.0)) * 0.5, 0.0)
+
+    # --- 間隔: 極端に短い/長い場合は軽微減点 ---
+    weeks = b["kankaku_weeks"]
+    interval = np.where((weeks <= 1) | (weeks >= 20), -0.1, 0.0)
+
+    score = ability + 0.3 * trend + stats + venue + condition + grade + interval
+    return np.where(mask, score, -np.inf)
+
+
+def _nanmean_last(x: np.ndarray) -> np.ndarray:
+    # 最終軸の nanmean（全欠損は NaN、警告なし）
+    valid = ~np.isnan(x)
+    cnt = valid.sum(axis=-1)
+    total = np.where(valid, x, 0.0).sum(axis=-1)
+    return np.where(cnt > 0, total / np.maximum(cnt, 1), np.nan)
+
+
+def _masked_mean(x: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    cnt = valid.sum(axis=1, keepdims=True)
+    total = np.where(valid, x, 0.0).sum(axis=1, keepdims=True)
+    return np.where(cnt > 0, total / np.maximum(cnt, 1), 0.0)
+
+
+def _softmax(score: np.ndarray, temperature: float) -> np.ndarray:
+    z = score / temperature
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+def predict_batch(batch: dict, method: str = "harville") -> np.ndarray:
+    """(レース数, 頭数, 3) の [勝率, 連対率, 3着内率]（0〜1）を返す"""
+    score = score_batch(batch)
+    win = _softmax(score, SOFTMAX_TEMPERATURE)
+    return placement_probs(win, method=method)
+
+
+# =========================
+# LLM と同一形式の JSON を生成
+# =========================
+def to_prediction(race: dict, rates: np.ndarray) -> list:
+    prediction = []
+    for i, name in enumerate(race["horse_name"]):
+        prediction.append({
+            "horse_number": int(race["horse_number"][i]),
+            "horse_name": name,
+            "win_rate": round(float(rates[i, 0]) * 100, 2),
+            "top2_rate": round(float(rates[i, 1]) * 100, 2),
+            "top3_rate": round(float(rates[i, 2]) * 100, 2),
+        })
+    return sorted(prediction, key=lambda x: -x["win_rate"])
+
+
+def predict_df(df: pd.DataFrame) -> list:
+    # 取得途中で馬番が欠けた行は出力できないため、確率を計算する前に除く（代替経路なので例外は出さない）
+    df = df[np.isfinite(_numeric(df, "horse_number"))]
+    if df.empty:
+        return []
+    race = race_features(df)
+    rates = predict_batch(stack_races([race]))[0]
+    return to_prediction(race, rates)
+
+
+def predict_csv(csv_path: str) -> list:
+    return predict_df(load_csv(csv_path))
+
+
+# =========================
+# メイン処理
+# =========================
+def main(csv_path: str):
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(csv_path)
+
+    prediction = predict_csv(csv_path)
+
+    out_json = os.path.join(os.path.dirname(csv_path), f"{build_base_name(csv_path)}.json")
+    with open(out_json, "w", encoding="utf-8") as f:
+        json.dump(prediction, f, ensure_ascii=False, indent=2)
+
+    print(f"[OK] ベースライン予測出力: {out_json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ネットワーク不要のベースライン予測")
+    parser.add_argument("csv_path", help="*_aiready.csv を指定")
+    args = parser.parse_args()
+
+    main(args.csv_path)
@@ -0,0 +1 @@
+# ステージ別ベンチマーク（python -m benchmarks.run）
@@ -0,0 +1,206 @@
+import html
+import os
+import random
+
+# ==============================
+# 合成レース日（ベンチマーク用）
+# ==============================
+# keibalab の横型馬柱を模した HTML を生成する。race_info_collect の解析が
+# 参照するセレクタ（umabanBox / bameiBox / umaboddsBox / jockeydata /
+# dbSeisekiData / zensouBox）をすべて含み、前走1〜5・成績 dict まで埋める。
+
+VENUE_CODES = {"05": "東京", "06": "中山", "09": "阪神", "08": "京都", "07": "中京"}
+
+SURFACES = ["芝", "ダ"]
+CONDITIONS = ["良", "稍", "重", "不"]
+WEATHERS = ["晴", "曇", "雨"]
+DISTANCES = {"芝": [1200, 1400, 1600, 1800, 2000, 2200, 2400], "ダ": [1200, 1400, 1700, 1800, 1900]}
+RACE_CLASSES = ["2歳未勝利", "2歳新馬", "3歳以上1勝クラス", "3歳以上2勝クラス", "3歳以上3勝クラス",
+                "リゲルS(L)", "ラピスラズリS", "チャレンジC(GⅢ)", "朝日杯FS(GⅠ)"]
+JOCKEYS = ["ルメール", "川田将雅", "戸崎圭太", "横山武史", "武豊", "松山弘平", "坂井瑠星", "岩田望来"]
+SIRES = ["キズナ", "エピファネイア", "ロードカナロア", "ドゥラメンテ", "モーリス", "キタサンブラック"]
+STYLE_MARKS = ["◀◀◁◁", "◁◀◀◁", "◁◁◀◀", "◀◁◁◁", "◁◁◁◀"]
+
+NUM_PREV = 5
+
+
+def _stats(rng: random.Random) -> list:
+    return [str(rng.randint(0, 4)), str(rng.randint(0, 3)), str(rng.randint(0, 3)), str(rng.randint(0, 12))]
+
+
+def make_horse(rng: random.Random, number: int, field_size: int, surface: str, condition: str) -> dict:
+    prevs = []
+    for i in range(NUM_PREV):
+        prev_surface = rng.choice(SURFACES)
+        prevs.append({
+            "rank": rng.randint(1, 18),
+            "date": f"2025/{rng.randint(1, 11)}/{rng.randint(1, 28)}",
+            "venue": rng.choice(list(VENUE_CODES.values())),
+            "surface": prev_surface,
+            "distance": rng.choice(DISTANCES[prev_surface]),
+            "race_name": rng.choice(RACE_CLASSES),
+            "corner": "".join(chr(0x2460 + rng.randint(0, 15)) for _ in range(2)),
+            "field_size": rng.randint(8, 18),
+            "horse_num": rng.randint(1, 18),
+            "popularity": rng.randint(1, 18),
+            "weather": rng.choice(WEATHERS),
+            "condition": rng.choice(CONDITIONS),
+            "time": f"1:{rng.randint(8, 59):02d}.{rng.randint(0, 9)}",
+            "agari": f"{rng.uniform(33.0, 40.0):.1f}",
+            "pace": rng.choice(["S", "M", "H"]),
+            "weight": rng.randint(420, 540),
+            "weight_diff": rng.choice(["+2", "-4", "0", "+8", "---"]),
+            "jockey": rng.choice(JOCKEYS),
+            "margin": f"{rng.uniform(-0.5, 3.0):.1f}",
+        })
+
+    return {
+        "wakuban": min(8, (number + 1) // 2),
+        "horse_number": number,
+        "horse_name": f"シンセティック{number:02d}",
+        "jockey": rng.choice(JOCKEYS),
+        "kinryou": rng.choice(["55.0", "56.0", "57.0", "58.0"]),
+        "sex_age": f"{rng.choice(['牡', '牝', 'セ'])}{rng.randint(2, 6)}",
+        "kankaku": f"中{rng.randint(1, 20)}週",
+        "style": rng.choice(STYLE_MARKS),
+        "popularity": rng.randint(1, field_size),
+        "odds": f"{rng.uniform(1.5, 150.0):.1f}",
+        "horse_weight": rng.randint(420, 540),
+        "weight_diff": rng.choice(["+2", "-4", "0", "+8"]),
+        "father": rng.choice(SIRES),
+        "mother": f"母{number:02d}",
+        "rates": [f"{rng.uniform(0, 30):.1f}%[{rng.randint(5, 300)}]" for _ in range(4)],
+        "dist_stats": {"当距離": _stats(rng), "前後": _stats(rng)},
+        "course_stats": {f"{surface}右": _stats(rng), f"{surface}左": _stats(rng)},
+        "surface_stats": {f"{surface}{c}": _stats(rng) for c in CONDITIONS},
+        "prevs": prevs,
+    }
+
+
+def make_day(venues: int = 3, races: int = 12, horses: int = 18, date_str: str = "20251207", seed: int = 0) -> list:
+    """venues × races のレース dict を返す（各レース horses 頭）"""
+    rng = random.Random(seed)
+    codes = list(VENUE_CODES)[:venues]
+    day = []
+    for code in codes:
+        for r in range(1, races + 1):
+            surface = rng.choice(SURFACES)
+            condition = rng.choice(CONDITIONS)
+            day.append({
+                "race_id": f"{date_str}{code}{r:02d}",
+                "race_number": f"{r}R",
+                "race_name": rng.choice(RACE_CLASSES),
+                "date_info": f"2025/12/7(日) 5回{VENUE_CODES[code]}2日目",
+                "weather": rng.choice(WEATHERS),
+                "track_condition": condition,
+                "surface": surface,
+                "distance": rng.choice(DISTANCES[surface]),
+                "headcount": horses,
+                "post_time": f"{9 + r}:{rng.choice(['05', '25', '45'])}",
+                "horses": [make_horse(rng, n, horses, surface, condition) for n in range(1, horses + 1)],
+            })
+            # 乱数列を変えないよう、馬 ID は開催場・R・馬番から決める
+            for h in day[-1]["horses"]:
+                h["horse_id"] = f"2019{code}{r:02d}{h['horse_number']:02d}"
+    return day
+
+
+# =========================
+# HTML レンダリング
+# =========================
+def _prev_html(p: dict) -> str:
+    return (
+        '<td class="zensouBox"><dl class="zensouDl">'
+        f"<dd>{p['rank']}</dd>"
+        f"<dd>{p['venue']} {p['date']} {p['surface']}{p['distance']} "
+        f"<span class=\"tL bold\">{html.escape(p['race_name'])}</span></dd>"
+        f"<dd><span>－－{p['corner']}</span>"
+        f"<span>{p['field_size']}頭 {p['horse_num']}番 {p['popularity']}人</span> "
+        f"{p['weather']} {p['condition']}</dd>"
+        f"<dd>{p['time']} {p['agari']} {p['pace']} {p['weight']}kg({p['weight_diff']})</dd>"
+        f"<dd>{p['jockey']} 57.0 相手馬({p['margin']})</dd>"
+        "</dl></td>"
+    )
+
+
+def _stats_table(stats: dict) -> str:
+    rows = "".join(
+        f"<tr><th>{k}</th>" + "".join(f"<td>{v}</td>" for v in vals) + "</tr>"
+        for k, vals in stats.items()
+    )
+    return f"<table>{rows}</table>"
+
+
+def _horse_html(h: dict) -> str:
+    labels = ["騎手", "馬番", "父馬", "コンビ"]
+    jockey_lines = "<br>".join(f"{label}：{rate}" for label, rate in zip(labels, h["rates"]))
+    style = "".join(f"<span>{ch}</span>" for ch in h["style"])
+    return (
+        "<tr>"
+        f'<td class="wakubanBox">{h["wakuban"]}</td>'
+        f'<td class="umabanBox">{h["horse_number"]}</td>'
+        '<td class="bameiBox">'
+        f'<div class="bamei3"><a href="/db/horse/{h["horse_id"]}/">{h["horse_name"]}</a></div>'
+        f'<div class="kisyu3"><a href="#">{h["jockey"]}</a> <span class="dbkinryou">({h["kinryou"]})</span></div>'
+        f'<div class="kisyu3">{h["sex_age"]} {h["kankaku"]}</div>'
+        f'<div class="dbrunstyle2yoko">{style}</div>'
+        f'<div class="chichi3"><a href="#">{h["father"]}</a></div><div class="haha4">{h["mother"]}</div>'
+        "</td>"
+        '<td class="umaboddsBox"><dl class="umaboddsDl">'
+        f'<dd>{h["popularity"]}人気</dd><dd>{h["odds"]}</dd>'
+        f'<dd>{h["horse_weight"]}kg</dd><dd>({h["weight_diff"]})</dd>'
+        "</dl></td>"
+        f'<td class="jockeydata">{jockey_lines}</td>'
+        '<td class="jockeydata dbSeisekiData">'
+        f'{_stats_table(h["dist_stats"])}{_stats_table(h["course_stats"])}{_stats_table(h["surface_stats"])}'
+        "</td>"
+        + "".join(_prev_html(p) for p in h["prevs"])
+        + "</tr>"
+    )
+
+
+def render_race_html(race: dict) -> str:
+    horses = "".join(_horse_html(h) for h in race["horses"])
+    return (
+        "<html><body>"
+        f'<div class="icoRacedata">{race["race_number"]}</div>'
+        f'<div class="racedatabox"><p class="bold">{race["date_info"]}</p></div>'
+        f'<h1 class="raceTitle">{html.escape(race["race_name"])}</h1>'
+        f'<div class="weather_ground"><ul><li>{race["weather"]}</li><li>{race["track_condition"]}</li></ul></div>'
+        f'<ul class="classCourseSyokin"><li>{race["surface"]}{race["distance"]}m {race["headcount"]}頭 '
+        f'{race["post_time"]}発走</li></ul>'
+        f'<table class="yokobashiraTable" summary="{html.escape(race["race_name"])}の横型馬柱">'
+        f"<tbody>{horses}</tbody></table>"
+        "</body></html>"
+    )
+
+
+def race_url(race: dict) -> str:
+    return f"https://keibalab.jp/db/race/{race['race_id']}/umabashira.html?kind=yoko"
+
+
+def make_predictions(race: dict, seed: int = 0) -> list:
+    """LLM 応答相当の（正規化前の）予測"""
+    rng = random.Random(f"{race['race_id']}:{seed}")
+    out = []
+    for h in race["horses"]:
+        win = rng.uniform(1, 30)
+        out.append({
+            "horse_number": h["horse_number"],
+            "horse_name": h["horse_name"],
+            "win_rate": round(win, 2),
+            "top2_rate": round(min(100.0, win * rng.uniform(1.6, 2.2)), 2),
+            "top3_rate": round(min(100.0, win * rng.uniform(2.2, 3.0)), 2),
+        })
+    return out
+
+
+def write_html(day: list, out_dir: str) -> list:
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for race in day:
+        path = os.path.join(out_dir, f"{race['race_id']}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(render_race_html(race))
+        paths.append(path)
+    return paths
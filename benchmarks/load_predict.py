@@ -0,0 +1,229 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.run import RESULTS_DIR, git_revision, prepare_context
+
+# ==============================
+# 予測スループットの負荷試験（OpenAI 代替サーバ使用）
+# ==============================
+# 使い方:
+#   python -m benchmarks.load_predict
+#   python -m benchmarks.load_predict --concurrency 1,4,8,16 --latency lognormal:6,0.6 --rate-limit-rate 0.05
+#   python -m benchmarks.load_predict --stream --malformed-rate 0.1 --max-retries 1 --hedge-after 8
+#   python -m benchmarks.load_predict --base-url http://127.0.0.1:8766/v1   # 起動済みの mock_openai_server.py
+#
+# 合成した1日分の aiready CSV に対し、predict_race_ai.main を N レース同時に実行して
+# スループット（レース/秒）とレース単位の所要時間の分位点を並列度ごとに報告する。
+# LLM は mock_openai_server.py（既定ではこのプロセス内で起動）で代替し、実 API には一切アクセスしない。
+# 再試行・ヘッジ回数は metrics.py のカウンタ、500 / 429 / 出力破損の件数はサーバ側の集計から取る。
+
+DEFAULT_CONCURRENCY = "1,4,8"
+
+
+def percentile(values: list, q: float) -> float:
+    """線形補間の分位点（q は 0〜1）"""
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def _predict_one(path: str, args, policy, histograms) -> tuple:
+    import predict_race_ai
+
+    start = time.monotonic()
+    try:
+        predict_race_ai.main(path, args.model, stream=args.stream, fallback=args.fallback,
+                             placement=args.placement, policy=policy, histograms=histograms)
+        error = None
+    except Exception as e:
+        error = type(e).__name__
+    return time.monotonic() - start, error
+
+
+def run_level(paths: list, concurrency: int, args, server_stats) -> dict:
+    """並列度 concurrency で全レースを1回ずつ予測し、結果をまとめる"""
+    import metrics
+    from request_policy import RequestPolicy, load_histograms
+
+    policy = RequestPolicy(
+        deadline_seconds=args.deadline,
+        hedge_after_seconds=args.hedge_after,
+        max_hedges=args.max_hedges,
+        max_retries=args.max_retries,
+    )
+    # 並列度ごとに空の履歴から始める（ヘッジ閾値が前の水準の結果に引きずられないように）
+    histograms = load_histograms(None)
+    before = server_stats(reset=True)
+    retries0 = metrics.value("keiba_llm_retries_total")
+    hedges0 = metrics.value("keiba_llm_hedges_total")
+
+    out = io.StringIO() if not args.verbose else None
+    start = time.monotonic()
+    with contextlib.redirect_stdout(out) if out else contextlib.nullcontext():
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="race") as pool:
+            results = list(pool.map(lambda p: _predict_one(p, args, policy, histograms), paths))
+    wall = time.monotonic() - start
+
+    server = server_stats(reset=False, since=before)
+    latencies = [t for t, _ in results]
+    ok = [t for t, e in results if e is None]
+    errors = {}
+    for _, e in results:
+        if e is not None:
+            errors[e] = errors.get(e, 0) + 1
+
+    return {
+        "concurrency": concurrency,
+        "races": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 4) if wall else 0.0,
+        "latency_s": {
+            "mean": round(statistics.mean(latencies), 3) if latencies else None,
+            "p50": round(percentile(latencies, 0.5), 3),
+            "p90": round(percentile(latencies, 0.9), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(max(latencies), 3) if latencies else None,
+        },
+        "retries": metrics.value("keiba_llm_retries_total") - retries0,
+        "hedges": metrics.value("keiba_llm_hedges_total") - hedges0,
+        "server": server,
+    }
+
+
+def format_level(r: dict) -> str:
+    lat = r["latency_s"]
+    s = r["server"]
+    errors = ", ".join(f"{k} {v}" for k, v in sorted(r["errors"].items())) or "なし"
+    return (
+        f"  並列 {r['concurrency']:3d}: {r['ok']}/{r['races']} 成功 / {r['wall_s']:.1f}s / "
+        f"{r['throughput_rps']:.2f} レース/秒 / p50 {lat['p50']:.2f}s p90 {lat['p90']:.2f}s "
+        f"p99 {lat['p99']:.2f}s max {lat['max']:.2f}s\n"
+        f"           再試行 {r['retries']:g} / ヘッジ {r['hedges']:g} / 失敗: {errors}\n"
+        f"           サーバ: リクエスト {s.get('requests', '?')} / 429 {s.get('rate_limited', '?')} / "
+        f"500 {s.get('server_error', '?')} / 破損 {s.get('malformed', '?')} / 切断 {s.get('disconnected', '?')} / "
+        f"最大同時 {s.get('max_inflight', '?')}"
+    )
+
+
+def _server_stats_fn(state=None, base_url: str = None):
+    """(reset, since) → サーバ集計。外部サーバは /stats の差分で代用する"""
+    if state is not None:
+        def stats(reset: bool = False, since: dict = None):
+            if reset:
+                state.reset()
+            return state.stats()
+        return stats
+
+    import urllib.request
+
+    url = base_url.rstrip("/").rsplit("/v1", 1)[0] + "/stats"
+
+    def stats(reset: bool = False, since: dict = None):
+        try:
+            with urllib.request.urlopen(url, timeout=5) as r:
+                now = json.load(r)
+        except OSError:
+            return {}
+        if since:
+            now = {k: v - since.get(k, 0) if isinstance(v, (int, float)) and k not in ("inflight", "max_inflight")
+                   else v for k, v in now.items()}
+        return now
+
+    return stats
+
+
+def main(argv=None):
+    import mock_openai_server
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load_predict",
+                                     description="OpenAI 代替サーバを使った予測スループットの負荷試験")
+    parser.add_argument("--venues", type=int, default=3)
+    parser.add_argument("--races", type=int, default=12)
+    parser.add_argument("--horses", type=int, default=16)
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY, help="カンマ区切りの並列度（順に計測）")
+    parser.add_argument("--model", default="gpt-4.1-mini")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--fallback", action="store_true", help="失敗時にベースライン予測で代替（成功として数える）")
+    parser.add_argument("--placement", default="independent")
+    parser.add_argument("--deadline", type=float, default=60.0)
+    parser.add_argument("--hedge-after", type=float, default=None, help="ヘッジまでの秒数（既定: 履歴の分位点）")
+    parser.add_argument("--max-hedges", type=int, default=1)
+    parser.add_argument("--max-retries", type=int, default=2)
+    parser.add_argument("--base-url", default=None, help="起動済みの代替サーバ（既定: このプロセス内で起動）")
+    parser.add_argument("--out", default=None, help="既定: benchmarks/results/load_YYYYMMDD_HHMMSS.json")
+    parser.add_argument("--verbose", action="store_true", help="predict_race_ai の出力をそのまま表示")
+    mock_openai_server.add_arguments(parser)
+    parser.set_defaults(latency="lognormal:2,0.5")
+    args = parser.parse_args(argv)
+
+    try:
+        levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+        config = mock_openai_server.config_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url
+        server_stats = _server_stats_fn(base_url=base_url)
+    else:
+        server, state = mock_openai_server.start_server(**config)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        server_stats = _server_stats_fn(state=state)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+    n = args.venues * args.races
+    print(f"=== 負荷試験: {n} レース × {args.horses}頭 / 並列 {levels} / {base_url} ===")
+    print(f"    応答 {args.latency} / 500 {args.error_rate:g} / 429 {args.rate_limit_rate:g} / "
+          f"破損 {args.malformed_rate:g} / stream={args.stream} / 締切 {args.deadline:g}s / 再試行 {args.max_retries}")
+
+    results = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "fixture": {"venues": args.venues, "races": args.races, "horses": args.horses},
+            "server": config if server else {"base_url": base_url},
+            "policy": {"deadline": args.deadline, "hedge_after": args.hedge_after,
+                       "max_hedges": args.max_hedges, "max_retries": args.max_retries},
+            "stream": args.stream,
+            "fallback": args.fallback,
+        },
+        "levels": [],
+    }
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="keiba_load_") as work_dir:
+            paths = prepare_context(args.venues, args.races, args.horses, 1, work_dir)["aiready"]
+            for c in levels:
+                r = run_level(paths, c, args, server_stats)
+                results["levels"].append(r)
+                print(format_level(r))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    out_path = args.out or os.path.join(RESULTS_DIR, f"load_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"[OK] 結果: {out_path}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
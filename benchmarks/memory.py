@@ -0,0 +1,146 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.fixtures import make_day, race_url, render_race_html
+from benchmarks.run import RESULTS_DIR, git_revision
+
+# ==============================
+# 馬1頭あたりのメモリ使用量
+# ==============================
+# 使い方:
+#   python -m benchmarks.memory
+#   python -m benchmarks.memory --days 5 --out benchmarks/results/memory.json
+#
+# before: 従来の表現（前走を prev{i}_* に展開した行 dict と、それを pandas に渡した DataFrame）
+# after : race_records（__slots__ 付き Horse / PrevRun + 文字列の intern、category / downcast 済み DataFrame）
+# 合成日を days 日分解析し、レコード保持時（tracemalloc）と DataFrame（memory_usage(deep=True)）を比較する。
+
+
+def _fresh(v):
+    """HTML 解析で毎回作られる文字列を再現する（intern 済みの共有を外す）"""
+    if isinstance(v, str):
+        return v.encode("utf-8").decode("utf-8")
+    if isinstance(v, dict):
+        return {_fresh(k): [_fresh(x) for x in vals] for k, vals in v.items()}
+    if isinstance(v, tuple):
+        return [_fresh(x) for x in v]
+    return v
+
+
+def legacy_row(horse) -> dict:
+    """変更前の parse_and_save_race が作っていた 1 頭分の dict"""
+    from race_records import HORSE_FIELDS, PREV_FIELDS
+
+    row = {name: _fresh(getattr(horse, name)) for name in HORSE_FIELDS}
+    for i, prev in enumerate(horse.prevs, start=1):
+        for name in PREV_FIELDS:
+            row[f"prev{i}_{name}"] = _fresh(getattr(prev, name))
+    return row
+
+
+def compact_record(horse):
+    """HTML から作り直した場合と同じく、新しい文字列から Horse を組み立てる"""
+    from race_records import HORSE_FIELDS, PREV_FIELDS, Horse, PrevRun
+
+    prevs = tuple(
+        PrevRun(**{name: _fresh(getattr(p, name)) if name != "corner_order" else tuple(_fresh(p.corner_order))
+                   for name in PREV_FIELDS})
+        for p in horse.prevs
+    )
+    return Horse(**{name: _fresh(getattr(horse, name)) for name in HORSE_FIELDS}, prevs=prevs)
+
+
+def traced_bytes(build) -> tuple:
+    """build() の戻り値を保持したままの確保量（バイト）"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        obj = build()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return obj, used
+
+
+def parse_days(days: int, venues: int, races: int, horses: int) -> list:
+    import race_info_collect
+
+    parsed = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for d in range(days):
+            for race in make_day(venues, races, horses, seed=d):
+                _, _, records, _ = race_info_collect.parse_race(render_race_html(race), race_url(race))
+                parsed.extend(records)
+    return parsed
+
+
+def measure(days: int, venues: int, races: int, horses: int) -> dict:
+    import pandas as pd
+
+    from race_records import horses_to_frame
+
+    source = parse_days(days, venues, races, horses)
+    n = len(source)
+
+    rows, rows_bytes = traced_bytes(lambda: [legacy_row(h) for h in source])
+    records, records_bytes = traced_bytes(lambda: [compact_record(h) for h in source])
+
+    frame_before = pd.DataFrame(rows)
+    frame_after = horses_to_frame(records)
+    frame_before_bytes = int(frame_before.memory_usage(deep=True).sum())
+    frame_after_bytes = int(frame_after.memory_usage(deep=True).sum())
+
+    def per_horse(b):
+        return round(b / n, 1)
+
+    return {
+        "horses": n,
+        "records": {
+            "before_bytes_per_horse": per_horse(rows_bytes),
+            "after_bytes_per_horse": per_horse(records_bytes),
+            "ratio": round(records_bytes / rows_bytes, 3),
+        },
+        "frame": {
+            "before_bytes_per_horse": per_horse(frame_before_bytes),
+            "after_bytes_per_horse": per_horse(frame_after_bytes),
+            "ratio": round(frame_after_bytes / frame_before_bytes, 3),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.memory", description="馬1頭あたりのメモリ使用量")
+    parser.add_argument("--days", type=int, default=3, help="合成日数（多いほど category 化の効果が出る）")
+    parser.add_argument("--venues", type=int, default=3)
+    parser.add_argument("--races", type=int, default=12)
+    parser.add_argument("--horses", type=int, default=18)
+    parser.add_argument("--out", default=None, help="既定: benchmarks/results/memory_YYYYMMDD_HHMMSS.json")
+    args = parser.parse_args(argv)
+
+    print(f"=== メモリ: {args.days}日 × {args.venues}場 × {args.races}R × {args.horses}頭 ===")
+    result = measure(args.days, args.venues, args.races, args.horses)
+    for key, label in (("records", "レコード"), ("frame", "DataFrame")):
+        r = result[key]
+        print(f"  {label:<10} {r['before_bytes_per_horse']:9.1f} → {r['after_bytes_per_horse']:9.1f} B/頭  "
+              f"(x{r['ratio']:.2f})")
+
+    result["meta"] = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "fixture": {"days": args.days, "venues": args.venues, "races": args.races, "horses": args.horses},
+    }
+    out_path = args.out or os.path.join(RESULTS_DIR, f"memory_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"[OK] ベンチマーク結果出力: {out_path}")
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.fixtures import make_day, make_predictions, race_url, render_race_html
+
+# ==============================
+# ステージ別ベンチマーク
+# ==============================
+# 使い方:
+#   python -m benchmarks.run
+#   python -m benchmarks.run --venues 3 --races 12 --horses 18 --repeat 5
+#   python -m benchmarks.run --stages prepare,prompt --compare benchmarks/results/20251207_101500.json
+#
+# 合成した1日分（既定: 3場 × 12R × 18頭）で各ステージを計測し、結果を JSON で保存する。
+# ネットワーク（Selenium / OpenAI / Discord）には一切アクセスしない。
+
+# 既定の出力先（.gitignore 済み。--out で任意の場所に出せる）
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+DEFAULT_REPEAT = 5
+
+
+# =========================
+# ステージ
+# =========================
+# 各ステージは setup(ctx) → 計測対象の関数 を返す。setup の処理時間は計測しない。
+
+def stage_parse(ctx):
+    """新聞 HTML の解析と _data.csv / _common.csv の保存（collect_and_format_race_data の取得後の処理）"""
+    import race_info_collect
+
+    pages = [(render_race_html(race), race_url(race)) for race in ctx["day"]]
+    out_dir = os.path.join(ctx["work_dir"], "parse")
+
+    def run():
+        for content, url in pages:
+            race_info_collect.parse_and_save_race(content, url, out_dir)
+        return len(pages)
+
+    return run
+
+
+def stage_prepare(ctx):
+    import prepare_ai_input
+
+    pairs = ctx["pairs"]
+    out_dir = os.path.join(ctx["work_dir"], "prepare")
+
+    def run():
+        for data_path, common_path in pairs:
+            out = os.path.join(out_dir, os.path.basename(data_path).replace("_data.csv", "_aiready.csv"))
+            prepare_ai_input.make_ai_ready_csv(data_path, common_path, out)
+        return len(pairs)
+
+    return run
+
+
+def stage_prompt(ctx):
+    """aiready CSV 読込 → split_common_and_horses → build_prompt"""
+    import predict_race_ai
+
+    paths = ctx["aiready"]
+
+    def run():
+        for path in paths:
+            common_info, horses = predict_race_ai.split_common_and_horses(predict_race_ai.load_csv(path))
+            predict_race_ai.build_prompt(common_info, horses)
+        return len(paths)
+
+    return run
+
+
+def _normalize_stage(placement):
+    def setup(ctx):
+        import predict_race_ai
+
+        # LLM 応答と同じ構造化配列で渡す
+        base = [predict_race_ai.to_prediction_array(make_predictions(race)) for race in ctx["day"]]
+        batches = [[p.copy() for p in base] for _ in range(ctx["repeat"] + 1)]
+
+        def run():
+            # normalize_rates は配列をその場で書き換えるため、試行ごとに別のコピーを使う
+            predictions = batches.pop()
+            for prediction in predictions:
+                predict_race_ai.normalize_rates(prediction, placement)
+            return len(predictions)
+
+        return run
+
+    setup.__doc__ = f"normalize_rates(placement={placement})"
+    return setup
+
+
+def stage_discord(ctx):
+    import notify_discord
+
+    races = []
+    for race in ctx["day"]:
+        common = {"date_info": race["date_info"], "race_title": race["race_name"]}
+        predictions = sorted(make_predictions(race), key=lambda x: x["win_rate"], reverse=True)
+        races.append((common, race["race_number"], predictions))
+
+    def run():
+        for common, race_number, predictions in races:
+            notify_discord.build_discord_message(common, race_number, predictions)
+        return len(races)
+
+    return run
+
+
+STAGES = {
+    "parse": stage_parse,
+    "prepare": stage_prepare,
+    "prompt": stage_prompt,
+    "normalize": _normalize_stage("independent"),
+    "normalize_harville": _normalize_stage("harville"),
+    "discord": stage_discord,
+}
+
+
+# =========================
+# 計測
+# =========================
+def prepare_context(venues: int, races: int, horses: int, repeat: int, work_dir: str) -> dict:
+    """後段のステージが使う _data.csv / _aiready.csv を一度だけ作っておく"""
+    import prepare_ai_input
+    import race_info_collect
+
+    day = make_day(venues, races, horses)
+    fixture_dir = os.path.join(work_dir, "fixture")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        pairs = [race_info_collect.parse_and_save_race(render_race_html(r), race_url(r), fixture_dir) for r in day]
+        for data_path, common_path in pairs:
+            prepare_ai_input.make_ai_ready_csv(data_path, common_path, data_path.replace("_data.csv", "_aiready.csv"))
+
+    return {
+        "day": day,
+        "repeat": repeat,
+        "work_dir": work_dir,
+        "pairs": pairs,
+        "aiready": sorted(glob.glob(os.path.join(fixture_dir, "*_aiready.csv"))),
+    }
+
+
+def time_stage(setup, ctx: dict, repeat: int) -> dict:
+    run = setup(ctx)
+    times = []
+    items = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()  # ウォームアップ（遅延 import・ファイルキャッシュ）
+        for _ in range(repeat):
+            start = time.perf_counter()
+            items = run()
+            times.append(time.perf_counter() - start)
+
+    median = statistics.median(times)
+    return {
+        "items": items,
+        "repeat": repeat,
+        "median_s": round(median, 6),
+        "min_s": round(min(times), 6),
+        "max_s": round(max(times), 6),
+        "per_item_ms": round(median / max(items, 1) * 1000, 4),
+    }
+
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_benchmarks(stages: list, venues: int, races: int, horses: int, repeat: int) -> dict:
+    results = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fixture": {"venues": venues, "races": races, "horses": horses},
+            "repeat": repeat,
+        },
+        "stages": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="keiba_bench_") as work_dir:
+        ctx = prepare_context(venues, races, horses, repeat, work_dir)
+        for name in stages:
+            results["stages"][name] = time_stage(STAGES[name], ctx, repeat)
+            r = results["stages"][name]
+            print(f"  {name:<20} {r['median_s'] * 1000:9.1f} ms  ({r['per_item_ms']:.3f} ms/レース)")
+    return results
+
+
+def compare(current: dict, previous: dict) -> str:
+    lines = [f"=== 比較: {previous['meta'].get('git', '?')} → {current['meta'].get('git', '?')} ==="]
+    for name, r in current["stages"].items():
+        before = previous.get("stages", {}).get(name)
+        if not before:
+            lines.append(f"  {name:<20} (比較対象なし)")
+            continue
+        ratio = r["median_s"] / before["median_s"] if before["median_s"] else float("inf")
+        lines.append(f"  {name:<20} {before['median_s'] * 1000:9.1f} → {r['median_s'] * 1000:9.1f} ms  (x{ratio:.2f})")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="ステージ別ベンチマーク")
+    parser.add_argument("--venues", type=int, default=3)
+    parser.add_argument("--races", type=int, default=12)
+    parser.add_argument("--horses", type=int, default=18)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"カンマ区切り（{', '.join(STAGES)}）")
+    parser.add_argument("--out", default=None, help="既定: benchmarks/results/YYYYMMDD_HHMMSS.json")
+    parser.add_argument("--compare", default=None, help="過去の結果 JSON と比較")
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"未対応のステージ: {', '.join(unknown)}")
+
+    print(f"=== ベンチマーク: {args.venues}場 × {args.races}R × {args.horses}頭 / repeat={args.repeat} ===")
+    results = run_benchmarks(stages, args.venues, args.races, args.horses, args.repeat)
+
+    out_path = args.out or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"[OK] ベンチマーク結果出力: {out_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print(compare(results, json.load(f)))
+    return results
+
+
+if __name__ == "__main__":
+    main()
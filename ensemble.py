@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# =========================
+# 設定
+# =========================
+POOL_METHODS = ("mean", "logpool")
+
+_EPS = 1e-6
+
+
+# =========================
+# メンバー指定の解析
+# =========================
+def parse_members(spec: str) -> list:
+    """
+    "gpt-5.2,gpt-4.1-mini@0.9,gpt-4.1-mini@0.9" → [(model, temperature), ...]
+    温度省略時は None（build_request の既定値を使用）。同じ指定を並べると複数サンプルになる。
+    """
+    members = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        model, _, temp = item.partition("@")
+        members.append((model, float(temp) if temp else None))
+    if not members:
+        raise ValueError(f"アンサンブルのメンバーが空です: {spec!r}")
+    return members
+
+
+def member_label(model: str, temperature) -> str:
+    return model if temperature is None else f"{model}@{temperature:g}"
+
+
+# =========================
+# 並列問い合わせ
+# =========================
+def run_members(ask, members: list) -> list:
+    """
+    ask(model, temperature) を全メンバー同時に実行する。
+    所要時間は最も遅いメンバー分のみ。失敗したメンバーは error を記録して続行する。
+    """
+    results = [None] * len(members)
+
+    def run(i):
+        model, temperature = members[i]
+        try:
+            results[i] = {"prediction": ask(model, temperature)}
+        except Exception as e:
+            print(f"[WARN] {member_label(model, temperature)} 失敗: {e}")
+            results[i] = {"error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=len(members)) as pool:
+        list(pool.map(run, range(len(members))))
+
+    out = []
+    for (model, temperature), r in zip(members, results):
+        out.append({"model": model, "temperature": temperature, **r})
+    return out
+
+
+# =========================
+# 集約（ベクトル化）
+# =========================
+def stack_predictions(predictions: list, horse_numbers: list) -> np.ndarray:
+    """(メンバー数, 頭数, 3) の確率配列に変換。列ごとに合計 1 へ正規化する"""
+    index = {n: i for i, n in enumerate(horse_numbers)}
+    rates = np.zeros((len(predictions), len(horse_numbers), 3))
+
+    for m, prediction in enumerate(predictions):
+        for p in prediction:
+            i = index.get(int(p["horse_number"]))
+            if i is not None:
+                rates[m, i] = (p["win_rate"], p["top2_rate"], p["top3_rate"])
+
+    total = rates.sum(axis=1, keepdims=True)
+    return np.divide(rates, total, out=np.zeros_like(rates), where=total > 0)
+
+
+def aggregate(probs: np.ndarray, method: str = "mean") -> np.ndarray:
+    """メンバー軸を集約し (頭数, 3) の [勝率, 連対率, 3着内率]（%）を返す"""
+    if method not in POOL_METHODS:
+        raise ValueError(f"未対応の集約方法: {method}")
+
+    if method == "mean":
+        pooled = probs.mean(axis=0)
+    else:
+        # log-opinion pool: 確率の幾何平均を正規化
+        pooled = np.exp(np.log(np.clip(probs, _EPS, None)).mean(axis=0))
+        pooled /= pooled.sum(axis=0, keepdims=True)
+
+    rates = pooled * np.array([100.0, 200.0, 300.0])
+    rates = np.minimum(rates, 100.0)
+    rates[:, 1] = np.maximum(rates[:, 1], rates[:, 0])
+    rates[:, 2] = np.maximum(rates[:, 2], rates[:, 1])
+    return rates
+
+
+def combine(members: list, horses: list, method: str = "mean") -> list:
+    ok = [m["prediction"] for m in members if "prediction" in m]
+    if not ok:
+        raise RuntimeError("アンサンブルの全メンバーが失敗しました")
+
+    horse_numbers = [int(h["horse_number"]) for h in horses]
+    rates = aggregate(stack_predictions(ok, horse_numbers), method)
+
+    combined = []
+    for h, row in zip(horses, rates):
+        combined.append({
+            "horse_number": int(h["horse_number"]),
+            "horse_name": h.get("horse_name", ""),
+            "win_rate": round(float(row[0]), 2),
+            "top2_rate": round(float(row[1]), 2),
+            "top3_rate": round(float(row[2]), 2),
+        })
+    return combined
@@ -0,0 +1,284 @@
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+# ==============================
+# 特徴量レジストリ
+# ==============================
+# aiready CSV の各列を「元の列・型・新馬戦で出すか・列単位の変換（カーネル）」として宣言し、
+# 起動時に1度だけ列プラン（FeaturePlan）へまとめる。
+#   prepare_ai_input.make_ai_ready_csv : PLAN.apply で _data.csv / _common.csv → aiready
+#   predict_race_ai.split_common_and_horses : PLAN.race_columns と normalize_distance
+# カーネルは pandas の列演算で書き、馬ごとの Python ループは持たない
+# （レース名の格付けのような文字列の対応表は、重複を除いた値ごとに1回だけ計算する）。
+# pandas は使う関数の中で import する。
+
+NUM_PREV = 3
+
+PREV_ITEMS = ["rank", "margin", "agari", "distance", "condition", "weather", "pace", "field_size"]
+
+STAT_KINDS = ["win", "place2", "place3", "other"]
+
+# horse_history.py が *_career.csv に書き出す通算成績
+CAREER_COLUMNS = [
+    "career_runs", "career_wins", "career_top3_rate", "career_avg_rank",
+    "career_surface_runs", "career_surface_top3_rate",
+    "career_dist_runs", "career_dist_top3_rate",
+    "career_agari_avg5", "career_days_since_last",
+]
+
+
+# =========================
+# 共通の値変換
+# =========================
+GRADE_SCORES = [
+    (("GⅠ", "G1", "ＧⅠ"), 1.00),
+    (("GⅡ", "G2", "ＧⅡ"), 0.8),
+    (("GⅢ", "G3", "ＧⅢ"), 0.6),
+    (("(L)", "（L）", "OP", "オープン"), 0.4),
+    (("3勝",), 0.35),
+    (("2勝",), 0.3),
+    (("1勝",), 0.12),
+    (("新馬",), 0.08),
+    (("未勝利",), 0.05),
+]
+
+# 上記のどれにも当たらない名前付きのレース（特別戦・重賞以外のオープン等）
+DEFAULT_GRADE_SCORE = 0.4
+
+
+def grade_to_score(title):
+    """レース名（「チャレンジC(GⅢ)」「3歳以上2勝クラス」など）→ 格付けスコア。名前がなければ None"""
+    if not isinstance(title, str) or not title.strip():
+        return None
+    for marks, score in GRADE_SCORES:
+        if any(m in title for m in marks):
+            return score
+    return DEFAULT_GRADE_SCORE
+
+
+def normalize_distance(v):
+    """18 → 1800 のような百m単位の距離を m に直す（数値にできなければそのまま）"""
+    if v is None or v != v:
+        return v
+    try:
+        v = int(float(v))
+        if v < 100:
+            return v * 100
+        return v
+    except Exception:
+        return v
+
+
+# =========================
+# カーネル（列単位）
+# =========================
+def _numeric(s):
+    import pandas as pd
+
+    if s.dtype.kind in "iuf":
+        return s
+    return pd.to_numeric(s, errors="coerce")
+
+
+def _percent(s):
+    """"24.5%" → 24.5（数字がなければ NaN）"""
+    return _numeric(s.astype("string").str.extract(r"([\d\.]+)", expand=False))
+
+
+def _distance_m(s):
+    import numpy as np
+    import pandas as pd
+
+    d = _numeric(s).to_numpy(dtype=float, na_value=np.nan)
+    return pd.Series(np.where(d < 100, d * 100, d), index=s.index)
+
+
+def as_dtype(s, dtype: str):
+    """宣言された型にそろえる。int は整数値だけなら欠損対応の Int64、小数を含めば float のまま"""
+    import numpy as np
+
+    if dtype == "str":
+        return s
+    s = _numeric(s)
+    if dtype == "int" and s.dtype.kind == "f":
+        v = s.to_numpy()
+        if np.all(np.isnan(v) | (v % 1 == 0)):
+            return s.astype("Int64")
+    return s
+
+
+def _grade(s):
+    """重複を除いた値ごとに grade_to_score を1回だけ呼ぶ"""
+    values = s.astype("string")
+    scores = {v: grade_to_score(v) for v in values.dropna().unique()}
+    return _numeric(values.map(scores))
+
+
+def _stats_pattern(key_regex: str):
+    """
+    "{'当距離': ['0', '3', '0', '5'], ...}" から key_regex に合う最初のキーの4値を取り出す正規表現。
+    値は数字に限らずそのまま取り出し（"-" など）、数値への変換は列ごとに行う。
+    """
+    return re.compile(r"'" + key_regex + r"':\s*\['([^']*)',\s*'([^']*)',\s*'([^']*)',\s*'([^']*)'\]")
+
+
+def _extract_stats(s, *patterns):
+    """
+    patterns を順に試し、最初に当たったキーの (勝, 2着, 3着, 着外) を4列で返す（Int64 化は dtype="int" で行う）。
+    dict の文字列表現を ast で読み直さず、正規表現で列ごとに一括抽出する。
+    キーが当たれば値が数字でなくてもそのキーを採用し、読めない値だけを欠損にする。
+    """
+    text = s.astype("string")
+    out = None
+    for pattern in patterns:
+        found = text.str.extract(pattern)
+        out = found if out is None else out.fillna(found)
+        if not out[0].isna().any():
+            break
+    return [_numeric(out[i]) for i in range(4)]
+
+
+def _dist_stats(df, race):
+    return _extract_stats(df["dist_stats"], _stats_pattern(r"[^']*当[^']*"))
+
+
+def _course_stats(df, race):
+    # 右回りの成績を優先し、なければ左回り、それもなければ最初のキー
+    return _extract_stats(
+        df["course_stats"],
+        _stats_pattern(r"[^']*右[^']*"),
+        _stats_pattern(r"[^']*左[^']*"),
+        _stats_pattern(r"[^']*"),
+    )
+
+
+def _surface_stats(df, race):
+    key = f"{race.get('surface', '')}{race.get('track_condition', '')}"
+    return _extract_stats(df["surface_stats"], _stats_pattern(re.escape(key)))
+
+
+# =========================
+# 宣言
+# =========================
+@dataclass(frozen=True, slots=True)
+class Feature:
+    """
+    names   : 出力列（複数列を返すカーネルは複数）
+    sources : 入力列。1つでも欠けていればこの特徴は出力しない
+    kernel  : (DataFrame, レース共通情報 dict) → 列（names が複数なら列の list）。None はそのまま
+    dtype   : "float" / "int"（数値に変換、読めない値は欠損）/ "str"（元の文字列のまま）
+    shinma  : 新馬戦でも出力するか（前走がないため成績系は出さない）
+    scope   : "horse"（馬ごと）/ "race"（レース共通情報を全馬に複製）
+    """
+    names: tuple
+    sources: tuple
+    kernel: Callable = None
+    dtype: str = "float"
+    shinma: bool = True
+    scope: str = "horse"
+
+
+def passthrough(name: str, dtype: str = "str", shinma: bool = True) -> Feature:
+    return Feature((name,), (name,), None, dtype, shinma)
+
+
+def _column(col: str, fn):
+    return lambda df, race: fn(df[col])
+
+
+def _registry() -> list:
+    features = [
+        passthrough("horse_number", "int"),
+        passthrough("horse_name"),
+        passthrough("sex_age"),
+        passthrough("running_style_score_0to1", "float", shinma=False),
+        passthrough("horse_weight", "int"),
+        passthrough("weight_diff", "int", shinma=False),
+        passthrough("kankaku", shinma=False),
+    ]
+
+    for col in ["jockey_course_win_rate", "horse_num_course_win_rate",
+                "father_course_win_rate", "trainer_jockey_win_rate"]:
+        features.append(Feature((col,), (col,), _column(col, _percent)))
+
+    for i in range(1, NUM_PREV + 1):
+        for item in PREV_ITEMS:
+            col = f"prev{i}_{item}"
+            if item == "distance":
+                features.append(Feature((col,), (col,), _column(col, _distance_m), "int"))
+            elif item in ("rank", "condition", "weather", "pace"):
+                # 着順は「取消」「中止」などの文字も残す
+                features.append(passthrough(col))
+            else:
+                features.append(passthrough(col, "float"))
+
+    # 前走の格付けはレース名から（predict 側の race_grade と同じ対応表）
+    for i in range(1, NUM_PREV + 1):
+        features.append(Feature((f"prev{i}_grade",), (f"prev{i}_race_name",),
+                                _column(f"prev{i}_race_name", _grade)))
+
+    for prefix, source, kernel in (("dist", "dist_stats", _dist_stats),
+                                   ("course", "course_stats", _course_stats),
+                                   ("surface", "surface_stats", _surface_stats)):
+        features.append(Feature(tuple(f"{prefix}_{k}" for k in STAT_KINDS), (source,), kernel, "int", shinma=False))
+
+    # horse_history.py の通算成績（*_career.csv を結合した場合のみ存在）
+    features.extend(passthrough(col, "float") for col in CAREER_COLUMNS)
+
+    for col in ["date_info", "race_title", "weather", "track_condition", "surface", "distance"]:
+        features.append(Feature((col,), (col,), None, "str", scope="race"))
+
+    return features
+
+
+# =========================
+# 列プラン
+# =========================
+class FeaturePlan:
+    def __init__(self, features: list):
+        self.features = features
+        self.horse_features = [f for f in features if f.scope == "horse"]
+        self.race_features = [f for f in features if f.scope == "race"]
+        self.race_columns = [f.names[0] for f in self.race_features]
+        # _data.csv から読む必要のある列（read_csv の usecols に渡す）
+        self.horse_sources = {s for f in self.horse_features for s in f.sources}
+        self.shinma_excluded = {n for f in features if not f.shinma for n in f.names}
+
+    def apply(self, df, common: dict):
+        """馬ごとの DataFrame と共通情報から aiready の DataFrame を作る"""
+        import pandas as pd
+
+        # 新馬戦で出さない列は計算もしない
+        skip = self.shinma_excluded if "新馬" in str(common.get("race_title", "")) else set()
+
+        columns = {}
+        for f in self.horse_features:
+            if not all(s in df.columns for s in f.sources) or all(n in skip for n in f.names):
+                continue
+            values = df[f.sources[0]] if f.kernel is None else f.kernel(df, common)
+            if len(f.names) == 1:
+                values = [values]
+            for name, v in zip(f.names, values):
+                v = as_dtype(v if isinstance(v, pd.Series) else pd.Series(v, index=df.index), f.dtype)
+                if name not in skip and not _is_blank(v):
+                    columns[name] = v
+
+        for f in self.race_features:
+            name = f.names[0]
+            value = common.get(name)
+            if not (value is None or value != value or value == ""):
+                columns[name] = pd.Series([value] * len(df), index=df.index, dtype=object)
+
+        return pd.DataFrame(columns, index=df.index)
+
+
+def _is_blank(s) -> bool:
+    """全欠損（NaN または空文字）の列は出さない"""
+    missing = s.isna()
+    if s.dtype.kind == "O":  # object / str / string
+        missing |= s.eq("")
+    return bool(missing.all())
+
+
+PLAN = FeaturePlan(_registry())
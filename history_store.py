@@ -0,0 +1,333 @@
+import argparse
+import glob
+import os
+import re
+
+# ==============================
+# 列指向の履歴ストア（Arrow IPC / メモリマップ）
+# ==============================
+# 使い方:
+#   python history_store.py ingest race_data_20251207 race_data_20251214
+#   python history_store.py ingest --root . --start 20250101 --end 20251231
+#   python history_store.py info --start 20251201 --end 20251231 --venue 06
+#   python history_store.py check          # 型の異なるパーティションをまとめて読めるかの確認
+#
+# prepare_ai_input.make_ai_ready_csv の出力（*_aiready.csv）を、開催日 × 開催場ごとに
+# 1つの Arrow IPC ファイルへまとめる。
+#   history/date=YYYYMMDD/venue=CC/data.arrow   （CC は COURSE_CODE_MAP のキー）
+# 日付・開催場はディレクトリ名で絞り込むためファイルを開かない。読み込みはメモリマップで、
+# 参照した列のバッファだけがページインされる（数値列は NaN 埋めの float32 で、numpy へゼロコピー）。
+# 列の型は feature_registry.PLAN の宣言型で決め、日ごとの CSV の推論結果には依存させない
+# （「取消」を含む日だけ prev1_rank が文字列になる、といった型の食い違いでスキャンが失敗しないように）。
+# 既存の日は同じ日を取り込み直したときだけ置き換わり、それ以外は追記のみ。
+
+HISTORY_DIR = "history"
+PARTITION_FILE = "data.arrow"
+
+# 取り込み時に付与するキー列
+KEY_COLUMNS = ["race_id", "date", "venue"]
+
+_PARTITION_RE = re.compile(r"date=(\d{8})[\\/]venue=(\d{2})[\\/]" + re.escape(PARTITION_FILE) + "$")
+
+
+def _race_id(csv_path: str) -> str:
+    m = re.match(r"(\d{12})_", os.path.basename(csv_path))
+    return m.group(1) if m else ""
+
+
+def partition_path(root: str, date: str, venue: str) -> str:
+    return os.path.join(root, f"date={date}", f"venue={venue}", PARTITION_FILE)
+
+
+# =========================
+# 書き込み
+# =========================
+def declared_types() -> dict:
+    """列名 → feature_registry の宣言型（"str" / "float" / "int"）"""
+    from feature_registry import PLAN
+
+    return {name: f.dtype for f in PLAN.features for name in f.names}
+
+
+def _to_arrow(df, declared: dict = None):
+    """
+    df は全列を文字列で読んだもの。宣言型が "str" の列とキー列は string、
+    数値（"float" / "int"）は NaN 埋めの float32（null ビットマップなし → ゼロコピー可）。
+    宣言のない列だけ、全値が数値として読めれば float32 とする。
+    """
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+
+    declared = declared_types() if declared is None else declared
+    arrays, names = [], []
+    for col in df.columns:
+        s = df[col]
+        dtype = "str" if col in KEY_COLUMNS else declared.get(col)
+        numeric = None
+        if dtype != "str":
+            numeric = pd.to_numeric(s, errors="coerce")
+            if dtype is None and numeric.isna().sum() != s.isna().sum():
+                numeric = None
+        if numeric is not None:
+            arrays.append(pa.array(numeric.to_numpy(dtype=np.float32, na_value=np.nan)))
+        else:
+            arrays.append(pa.array(s.astype(object).where(s.notna(), None), type=pa.string()))
+        names.append(col)
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def _write_atomic(table, path: str):
+    import pyarrow as pa
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with pa.OSFile(tmp, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def ingest_day(date_dir: str, root: str = HISTORY_DIR) -> int:
+    """1日分の *_aiready.csv を開催場ごとのパーティションに書き込む。取り込んだレース数を返す"""
+    import pandas as pd
+
+    by_venue = {}
+    for csv_path in sorted(glob.glob(os.path.join(date_dir, "*_aiready.csv"))):
+        race_id = _race_id(csv_path)
+        if not race_id:
+            continue
+        # 型は _to_arrow で宣言に合わせるため、ここでは推論させない
+        df = pd.read_csv(csv_path, dtype=str)
+        if df.empty:
+            continue
+        df.insert(0, "race_id", race_id)
+        df.insert(1, "date", race_id[:8])
+        df.insert(2, "venue", race_id[8:10])
+        by_venue.setdefault((race_id[:8], race_id[8:10]), []).append(df)
+
+    races = 0
+    declared = declared_types()
+    for (date, venue), frames in by_venue.items():
+        # 新馬戦などで列が欠けるレースがあるため、列の和集合でそろえる
+        day = pd.concat(frames, ignore_index=True, sort=False)
+        _write_atomic(_to_arrow(day, declared), partition_path(root, date, venue))
+        races += len(frames)
+        print(f"[OK] 履歴ストア: {partition_path(root, date, venue)} ({len(frames)} レース / {len(day)} 頭)")
+    return races
+
+
+# =========================
+# 読み込み
+# =========================
+class HistoryStore:
+    def __init__(self, root: str = HISTORY_DIR):
+        self.root = root
+
+    def partitions(self, start: str = None, end: str = None, venues=None) -> list:
+        """[(date, venue, path)]。ディレクトリ名だけで絞り込む"""
+        venues = {venues} if isinstance(venues, str) else set(venues or [])
+        out = []
+        for path in glob.glob(os.path.join(self.root, "date=*", "venue=*", PARTITION_FILE)):
+            m = _PARTITION_RE.search(path)
+            if not m:
+                continue
+            date, venue = m.groups()
+            if (start and date < start) or (end and date > end) or (venues and venue not in venues):
+                continue
+            out.append((date, venue, path))
+        return sorted(out)
+
+    @staticmethod
+    def _open(path: str, columns: list):
+        import pyarrow as pa
+
+        reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+        table = reader.read_all()
+        if columns is not None:
+            table = table.select([c for c in columns if c in table.column_names])
+        return table
+
+    def scan(self, columns: list = None, start: str = None, end: str = None, venues=None,
+             surface: str = None, distance=None):
+        """
+        条件に合う馬の行を pyarrow.Table で返す。
+        columns      : 読む列（None で全列）。絞り込みに使う列は自動で追加し、結果からは外す
+        surface      : "芝" / "ダ"
+        distance     : 1600 のような完全一致、または (下限, 上限) の範囲（両端含む）
+        行の絞り込みがなければ各列はメモリマップ上のバッファをそのまま参照する。
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        filter_cols = (["surface"] if surface else []) + (["distance"] if distance is not None else [])
+        read_cols = None if columns is None else list(dict.fromkeys(list(columns) + filter_cols))
+
+        tables = []
+        for _, _, path in self.partitions(start, end, venues):
+            t = self._open(path, read_cols)
+            if filter_cols and not set(filter_cols) <= set(t.column_names):
+                continue
+
+            mask = None
+            if surface:
+                mask = pc.equal(t["surface"], surface)
+            if distance is not None:
+                lo, hi = distance if isinstance(distance, (tuple, list)) else (distance, distance)
+                d = t["distance"].cast(pa.float32())
+                cond = pc.and_(pc.greater_equal(d, lo), pc.less_equal(d, hi))
+                mask = cond if mask is None else pc.and_(mask, cond)
+            if mask is not None:
+                t = t.filter(mask)
+            if t.num_rows:
+                tables.append(t)
+
+        if not tables:
+            return pa.table({c: pa.array([], type=pa.string()) for c in (columns or [])})
+
+        table = pa.concat_tables(_unify_types(tables), promote_options="permissive")
+        if columns is not None:
+            table = table.select([c for c in columns if c in table.column_names])
+        return table
+
+    def column(self, name: str, **filters):
+        """1列を numpy 配列で返す（1パーティション・行絞り込みなしならゼロコピー）"""
+        table = self.scan([name], **filters)
+        chunked = table[name]
+        if chunked.num_chunks == 1 and chunked.null_count == 0:
+            return chunked.chunk(0).to_numpy(zero_copy_only=False)
+        return chunked.to_numpy()
+
+    def to_pandas(self, columns: list = None, **filters):
+        return self.scan(columns, **filters).to_pandas()
+
+
+def _unify_types(tables: list) -> list:
+    """
+    型の食い違う列（宣言型で取り込む前に書かれたパーティション）をそろえる。
+    数値どうしなら float32、文字列が混じれば string（permissive でも float と string は統合できない）。
+    取り込み直せば宣言型になる。
+    """
+    import pyarrow as pa
+
+    types = {}
+    for t in tables:
+        for field in t.schema:
+            types.setdefault(field.name, set()).add(field.type)
+    target = {
+        name: pa.float32() if all(pa.types.is_integer(x) or pa.types.is_floating(x) for x in ts) else pa.string()
+        for name, ts in types.items() if len(ts) > 1
+    }
+    if not target:
+        return tables
+
+    out = []
+    for t in tables:
+        for name in target.keys() & set(t.column_names):
+            if t.schema.field(name).type != target[name]:
+                t = t.set_column(t.column_names.index(name), name, t[name].cast(target[name]))
+        out.append(t)
+    return out
+
+
+def check() -> int:
+    """
+    型推論が食い違う2日分（着順がすべて数字の日 / 「取消」を含む日）と、宣言型を使う前の形式の
+    パーティションを一時ディレクトリに作り、まとめてスキャンできることを確かめる。
+    """
+    import tempfile
+
+    import pandas as pd
+    import pyarrow as pa
+
+    def race(rank: list) -> pd.DataFrame:
+        n = len(rank)
+        return pd.DataFrame({
+            "horse_number": range(1, n + 1),
+            "horse_name": [f"テスト{i}" for i in range(1, n + 1)],
+            "prev1_rank": rank,
+            "prev1_margin": [0.1 * i for i in range(n)],
+            "surface": ["芝"] * n,
+            "distance": [1600] * n,
+        })
+
+    with tempfile.TemporaryDirectory(prefix="history_check_") as work:
+        for date, rank in (("20250105", [1, 2, 3]), ("20250112", [1, "取消", 3])):
+            day_dir = os.path.join(work, f"race_data_{date}")
+            os.makedirs(day_dir)
+            race(rank).to_csv(os.path.join(day_dir, f"{date}0601_テスト_aiready.csv"), index=False)
+            ingest_day(day_dir, os.path.join(work, HISTORY_DIR))
+
+        # 旧形式: pandas の推論どおり prev1_rank が float32 のパーティション
+        legacy = race([4, 5, 6]).astype({"prev1_rank": "float32", "prev1_margin": "float64", "distance": "int64"})
+        legacy.insert(0, "race_id", "202501190601")
+        _write_atomic(pa.Table.from_pandas(legacy, preserve_index=False),
+                      partition_path(os.path.join(work, HISTORY_DIR), "20250119", "06"))
+
+        table = HistoryStore(os.path.join(work, HISTORY_DIR)).scan(
+            ["race_id", "prev1_rank", "prev1_margin"], surface="芝", distance=(1400, 1800))
+
+    ok = (table.num_rows == 9 and table.schema.field("prev1_rank").type == pa.string()
+          and table.schema.field("prev1_margin").type == pa.float32())
+    types = ", ".join(f"{f.name}={f.type}" for f in table.schema)
+    print(f"[{'OK' if ok else 'ERROR'}] 型の異なるパーティションのスキャン: {table.num_rows} 頭 / {types}")
+    return 0 if ok else 1
+
+
+# =========================
+# CLI
+# =========================
+def _day_dirs(root: str, start: str, end: str) -> list:
+    dirs = []
+    for path in glob.glob(os.path.join(root, "race_data_*")):
+        m = re.fullmatch(r"race_data_(\d{8})", os.path.basename(path))
+        if m and (not start or m.group(1) >= start) and (not end or m.group(1) <= end):
+            dirs.append(path)
+    return sorted(dirs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="aiready CSV の列指向履歴ストア")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest = sub.add_parser("ingest", help="race_data_YYYYMMDD を取り込む")
+    ingest.add_argument("date_dirs", nargs="*", help="取り込む日付ディレクトリ")
+    ingest.add_argument("--root", default=".", help="--start/--end 指定時に race_data_* を探す場所")
+    ingest.add_argument("--start", default=None)
+    ingest.add_argument("--end", default=None)
+    ingest.add_argument("--store", default=HISTORY_DIR)
+
+    info = sub.add_parser("info", help="パーティションと行数を表示")
+    info.add_argument("--store", default=HISTORY_DIR)
+    info.add_argument("--start", default=None)
+    info.add_argument("--end", default=None)
+    info.add_argument("--venue", action="append", default=None, help="開催場コード（複数可）")
+
+    sub.add_parser("check", help="型推論の異なる日をまとめてスキャンできるか一時ディレクトリで確認")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        return check()
+
+    if args.command == "ingest":
+        dirs = list(args.date_dirs)
+        if args.start or args.end:
+            dirs += _day_dirs(args.root, args.start, args.end)
+        if not dirs:
+            parser.error("取り込む日付ディレクトリがありません")
+        total = sum(ingest_day(d, args.store) for d in dirs)
+        print(f"=== 取り込み完了: {len(dirs)} 日 / {total} レース ===")
+        return 0
+
+    store = HistoryStore(args.store)
+    parts = store.partitions(args.start, args.end, args.venue)
+    for date, venue, path in parts:
+        print(f"  {date} {venue}  {os.path.getsize(path) / 1024:8.1f} KiB  {path}")
+    table = store.scan(["race_id"], start=args.start, end=args.end, venues=args.venue)
+    print(f"=== {len(parts)} パーティション / {table.num_rows} 頭 ===")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,359 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import metrics
+import race_info_collect
+from feature_registry import CAREER_COLUMNS, normalize_distance
+
+# ==============================
+# 馬ごとの全成績（馬ページのキャッシュ）
+# ==============================
+# 使い方:
+#   python horse_history.py 20251207
+#   python horse_history.py 20251207 --queue scrape_queue.sqlite --min-interval 5   （work_queue と間隔を共有）
+#   python horse_history.py 20251207 --offline                                      （キャッシュのみで特徴量を作る）
+#
+# 新聞の馬名リンク（td.bameiBox .bamei3 a → _data.csv の horse_id）から馬ページを取得し、
+# horse_cache/ に馬単位で保存する。キャッシュには最終出走日を持たせ、
+# 新聞の前走日（prev1_date）がそれより新しい馬だけを取り直す（新馬は取得しない）。
+# 同じ馬は日をまたいでも1回しか取得しないため、通算成績の特徴量を毎日作っても負荷は増えない。
+# 出力: 各レースの {race_id}_..._career.csv（馬番ごとの通算・同コース条件の成績）。
+#       prepare_ai_input.make_ai_ready_csv は存在すればこれを結合する。
+
+HORSE_URL_TEMPLATE = "https://keibalab.jp/db/horse/{horse_id}/"
+HORSE_READY_SELECTOR = "table"
+
+CACHE_DIR = "horse_cache"
+CACHE_INDEX_NAME = "index.sqlite"
+
+CAREER_FILE_SUFFIX = "_career.csv"
+
+# 同距離とみなす幅（m）
+DISTANCE_TOLERANCE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS horses (
+    horse_id   TEXT PRIMARY KEY,
+    last_run   TEXT NOT NULL,
+    runs       INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    records    TEXT NOT NULL
+);
+"""
+
+
+def normalize_date(text) -> str:
+    """"2025/11/30" / "2025.11.30" / "20251130" → "20251130"（不明は ""）"""
+    m = re.search(r"(\d{4})\D?(\d{1,2})\D?(\d{1,2})", str(text or ""))
+    if not m:
+        return ""
+    return f"{int(m.group(1)):04d}{int(m.group(2)):02d}{int(m.group(3)):02d}"
+
+
+# ----------------------------------------
+# ■ 馬ページの解析
+# ----------------------------------------
+
+# 成績表の列見出し → レコードのキー
+RECORD_COLUMNS = {
+    "日付": "date",
+    "開催": "venue",
+    "レース名": "race_name",
+    "頭数": "field_size",
+    "馬番": "horse_num",
+    "人気": "popularity",
+    "着順": "rank",
+    "着": "rank",
+    "騎手": "jockey",
+    "距離": "course",
+    "コース": "course",
+    "馬場": "condition",
+    "タイム": "time",
+    "着差": "margin",
+    "上り": "agari",
+    "上がり": "agari",
+    "3F": "agari",
+    "馬体重": "horse_weight",
+}
+
+
+def parse_horse_page(content: str) -> list:
+    """ヘッダに「日付」と「着順」（または「着」）を持つ表を成績表とみなし、新しい順のレコードを返す"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, "html.parser")
+    for table in soup.find_all("table"):
+        header = table.select_one("thead tr") or table.select_one("tr")
+        names = [c.get_text(strip=True) for c in header.find_all(["th", "td"])] if header else []
+        keys = [RECORD_COLUMNS.get(n) for n in names]
+        if "date" not in keys or "rank" not in keys:
+            continue
+
+        records = []
+        for tr in table.select("tbody tr") or table.find_all("tr")[1:]:
+            cells = tr.find_all("td")
+            row = {k: cells[i].get_text(" ", strip=True) for i, k in enumerate(keys) if k and i < len(cells)}
+            date = normalize_date(row.get("date"))
+            if not date:
+                continue
+            m_course = re.search(r"(芝|ダ)\D*(\d{3,4})", row.get("course", ""))
+            rank = row.get("rank", "")
+            records.append({
+                "date": date,
+                "venue": row.get("venue", ""),
+                "race_name": row.get("race_name", ""),
+                "surface": m_course.group(1) if m_course else "",
+                "distance": int(m_course.group(2)) if m_course else None,
+                "condition": row.get("condition", ""),
+                "field_size": row.get("field_size", ""),
+                "popularity": row.get("popularity", ""),
+                # 中止・除外・取消は None
+                "rank": int(rank) if rank.isdigit() else None,
+                "agari": row.get("agari", ""),
+                "margin": row.get("margin", ""),
+            })
+        return sorted(records, key=lambda r: r["date"], reverse=True)
+    return []
+
+
+# ----------------------------------------
+# ■ キャッシュ
+# ----------------------------------------
+
+class HorseCache:
+    """
+    馬ページの HTML（gzip）と解析済みレコードを馬単位で保持する。
+    索引（最終出走日・取得時刻・レコード）は SQLite に置き、HTML は解析ロジック変更時の再解析用。
+    """
+
+    def __init__(self, root: str = CACHE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, CACHE_INDEX_NAME), timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.RLock()
+
+    def close(self):
+        self.conn.close()
+
+    def html_path(self, horse_id: str) -> str:
+        return os.path.join(self.root, horse_id[:4], f"{horse_id}.html.gz")
+
+    def last_run(self, horse_id: str):
+        with self.lock:
+            row = self.conn.execute("SELECT last_run FROM horses WHERE horse_id=?", (horse_id,)).fetchone()
+        return row["last_run"] if row else None
+
+    def needs_fetch(self, horse_id: str, card_last_run: str) -> bool:
+        """新聞の前走日がキャッシュの最終出走日より新しい（その後に出走した）ときだけ取り直す"""
+        if not horse_id or not card_last_run:
+            return False
+        cached = self.last_run(horse_id)
+        stale = cached is None or cached < card_last_run
+        metrics.cache_lookup("horse_page", hit=not stale)
+        return stale
+
+    def store(self, horse_id: str, content: str, records: list):
+        path = self.html_path(horse_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(content)
+        last_run = records[0]["date"] if records else ""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO horses (horse_id, last_run, runs, fetched_at, records) VALUES (?, ?, ?, ?, ?)",
+                (horse_id, last_run, len(records), time.time(), json.dumps(records, ensure_ascii=False)),
+            )
+
+    def records(self, horse_id: str) -> list:
+        with self.lock:
+            row = self.conn.execute("SELECT records FROM horses WHERE horse_id=?", (horse_id,)).fetchone()
+        return json.loads(row["records"]) if row else []
+
+    def reparse(self) -> int:
+        """保存済み HTML を parse_horse_page で解析し直す（取得はしない）"""
+        with self.lock:
+            ids = [r["horse_id"] for r in self.conn.execute("SELECT horse_id FROM horses")]
+        for horse_id in ids:
+            with gzip.open(self.html_path(horse_id), "rt", encoding="utf-8") as f:
+                content = f.read()
+            self.store(horse_id, content, parse_horse_page(content))
+        return len(ids)
+
+
+# ----------------------------------------
+# ■ 特徴量
+# ----------------------------------------
+
+def _rate(hits: int, runs: int):
+    return round(hits / runs, 3) if runs else None
+
+
+def career_features(records: list, race_date: str, surface: str, distance) -> dict:
+    """当該レースより前の出走だけを使った通算成績"""
+    past = [r for r in records if r["date"] < race_date and r["rank"] is not None]
+    if not past:
+        return {col: None for col in CAREER_COLUMNS}
+
+    top3 = [r for r in past if r["rank"] <= 3]
+    same_surface = [r for r in past if r["surface"] == surface]
+    same_dist = [
+        r for r in same_surface
+        if distance and r["distance"] and abs(r["distance"] - distance) <= DISTANCE_TOLERANCE
+    ]
+    agari = []
+    for r in past[:5]:
+        try:
+            agari.append(float(r["agari"]))
+        except (TypeError, ValueError):
+            pass
+
+    last = datetime.strptime(past[0]["date"], "%Y%m%d")
+    return {
+        "career_runs": len(past),
+        "career_wins": sum(1 for r in past if r["rank"] == 1),
+        "career_top3_rate": _rate(len(top3), len(past)),
+        "career_avg_rank": round(sum(r["rank"] for r in past) / len(past), 2),
+        "career_surface_runs": len(same_surface),
+        "career_surface_top3_rate": _rate(sum(1 for r in same_surface if r["rank"] <= 3), len(same_surface)),
+        "career_dist_runs": len(same_dist),
+        "career_dist_top3_rate": _rate(sum(1 for r in same_dist if r["rank"] <= 3), len(same_dist)),
+        "career_agari_avg5": round(sum(agari) / len(agari), 2) if agari else None,
+        "career_days_since_last": (datetime.strptime(race_date, "%Y%m%d") - last).days,
+    }
+
+
+def write_career_csv(data_path: str, common_path: str, cache: HorseCache) -> str:
+    import pandas as pd
+
+    df = pd.read_csv(data_path, dtype=str, keep_default_na=False)
+    common = pd.read_csv(common_path, dtype=str, keep_default_na=False).iloc[0]
+    race_id = str(common.get("race_id", ""))
+    surface = str(common.get("surface", ""))
+    distance = normalize_distance(common.get("distance") or None)
+    distance = distance if isinstance(distance, int) else None
+
+    rows = []
+    for _, h in df.iterrows():
+        features = career_features(cache.records(h.get("horse_id", "")), race_id[:8], surface, distance)
+        rows.append({"horse_number": h["horse_number"], **features})
+
+    out_path = data_path.replace("_data.csv", CAREER_FILE_SUFFIX)
+    pd.DataFrame(rows, columns=["horse_number"] + CAREER_COLUMNS).to_csv(out_path, index=False, encoding="utf-8-sig")
+    return out_path
+
+
+# ----------------------------------------
+# ■ 取得
+# ----------------------------------------
+
+def horses_to_fetch(day_dir: str, cache: HorseCache) -> list:
+    """その日の全レースの馬から、取り直しが必要な horse_id を重複なく集める"""
+    import pandas as pd
+
+    wanted = set()
+    for data_path in glob.glob(os.path.join(day_dir, "*_data.csv")):
+        df = pd.read_csv(data_path, dtype=str, keep_default_na=False)
+        if "horse_id" not in df.columns:
+            print(f"[WARN] horse_id 列がありません（新聞を取り直してください）: {data_path}")
+            continue
+        for horse_id, prev_date in zip(df["horse_id"], df.get("prev1_date", [""] * len(df))):
+            if cache.needs_fetch(horse_id, normalize_date(prev_date)):
+                wanted.add(horse_id)
+    return sorted(wanted)
+
+
+def fetch_horses(horse_ids: list, cache: HorseCache, queue_path: str = None, min_interval: float = None) -> int:
+    """
+    馬ページを取得してキャッシュに保存する。queue_path を指定すると work_queue の
+    全ワーカー共通のアクセス間隔に従う（指定しなければ REQUEST_DELAY_SECONDS ずつ待つ）。
+    """
+    if not horse_ids:
+        return 0
+
+    limiter = None
+    if queue_path:
+        from work_queue import WorkQueue
+        limiter = WorkQueue(queue_path)
+    min_interval = race_info_collect.REQUEST_DELAY_SECONDS if min_interval is None else min_interval
+
+    fetched = 0
+    driver = None
+    try:
+        driver, wait = race_info_collect.create_driver()
+        for horse_id in horse_ids:
+            url = HORSE_URL_TEMPLATE.format(horse_id=horse_id)
+            if limiter is not None:
+                limiter.acquire_rate_slot(min_interval)
+            content = race_info_collect.get_html_content_with_selenium(
+                url, driver, wait, HORSE_READY_SELECTOR, delay=0 if limiter is not None else min_interval
+            )
+            if not content:
+                print(f"[WARN] 馬ページ取得失敗: {horse_id}")
+                continue
+            records = parse_horse_page(content)
+            cache.store(horse_id, content, records)
+            fetched += 1
+            print(f"[OK] 馬ページ: {horse_id} ({len(records)} 走)")
+    finally:
+        if driver:
+            driver.quit()
+        if limiter is not None:
+            limiter.close()
+    return fetched
+
+
+def collect_day(day_dir: str, cache_root: str = CACHE_DIR, queue_path: str = None,
+                min_interval: float = None, offline: bool = False) -> int:
+    cache = HorseCache(cache_root)
+    try:
+        if not offline:
+            horse_ids = horses_to_fetch(day_dir, cache)
+            print(f"[INFO] 取得対象: {len(horse_ids)} 頭（キャッシュ済み・新馬は除外）")
+            fetch_horses(horse_ids, cache, queue_path, min_interval)
+
+        written = 0
+        for data_path in sorted(glob.glob(os.path.join(day_dir, "*_data.csv"))):
+            common_path = data_path.replace("_data.csv", "_common.csv")
+            if not os.path.exists(common_path):
+                continue
+            print(f"[OK] 通算成績 → {write_career_csv(data_path, common_path, cache)}")
+            written += 1
+    finally:
+        cache.close()
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="馬ページの全成績を取得し、通算成績の特徴量を作る")
+    parser.add_argument("date", help="YYYYMMDD")
+    parser.add_argument("--output-dir", default=None, help="既定: race_data_YYYYMMDD")
+    parser.add_argument("--cache", default=CACHE_DIR, help="馬ページのキャッシュ（日をまたいで共有）")
+    parser.add_argument("--queue", default=None, help="アクセス間隔を共有する work_queue の SQLite")
+    parser.add_argument("--min-interval", type=float, default=None, help="取得間隔（秒、既定: REQUEST_DELAY_SECONDS）")
+    parser.add_argument("--offline", action="store_true", help="取得せずキャッシュだけで特徴量を作る")
+    parser.add_argument("--reparse", action="store_true", help="キャッシュ済み HTML を解析し直してから実行")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    if not re.match(r"^\d{8}$", args.date):
+        parser.error("日付はYYYYMMDD形式で指定してください")
+
+    metrics.start_from_args(args)
+    if args.reparse:
+        cache = HorseCache(args.cache)
+        print(f"[OK] 再解析: {cache.reparse()} 頭")
+        cache.close()
+
+    n = collect_day(args.output_dir or f"race_data_{args.date}", args.cache, args.queue,
+                    args.min_interval, args.offline)
+    print(f"\n=== 完了: {n} レース ===")
@@ -0,0 +1,566 @@
+import argparse
+import glob
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import notify_discord
+import predict_race_ai
+import prepare_ai_input
+import metrics
+import profiling
+import race_info_collect
+from notify_outbox import OUTBOX_FILE_NAME, NotificationOutbox
+from race_day_daemon import DEFAULT_LEAD_MINUTES, JST, TimerQueue, read_post_time, trigger_time
+from request_policy import RequestPolicy, format_histograms, load_histograms, save_histograms
+
+# =========================
+# 1日分をレース単位のタスクDAGとして1プロセスで実行
+# =========================
+# 使い方:
+#   python -m keiba run --date 20251207 --model gpt-5.2
+#   python -m keiba daemon --date 20251207 --lead-minutes 10
+#
+# 各レースは scrape → prepare → predict → notify の依存チェーンになり、
+# 前段が終わったレースから次段へ進む（全レースのスクレイプ完了を待たない）。
+# --mode stream では取得済みレースを有界キューで後段へ流し、後段が詰まれば取得を待たせる。
+
+STAGES = ("scrape", "prepare", "predict", "notify")
+
+# Chrome 1台あたり同時に1ページしか扱えないため scrape の既定は 1
+DEFAULT_CONCURRENCY = {"scrape": 1, "prepare": 2, "predict": 4, "notify": 1}
+
+
+def parse_concurrency(spec: str) -> dict:
+    """"scrape=1,predict=6" → DEFAULT_CONCURRENCY を上書きした dict"""
+    out = dict(DEFAULT_CONCURRENCY)
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        stage, _, n = item.partition("=")
+        stage = stage.strip()
+        if stage not in out:
+            raise ValueError(f"未知のステージ: {stage}")
+        out[stage] = max(1, int(n))
+    return out
+
+
+# =========================
+# WebDriver プール（scrape 並列数 = Chrome 台数）
+# =========================
+class DriverPool:
+    def __init__(self, size: int):
+        self.size = size
+        self.created = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.created) < self.size:
+                pair = race_info_collect.create_driver()
+                self.created.append(pair)
+                return pair
+        return self.idle.get()
+
+    def release(self, pair):
+        self.idle.put(pair)
+
+    def close(self):
+        for driver, _ in self.created:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+
+# =========================
+# タスクDAG
+# =========================
+class RaceDAG:
+    """
+    レースごとの段階チェーンを、ステージ別のスレッドプールで実行する。
+    あるステージが None を返した場合、そのレースの後続ステージは実行しない。
+    """
+
+    def __init__(self, concurrency: dict):
+        self.pools = {
+            stage: ThreadPoolExecutor(max_workers=concurrency[stage], thread_name_prefix=stage)
+            for stage in STAGES
+        }
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.all_done = threading.Event()
+        self.all_done.set()
+        self.errors = []
+        self.inflight = {stage: 0 for stage in STAGES}  # プールに投入済みで未完了の件数
+        self.stage_seconds = {stage: 0.0 for stage in STAGES}
+        self.completed = {stage: 0 for stage in STAGES}
+        self.first_done = {}
+        self.started_at = time.monotonic()
+
+    def submit(self, race_key: str, chain: list, value=None):
+        """chain: [(stage, fn), ...]。fn は前段の戻り値を受け取る"""
+        with self.lock:
+            self.outstanding += 1
+            self.all_done.clear()
+        self._run_next(race_key, chain, 0, value)
+
+    def _run_next(self, race_key, chain, i, value):
+        if i >= len(chain) or value is None and i > 0:
+            self._finish()
+            return
+        stage, fn = chain[i]
+        with self.lock:
+            self.inflight[stage] += 1
+        self.pools[stage].submit(self._run, race_key, chain, i, value)
+
+    def _run(self, race_key, chain, i, value):
+        stage, fn = chain[i]
+        t0 = time.monotonic()
+        try:
+            result = fn(value)
+        except Exception as e:
+            print(f"[ERROR] {race_key} {stage}: {e}")
+            metrics.error(stage)
+            with self.lock:
+                self.inflight[stage] -= 1
+                self.errors.append((race_key, stage, str(e)))
+            self._finish()
+            return
+
+        now = time.monotonic()
+        with self.lock:
+            self.inflight[stage] -= 1
+            self.stage_seconds[stage] += now - t0
+            if result is not None:
+                self.completed[stage] += 1
+                self.first_done.setdefault(stage, now - self.started_at)
+        self._run_next(race_key, chain, i + 1, result)
+
+    def _finish(self):
+        with self.lock:
+            self.outstanding -= 1
+            if self.outstanding == 0:
+                self.all_done.set()
+
+    def wait(self):
+        self.all_done.wait()
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+    def depth_metrics(self) -> list:
+        with self.lock:
+            return [("keiba_queue_depth", {"queue": stage, "state": "inflight"}, n) for stage, n in self.inflight.items()]
+
+    def report(self) -> str:
+        lines = []
+        for stage in STAGES:
+            first = self.first_done.get(stage)
+            first_s = f"{first:.1f}s" if first is not None else "-"
+            lines.append(
+                f"  {stage:8s} 完了 {self.completed[stage]:3d} / 累計 {self.stage_seconds[stage]:.1f}s / 初回完了 {first_s}"
+            )
+        lines.append(f"  経過 {time.monotonic() - self.started_at:.1f}s / エラー {len(self.errors)} 件")
+        return "\n".join(lines)
+
+
+# =========================
+# ストリーミング（有界キューによる段間受け渡し）
+# =========================
+_END = object()
+
+
+class StreamingPipeline:
+    """
+    source から1レースずつ受け取り、段ごとのワーカーへ有界キューで流す。
+    後段が詰まると前段の put がブロックし、取得が先行しすぎない（背圧）。
+    """
+
+    def __init__(self, stages: list, queue_size: int = 2):
+        # stages: [(name, fn, workers), ...]。fn が None を返したレースはそこで終了
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.lock = threading.Lock()
+        self.errors = []
+        self.completed = {name: 0 for name, _, _ in stages}
+        self.first_done = {}
+        self.max_depth = [0] * len(stages)
+        self.started_at = time.monotonic()
+
+    def _put(self, i: int, item):
+        q = self.queues[i]
+        q.put(item)
+        with self.lock:
+            self.max_depth[i] = max(self.max_depth[i], q.qsize())
+
+    def _worker(self, i: int, remaining: list):
+        name, fn, _ = self.stages[i]
+        while True:
+            item = self.queues[i].get()
+            if item is _END:
+                break
+            race_key, value = item
+            try:
+                result = fn(value)
+            except Exception as e:
+                print(f"[ERROR] {race_key} {name}: {e}")
+                metrics.error(name)
+                with self.lock:
+                    self.errors.append((race_key, name, str(e)))
+                continue
+            if result is None:
+                continue
+            with self.lock:
+                self.completed[name] += 1
+                self.first_done.setdefault(name, time.monotonic() - self.started_at)
+            if i + 1 < len(self.stages):
+                self._put(i + 1, (race_key, result))
+
+        # 段の最後のワーカーが次段へ終了を伝える
+        with self.lock:
+            remaining[i] -= 1
+            last = remaining[i] == 0
+        if last and i + 1 < len(self.stages):
+            for _ in range(self.stages[i + 1][2]):
+                self._put(i + 1, _END)
+
+    def run(self, source):
+        """source: (race_key, value) を順に返すイテラブル"""
+        remaining = [workers for _, _, workers in self.stages]
+        threads = []
+        for i, (name, _, workers) in enumerate(self.stages):
+            for n in range(workers):
+                t = threading.Thread(target=self._worker, args=(i, remaining), name=f"{name}-{n}", daemon=True)
+                t.start()
+                threads.append(t)
+
+        try:
+            for item in source:
+                self._put(0, item)
+        finally:
+            for _ in range(self.stages[0][2]):
+                self._put(0, _END)
+            for t in threads:
+                t.join()
+
+    def depth_metrics(self) -> list:
+        return [
+            ("keiba_queue_depth", {"queue": name, "state": "queued"}, self.queues[i].qsize())
+            for i, (name, _, _) in enumerate(self.stages)
+        ]
+
+    def report(self) -> str:
+        lines = []
+        for i, (name, _, _) in enumerate(self.stages):
+            first = self.first_done.get(name)
+            first_s = f"{first:.1f}s" if first is not None else "-"
+            lines.append(
+                f"  {name:8s} 完了 {self.completed[name]:3d} / 初回完了 {first_s} / 最大待ち行列 {self.max_depth[i]}"
+            )
+        lines.append(f"  経過 {time.monotonic() - self.started_at:.1f}s / エラー {len(self.errors)} 件")
+        return "\n".join(lines)
+
+
+# =========================
+# 各ステージ
+# =========================
+def url_race_id(url: str) -> str:
+    m = re.search(r"/db/race/(\d{12})/", url)
+    return m.group(1) if m else url
+
+
+class DayPipeline:
+    def __init__(self, args):
+        self.args = args
+        self.date = args.date
+        self.output_dir = args.output_dir or f"race_data_{args.date}"
+        self.concurrency = parse_concurrency(args.concurrency)
+        self.policy = RequestPolicy(deadline_seconds=args.deadline)
+        self.latency_path = os.path.join(self.output_dir, predict_race_ai.LATENCY_FILE_NAME)
+        self.histograms = None
+        self.drivers = DriverPool(self.concurrency["scrape"])
+        self.outbox = None
+        self.client = None
+        self.batcher = None
+        self.delivered = set()
+        self.similar_index = None
+        if args.similar_index:
+            from race_index import RaceIndex
+            self.similar_index = RaceIndex.load(args.similar_index)
+
+    # --- scrape ---
+    def scrape(self, url):
+        pair = self.drivers.acquire()
+        try:
+            driver, wait = pair
+            return race_info_collect.scrape_race(url, driver, wait, self.output_dir)
+        finally:
+            self.drivers.release(pair)
+
+    # --- prepare ---
+    def prepare(self, paths):
+        data_path, common_path = paths
+        aiready = data_path.replace("_data.csv", "_aiready.csv")
+        prepare_ai_input.make_ai_ready_csv(data_path, common_path, aiready)
+        return aiready
+
+    # --- predict ---
+    def predict(self, aiready):
+        json_path = predict_race_ai.main(
+            aiready,
+            self.args.model,
+            stream=self.args.stream,
+            fallback=self.args.fallback,
+            placement=self.args.placement,
+            policy=self.policy,
+            ensemble=self.args.ensemble,
+            histograms=self.histograms,
+            similar_index=self.similar_index,
+        )
+        return json_path, aiready
+
+    # --- notify ---
+    def notify(self, paths):
+        # 登録だけ行い、送信は NotifyBatcher が開催場ごとにまとめて行う
+        json_path, aiready = paths
+        self.batcher.add(json_path, aiready)
+        return json_path
+
+    def chain(self, start: str) -> list:
+        stages = [
+            ("scrape", self.scrape),
+            ("prepare", self.prepare),
+            ("predict", self.predict),
+            ("notify", self.notify),
+        ]
+        if self.args.no_notify:
+            stages = stages[:-1]
+        names = [s for s, _ in stages]
+        return stages[names.index(start):]
+
+    def accept(self, race_id: str) -> bool:
+        """送信済みなら飛ばす。実行するレースは開催場ごとのまとめ送信の対象として登録する"""
+        if race_id in self.delivered:
+            print(f"[INFO] 送信済みのためスキップ: {race_id}")
+            return False
+        if self.batcher is not None and self.args.command == "run":
+            self.batcher.expect(race_id)
+        return True
+
+    def race_card_urls(self, driver, wait) -> list:
+        _, urls = race_info_collect.get_all_race_card_urls(driver, wait, self.date)
+        return [url for url in urls if self.accept(url_race_id(url))]
+
+    def race_inputs(self):
+        """(race_key, 開始ステージ, 初期値) を時刻順（race_id 順）に列挙"""
+        if self.args.skip_scrape:
+            for data_path in sorted(glob.glob(os.path.join(self.output_dir, "*_data.csv"))):
+                common_path = data_path.replace("_data.csv", "_common.csv")
+                race_key = os.path.basename(data_path)
+                if os.path.exists(common_path) and self.accept(race_key.split("_")[0]):
+                    yield race_key, "prepare", (data_path, common_path)
+            return
+
+        pair = self.drivers.acquire()
+        try:
+            urls = self.race_card_urls(*pair)
+        finally:
+            self.drivers.release(pair)
+        for url in urls:
+            yield url_race_id(url), "scrape", url
+
+    def scraped_races(self):
+        """ストリーミング用の取得元: 1レース取得するごとに (race_key, (data, common)) を返す"""
+        if self.args.skip_scrape:
+            for race_key, _, value in self.race_inputs():
+                yield race_key, value
+            return
+
+        pair = self.drivers.acquire()
+        try:
+            driver, wait = pair
+            urls = self.race_card_urls(driver, wait)
+            for paths in race_info_collect.iter_race_data(urls, driver, wait, self.output_dir):
+                yield os.path.basename(paths[0]), paths
+        finally:
+            self.drivers.release(pair)
+
+    def run_streaming(self):
+        stages = [(name, fn, self.concurrency[name]) for name, fn in self.chain("prepare")]
+        pipeline = StreamingPipeline(stages, queue_size=self.args.queue_size)
+        metrics.set_collector("pipeline", pipeline.depth_metrics)
+        pipeline.run(self.scraped_races())
+        return pipeline
+
+    def run_dag(self):
+        dag = RaceDAG(self.concurrency)
+        metrics.set_collector("pipeline", dag.depth_metrics)
+        for race_key, start, value in self.race_inputs():
+            dag.submit(race_key, self.chain(start), value)
+        dag.wait()
+        return dag
+
+    # --- 直前更新（デーモン用） ---
+    def refresh(self, paths):
+        data_path, common_path = paths
+        race_id = os.path.basename(data_path).split("_")[0]
+        url = race_info_collect.NEWSPAPER_URL_TEMPLATE.format(race_id=race_id)
+        pair = self.drivers.acquire()
+        try:
+            driver, wait = pair
+            race_info_collect.refresh_race_data(url, driver, wait, data_path, common_path)
+        finally:
+            self.drivers.release(pair)
+        return paths
+
+    def run_daemon(self):
+        """
+        出馬表を一度揃え、各レースの発走 N 分前にオッズ・馬体重を更新して
+        prepare → predict → notify を実行する（内容が変われば更新として通知）。
+        """
+        races = []
+        for race_key, start, value in self.race_inputs():
+            paths = value if start == "prepare" else self.scrape(value)
+            if paths:
+                races.append((race_key, paths))
+
+        dag = RaceDAG(self.concurrency)
+        timers = TimerQueue()
+        metrics.set_collector("pipeline", lambda: dag.depth_metrics() + [
+            ("keiba_queue_depth", {"queue": "timers", "state": "scheduled"}, len(timers.pending()))
+        ])
+        chain = self.chain("prepare")
+        if not self.args.skip_scrape:
+            # --skip-scrape 時はサイトへアクセスせず手元の CSV のまま予測する
+            chain = [("scrape", self.refresh)] + chain
+        now = time.time()
+
+        for race_key, paths in races:
+            trigger, post = trigger_time(self.date, read_post_time(paths[1]), self.args.lead_minutes)
+            if trigger is None:
+                print(f"[WARN] 発走時刻不明のためスキップ: {race_key}")
+                continue
+            if post.timestamp() <= now:
+                print(f"[INFO] 発走済みのためスキップ: {race_key} ({post:%H:%M})")
+                continue
+            when = max(trigger.timestamp(), now)
+            print(f"[DAEMON] 予約: {race_key} 発走 {post:%H:%M} → {datetime.fromtimestamp(when, JST):%H:%M:%S} に実行")
+            timers.schedule(when, race_key, lambda k=race_key, p=paths: dag.submit(k, chain, p))
+
+        timers.run()
+        dag.wait()
+        return dag
+
+    def run(self) -> int:
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.histograms = load_histograms(self.latency_path)
+        if not self.args.no_notify:
+            self.outbox = NotificationOutbox(os.path.join(self.output_dir, OUTBOX_FILE_NAME))
+            self.client = notify_discord.DiscordClient()
+            # デーモンは発走前の1レースごとに即送る
+            delay = 0 if self.args.command == "daemon" else self.args.notify_batch_seconds
+            self.batcher = notify_discord.NotifyBatcher(self.outbox, self.client, self.args.pack, delay)
+            metrics.set_collector("outbox", self.outbox.depth_metrics)
+            # 再実行（ジョブの再実行・途中失敗からの再開）では送信済みのレースを予測し直さない。
+            # daemon は直前データで内容が変われば更新として送るため対象外
+            if self.args.command == "run" and not self.args.redo_delivered:
+                self.delivered = self.outbox.delivered_races()
+                if self.delivered:
+                    print(f"[INFO] 送信済み {len(self.delivered)} レースは予測・通知を省略")
+
+        try:
+            if self.args.command == "daemon":
+                runner = self.run_daemon()
+            elif self.args.mode == "stream":
+                runner = self.run_streaming()
+            else:
+                runner = self.run_dag()
+        finally:
+            metrics.remove_collector("pipeline")
+            metrics.remove_collector("outbox")
+            self.drivers.close()
+            save_histograms(self.latency_path, self.histograms)
+            notify_failed = self.batcher.close() if self.batcher else 0
+            if self.client:
+                self.client.close()
+            if self.outbox:
+                self.outbox.close()
+
+        print("\n=== 実行結果 ===")
+        print(runner.report())
+        print(f"  レイテンシ: {format_histograms(self.histograms)}")
+        if notify_failed:
+            print(f"  通知失敗 {notify_failed} 件")
+        return 1 if runner.errors or notify_failed else 0
+
+
+# =========================
+# CLI
+# =========================
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m keiba", description="競馬予想パイプライン")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--date", required=True, help="YYYYMMDD")
+    common.add_argument("--model", default=predict_race_ai.DEFAULT_MODEL)
+    common.add_argument("--output-dir", default=None, help="既定: race_data_YYYYMMDD")
+    common.add_argument("--concurrency", default="",
+                        help="ステージ別並列数（例: scrape=1,prepare=2,predict=4,notify=1）")
+    common.add_argument("--skip-scrape", action="store_true", help="既存の *_data.csv から開始")
+    common.add_argument("--no-notify", action="store_true", help="Discord 通知を行わない")
+    common.add_argument("--stream", action="store_true")
+    common.add_argument("--fallback", action="store_true")
+    common.add_argument("--placement", choices=predict_race_ai.PLACEMENT_CHOICES, default="independent")
+    common.add_argument("--ensemble", default=None)
+    common.add_argument("--deadline", type=float, default=RequestPolicy.deadline_seconds)
+    common.add_argument("--pack", choices=notify_discord.PACK_MODES, default="embeds")
+    common.add_argument("--similar-index", default=None,
+                        help="race_index.py build のインデックス。類似した過去レースの結果をプロンプトに付ける")
+    common.add_argument("--profile", action="store_true",
+                        help=f"ステージごとの cProfile / tracemalloc を <出力先>/profile に保存（{profiling.PROFILE_ENV}=1 と同じ）")
+    metrics.add_arguments(common)
+
+    run = sub.add_parser("run", parents=[common], help="1日分を scrape → prepare → predict → notify で実行")
+    run.add_argument("--mode", choices=("dag", "stream"), default="dag",
+                     help="dag: レース単位のタスクDAG / stream: 取得順に有界キューで流す（scrape は1並列）")
+    run.add_argument("--queue-size", type=int, default=2, help="stream 時の段間キュー上限（背圧）")
+    run.add_argument("--notify-batch-seconds", type=float, default=notify_discord.DEFAULT_BATCH_SECONDS,
+                     help="開催場の最終レースを待たずにまとめて送るまでの秒数（0: レースごとに送信）")
+    run.add_argument("--redo-delivered", action="store_true",
+                     help="アウトボックスで送信済みのレースも予測し直す（内容が変われば更新として再送）")
+
+    daemon = sub.add_parser("daemon", parents=[common], help="各レースの発走 N 分前に直前データで予測・通知")
+    daemon.add_argument("--lead-minutes", type=float, default=DEFAULT_LEAD_MINUTES,
+                        help="発走の何分前に更新・予測するか")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+
+    if not re.match(r"^\d{8}$", args.date):
+        print("日付はYYYYMMDD形式で指定してください")
+        return 1
+
+    if args.profile:
+        profiling.enable()
+    metrics.start_from_args(args)
+    try:
+        return DayPipeline(args).run()
+    finally:
+        profiling.write_reports()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# ==============================
+# 実行中メトリクス（Prometheus テキスト形式）
+# ==============================
+# 使い方:
+#   python -m keiba run --date 20251207 --metrics-file race_data_20251207/metrics.prom
+#   python -m keiba daemon --date 20251207 --metrics-port 9108
+#   python work_queue.py work --queue scrape.sqlite --metrics-port 9109
+#   curl -s http://127.0.0.1:9108/metrics
+#   KEIBA_METRICS_FILE=/var/lib/node_exporter/keiba.prom python -m keiba daemon --date 20251207
+#
+# 各モジュールは inc / observe / progress で値を積むだけ（常時有効、ロック1回の加算）。
+# start() を呼んだプロセスだけが、file なら interval 秒ごとに原子的に書き出し
+# （node_exporter の textfile collector でも読める）、port なら GET /metrics で返す。
+# キューの深さのような「その時点の値」は set_collector で登録した関数を出力時に呼んで得る。
+#
+# 止まったステージは keiba_stage_last_progress_timestamp_seconds と現在時刻の差で分かる。
+
+METRICS_FILE_ENV = "KEIBA_METRICS_FILE"
+METRICS_PORT_ENV = "KEIBA_METRICS_PORT"
+
+DEFAULT_INTERVAL_SECONDS = 5.0
+
+# 取得（Selenium）とLLM の応答時間のバケット上限（秒）
+FETCH_BUCKETS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 60)
+LLM_BUCKETS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+
+# 名前 → (型, 説明, ヒストグラムのバケット)
+METRICS = {
+    "keiba_races_total": ("counter", "ステージを通過したレース数（stage=fetched/parsed/prepared/predicted/notified）", None),
+    "keiba_stage_errors_total": ("counter", "ステージごとのエラー数", None),
+    "keiba_stage_last_progress_timestamp_seconds": ("gauge", "ステージが最後にレースを通過させた時刻（UNIX 秒）", None),
+    "keiba_fetch_seconds": ("histogram", "ページ取得（driver.get から描画待ちまで）の所要時間", FETCH_BUCKETS),
+    "keiba_llm_request_seconds": ("histogram", "LLM 1リクエストの応答時間（成功分）", LLM_BUCKETS),
+    "keiba_llm_race_seconds": ("histogram", "1レースの予測にかかった時間（再試行・ヘッジ込み）", LLM_BUCKETS),
+    "keiba_llm_retries_total": ("counter", "出力不正・一時的な API エラーによる LLM の再試行回数", None),
+    "keiba_llm_hedges_total": ("counter", "応答遅延によるヘッジ送信回数", None),
+    "keiba_cache_requests_total": ("counter", "キャッシュ参照数（result=hit/miss）", None),
+    "keiba_cache_hit_ratio": ("gauge", "キャッシュのヒット率（keiba_cache_requests_total から算出）", None),
+    "keiba_rate_limit_wait_seconds_total": ("counter", "レート制限・アクセス間隔のために待った秒数", None),
+    "keiba_rate_limited_total": ("counter", "相手側のレート制限応答（429）の回数", None),
+    "keiba_queue_depth": ("gauge", "待ち行列・未処理件数（queue / state ごと）", None),
+    "keiba_process_start_time_seconds": ("gauge", "このプロセスの開始時刻（UNIX 秒）", None),
+}
+
+_lock = threading.Lock()
+_values = {}        # (name, labels) -> 値（counter / gauge）
+_histograms = {}    # (name, labels) -> [バケット別件数..., +Inf], 合計, 件数
+_collectors = {}    # key -> fn() -> [(name, labels dict, value), ...]
+_writer = None
+_server = None
+
+_START_TIME = time.time()
+
+
+def _key(name: str, labels: dict) -> tuple:
+    if name not in METRICS:
+        raise KeyError(f"未定義のメトリクス: {name}")
+    return name, tuple(sorted(labels.items()))
+
+
+# =========================
+# 記録
+# =========================
+def inc(name: str, amount: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+
+
+def set_gauge(name: str, value: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = value
+
+
+def observe(name: str, seconds: float, **labels):
+    key = _key(name, labels)
+    buckets = METRICS[name][2]
+    idx = len(buckets)
+    for i, upper in enumerate(buckets):
+        if seconds <= upper:
+            idx = i
+            break
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        h[0][idx] += 1
+        h[1] += seconds
+        h[2] += 1
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """ブロックの所要時間を observe する（例外で抜けた場合も記録する）"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start, **labels)
+
+
+def progress(stage: str, races: int = 1):
+    """stage を races レース通過させたことを記録し、最終進捗時刻を更新する"""
+    if races <= 0:
+        return
+    inc("keiba_races_total", races, stage=stage)
+    set_gauge("keiba_stage_last_progress_timestamp_seconds", time.time(), stage=stage)
+
+
+def error(stage: str):
+    inc("keiba_stage_errors_total", stage=stage)
+
+
+def cache_lookup(cache: str, hit: bool):
+    inc("keiba_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def rate_wait(limiter: str, seconds: float):
+    if seconds > 0:
+        inc("keiba_rate_limit_wait_seconds_total", seconds, limiter=limiter)
+
+
+def value(name: str, **labels) -> float:
+    """counter / gauge の現在値（未記録は 0）"""
+    key = _key(name, labels)
+    with _lock:
+        return _values.get(key, 0)
+
+
+def set_collector(key: str, fn):
+    """出力時に呼ぶ関数を登録する（同じ key は置き換え）。fn は [(name, labels, value), ...] を返す"""
+    with _lock:
+        _collectors[key] = fn
+
+
+def remove_collector(key: str):
+    with _lock:
+        _collectors.pop(key, None)
+
+
+# =========================
+# 出力
+# =========================
+def _format_labels(labels, extra: tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    parts = []
+    for k, v in items:
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _collected() -> dict:
+    with _lock:
+        collectors = list(_collectors.items())
+    values = {}
+    for key, fn in collectors:
+        try:
+            for name, labels, value in fn():
+                values[_key(name, labels)] = value
+        except Exception as e:
+            # 出力を止めないため、失敗した collector は飛ばしてエラーとして数える
+            values[_key("keiba_stage_errors_total", {"stage": f"collector:{key}"})] = 1
+            print(f"[WARN] メトリクス収集失敗: {key} ({e})")
+    return values
+
+
+def _hit_ratios(values: dict) -> dict:
+    totals = {}
+    for (name, labels), v in values.items():
+        if name == "keiba_cache_requests_total":
+            d = dict(labels)
+            hit, total = totals.get(d["cache"], (0, 0))
+            totals[d["cache"]] = (hit + (v if d["result"] == "hit" else 0), total + v)
+    return {
+        _key("keiba_cache_hit_ratio", {"cache": cache}): hit / total
+        for cache, (hit, total) in totals.items() if total
+    }
+
+
+def render() -> str:
+    """現在値を Prometheus テキスト形式（version 0.0.4）で返す"""
+    with _lock:
+        values = dict(_values)
+        histograms = {k: (list(h[0]), h[1], h[2]) for k, h in _histograms.items()}
+    values.update(_collected())
+    values.update(_hit_ratios(values))
+    values[_key("keiba_process_start_time_seconds", {})] = _START_TIME
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, v) for (n, labels), v in values.items() if n == name)
+        hists = sorted((labels, h) for (n, labels), h in histograms.items() if n == name)
+        if not series and not hists:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, v in series:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(v)}")
+        for labels, (counts, total, count) in hists:
+            cum = 0
+            for upper, c in zip(list(buckets) + [float("inf")], counts):
+                cum += c
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_value(upper)),))} {cum}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path: str):
+    """一時ファイルに書いてから置き換える（読み手が書きかけを見ない）"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+class _FileWriter(threading.Thread):
+    def __init__(self, path: str, interval: float):
+        super().__init__(name="metrics-writer", daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                write_file(self.path)
+            except OSError as e:
+                print(f"[WARN] メトリクス書き出し失敗: {self.path} ({e})")
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        write_file(self.path)
+
+
+def _serve(port: int, host: str):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start(path: str = None, port: int = None, interval: float = DEFAULT_INTERVAL_SECONDS,
+          host: str = "127.0.0.1"):
+    """
+    メトリクスの公開を始める。引数が無ければ環境変数（KEIBA_METRICS_FILE / KEIBA_METRICS_PORT）を見る。
+    どちらも無ければ何もしない。プロセス終了時に最後の値を書き出す。
+    """
+    global _writer, _server
+
+    path = path or os.environ.get(METRICS_FILE_ENV) or None
+    port = port or int(os.environ.get(METRICS_PORT_ENV) or 0) or None
+
+    if path and _writer is None:
+        _writer = _FileWriter(path, interval)
+        _writer.start()
+        write_file(path)
+        print(f"[INFO] メトリクス: {path} に {interval:g} 秒ごとに書き出し")
+    if port and _server is None:
+        _server = _serve(port, host)
+        print(f"[INFO] メトリクス: http://{host}:{port}/metrics")
+    if path or port:
+        atexit.register(stop)
+
+
+def stop():
+    global _writer, _server
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+
+def add_arguments(parser):
+    """--metrics-file / --metrics-port / --metrics-interval を追加する"""
+    parser.add_argument("--metrics-file", default=None,
+                        help=f"Prometheus テキスト形式のメトリクスを書き出すファイル（{METRICS_FILE_ENV} と同じ）")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help=f"GET /metrics で公開するポート（127.0.0.1、{METRICS_PORT_ENV} と同じ）")
+    parser.add_argument("--metrics-interval", type=float, default=DEFAULT_INTERVAL_SECONDS,
+                        help="ファイルの書き出し間隔（秒）")
+
+
+def start_from_args(args):
+    start(args.metrics_file, args.metrics_port, args.metrics_interval)
@@ -0,0 +1,148 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==============================
+# ローカル用 Discord Webhook 代替サーバ
+# ==============================
+# 使い方:
+#   python mock_discord_server.py --port 8765 --limit 5 --window 2
+#   export DISCORD_WEBHOOK_URL_NAKAYAMA=http://127.0.0.1:8765/api/webhooks/1/nakayama
+#   python notify_discord.py --batch race_data_YYYYMMDD
+#
+# Webhook（パス）ごとに window 秒あたり limit 件を超えると 429 と Retry-After を返す。
+
+DISCORD_MESSAGE_LIMIT = 2000
+DISCORD_EMBED_DESCRIPTION_LIMIT = 4096
+DISCORD_EMBEDS_PER_MESSAGE = 10
+DISCORD_EMBED_TOTAL_LIMIT = 6000
+
+
+class WebhookState:
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.hits = {}       # path -> 直近の受信時刻
+        self.messages = []   # (path, content)
+        self.rejected = 0
+
+    def check(self, path: str):
+        """(許可, 残数, リセットまでの秒数) を返す"""
+        now = time.monotonic()
+        with self.lock:
+            hits = [t for t in self.hits.get(path, []) if now - t < self.window]
+            if len(hits) >= self.limit:
+                self.hits[path] = hits
+                self.rejected += 1
+                return False, 0, self.window - (now - hits[0])
+            hits.append(now)
+            self.hits[path] = hits
+            return True, self.limit - len(hits), self.window - (now - hits[0])
+
+
+def check_embeds(embeds: list) -> str:
+    if len(embeds) > DISCORD_EMBEDS_PER_MESSAGE:
+        return f"Must be {DISCORD_EMBEDS_PER_MESSAGE} or fewer in length."
+    total = 0
+    for e in embeds:
+        desc = e.get("description", "")
+        if len(desc) > DISCORD_EMBED_DESCRIPTION_LIMIT:
+            return f"description must be {DISCORD_EMBED_DESCRIPTION_LIMIT} or fewer in length."
+        total += len(desc) + len(e.get("title", ""))
+    if total > DISCORD_EMBED_TOTAL_LIMIT:
+        return f"Embed size exceeds maximum size of {DISCORD_EMBED_TOTAL_LIMIT}"
+    return ""
+
+
+def make_handler(state: WebhookState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def _reply(self, status: int, body: dict = None, headers: dict = None):
+            data = json.dumps(body or {}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._reply(400, {"message": "invalid json"})
+                return
+
+            content = payload.get("content", "")
+            if not content and not payload.get("embeds"):
+                self._reply(400, {"message": "Cannot send an empty message"})
+                return
+            if len(content) > DISCORD_MESSAGE_LIMIT:
+                self._reply(400, {"content": [f"Must be {DISCORD_MESSAGE_LIMIT} or fewer in length."]})
+                return
+            error = check_embeds(payload.get("embeds") or [])
+            if error:
+                self._reply(400, {"embeds": [error]})
+                return
+
+            ok, remaining, reset_after = state.check(self.path)
+            headers = {
+                "X-RateLimit-Limit": str(state.limit),
+                "X-RateLimit-Remaining": str(remaining),
+                "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+            }
+            if not ok:
+                headers["Retry-After"] = f"{reset_after:.3f}"
+                self._reply(429, {"message": "You are being rate limited.", "retry_after": reset_after}, headers)
+                return
+
+            with state.lock:
+                state.messages.append((self.path, content or payload["embeds"]))
+            self.send_response(204)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+
+        def do_GET(self):
+            # 受信状況の確認用
+            with state.lock:
+                body = {
+                    "received": len(state.messages),
+                    "rejected": state.rejected,
+                    "by_webhook": {},
+                }
+                for path, _ in state.messages:
+                    body["by_webhook"][path] = body["by_webhook"].get(path, 0) + 1
+            self._reply(200, body)
+
+    return Handler
+
+
+def start_server(port: int = 0, limit: int = 5, window: float = 2.0):
+    """バックグラウンドで起動し (server, state) を返す。port=0 で空きポート"""
+    state = WebhookState(limit, window)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discord Webhook のローカル代替サーバ")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--limit", type=int, default=5, help="window 秒あたりの許容件数（Webhook ごと）")
+    parser.add_argument("--window", type=float, default=2.0)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(WebhookState(args.limit, args.window)))
+    print(f"mock discord webhook: http://127.0.0.1:{args.port}/api/webhooks/<id>/<token>")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
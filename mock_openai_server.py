@@ -0,0 +1,424 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import select
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==============================
+# ローカル用 OpenAI Responses API 代替サーバ
+# ==============================
+# 使い方:
+#   python mock_openai_server.py --port 8766 --latency lognormal:4,0.5 --rate-limit-rate 0.05 --malformed-rate 0.05
+#   export OPENAI_BASE_URL=http://127.0.0.1:8766/v1 OPENAI_API_KEY=mock
+#   python predict_race_ai.py race_data_YYYYMMDD/..._aiready.csv
+#   curl -s http://127.0.0.1:8766/stats
+#
+# predict_race_ai が使う POST /v1/responses（stream あり・なし）だけを実装する。
+# 応答はプロンプトの【出走馬データ】から作る全馬分の予測（プロンプトごとに決定的）。
+# text.format に json_schema があればスキーマの形（{"horses": [...]}、項目はスキーマのもの）で返す。
+# 応答時間の分布・500 / 429 の発生率・出力破損の混入率を指定でき、
+# benchmarks/load_predict.py から並列度・再試行設定の検証に使う。
+
+LATENCY_KINDS = ("fixed", "uniform", "lognormal")
+
+# 出力破損の種類
+#   prose     : JSON の前後に文章（ストリームは前置き許容で回復できる）
+#   truncated : 途中で切れた JSON
+#   missing   : 1頭欠けている
+#   bad_value : 数値であるべき値が文字列
+MALFORMED_KINDS = ("prose", "truncated", "missing", "bad_value")
+
+HORSES_HEADER = "【出走馬データ】"
+
+# ストリーム時の1イベントあたりの文字数
+STREAM_CHUNK_CHARS = 24
+
+
+def parse_latency(spec: str):
+    """
+    "fixed:2" / "uniform:1,5" / "lognormal:4,0.5"（中央値 4 秒・σ 0.5）→ rng を受け取り秒数を返す関数。
+    "0" または空なら待たない。
+    """
+    if not spec or spec == "0":
+        return lambda rng: 0.0
+    kind, _, params = spec.partition(":")
+    try:
+        values = [float(v) for v in params.split(",") if v.strip()]
+    except ValueError:
+        raise ValueError(f"応答時間の指定が不正です: {spec}")
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"応答時間の指定が不正です: {spec}（{' / '.join(LATENCY_KINDS)}）")
+
+
+# =========================
+# 予測の生成
+# =========================
+def prompt_text(payload: dict) -> str:
+    """input の最後の user メッセージ（文字列または input_text の配列）"""
+    items = payload.get("input")
+    if isinstance(items, str):
+        return items
+    for item in reversed(items or []):
+        if item.get("role") != "user":
+            continue
+        content = item.get("content")
+        if isinstance(content, str):
+            return content
+        return "".join(c.get("text", "") for c in content or [] if isinstance(c, dict))
+    return ""
+
+
+def horses_from_prompt(prompt: str) -> list:
+    """【出走馬データ】直後の JSON 配列を読む。読めなければ horse_number だけ拾う"""
+    head, _, rest = prompt.partition(HORSES_HEADER)
+    if rest:
+        line = rest.strip().split("\n", 1)[0]
+        try:
+            horses = json.loads(line)
+            if isinstance(horses, list):
+                # 取得途中の行（馬番が NaN など）は予測対象外
+                return [h for h in horses if isinstance(h, dict) and _finite_number(h.get("horse_number"))]
+        except ValueError:
+            pass
+    numbers = sorted({int(n) for n in re.findall(r'"horse_number":\s*(\d+)', prompt)})
+    return [{"horse_number": n} for n in numbers]
+
+
+def _finite_number(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+
+
+def make_prediction(prompt: str) -> list:
+    """プロンプトから決定的に作る（正規化前・% 単位の）予測。脚質と騎手のコース勝率を少し効かせる"""
+    seed = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+    rng = random.Random(seed)
+    out = []
+    for h in horses_from_prompt(prompt):
+        strength = rng.uniform(1, 20)
+        for key, weight in (("running_style_score_0to1", 5.0), ("jockey_course_win_rate", 0.3)):
+            v = h.get(key)
+            if isinstance(v, (int, float)) and v == v:
+                strength += weight * v
+        out.append({
+            "horse_number": int(h["horse_number"]),
+            "horse_name": h.get("horse_name", ""),
+            "win_rate": round(strength, 2),
+            "top2_rate": round(min(100.0, strength * rng.uniform(1.6, 2.2)), 2),
+            "top3_rate": round(min(100.0, strength * rng.uniform(2.2, 3.0)), 2),
+        })
+    return sorted(out, key=lambda x: x["horse_number"])
+
+
+def output_encoder(payload: dict):
+    """予測（dict の list）→ 応答テキスト。json_schema 指定時はスキーマの項目だけをスキーマの形で返す"""
+    fmt = (payload.get("text") or {}).get("format") or {}
+    if fmt.get("type") != "json_schema":
+        return lambda prediction: json.dumps(prediction, ensure_ascii=False)
+
+    props = fmt.get("schema", {}).get("properties") or {"horses": {}}
+    root = next(iter(props))
+    keys = list(props[root].get("items", {}).get("properties", {}))
+
+    def encode(prediction):
+        horses = [{k: h[k] for k in keys if k in h} if keys else h for h in prediction]
+        return json.dumps({root: horses}, ensure_ascii=False)
+
+    return encode
+
+
+def corrupt(text: str, prediction: list, kind: str, rng: random.Random, encode=None) -> str:
+    encode = encode or (lambda p: json.dumps(p, ensure_ascii=False))
+    if kind == "prose":
+        return f"以下が予測結果です。\n```json\n{text}\n```\n以上です。"
+    if kind == "truncated":
+        return text[: rng.randint(1, max(len(text) - 2, 1))]
+    if kind == "missing" and len(prediction) > 1:
+        dropped = list(prediction)
+        dropped.pop(rng.randrange(len(dropped)))
+        return encode(dropped)
+    broken = [dict(h) for h in prediction]
+    broken[rng.randrange(len(broken))]["win_rate"] = "高い"
+    return encode(broken)
+
+
+# =========================
+# サーバ状態
+# =========================
+class MockState:
+    def __init__(self, latency: str = "0", error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 malformed_rate: float = 0.0, malformed_kinds=MALFORMED_KINDS, retry_after: float = 1.0,
+                 seed: int = 0):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.malformed_kinds = tuple(malformed_kinds)
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {"requests": 0, "ok": 0, "server_error": 0, "rate_limited": 0, "malformed": 0,
+                           "stream": 0, "disconnected": 0}
+            self.malformed_by_kind = {k: 0 for k in self.malformed_kinds}
+            self.inflight = 0
+            self.max_inflight = 0
+            self.sequence = 0
+
+    def draw(self) -> dict:
+        """1リクエスト分の振る舞い（結果・応答時間・破損の種類）を決める"""
+        with self.lock:
+            self.sequence += 1
+            self.counts["requests"] += 1
+            r = self.rng.random()
+            if r < self.rate_limit_rate:
+                outcome = "rate_limited"
+            elif r < self.rate_limit_rate + self.error_rate:
+                outcome = "server_error"
+            elif self.rng.random() < self.malformed_rate and self.malformed_kinds:
+                outcome = "malformed"
+            else:
+                outcome = "ok"
+            kind = self.rng.choice(self.malformed_kinds) if outcome == "malformed" else None
+            self.counts[outcome] += 1
+            if kind:
+                self.malformed_by_kind[kind] += 1
+            return {
+                "id": self.sequence,
+                "outcome": outcome,
+                "latency": self.latency(self.rng),
+                "kind": kind,
+                "rng": random.Random(self.rng.random()),
+            }
+
+    def enter(self):
+        with self.lock:
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+
+    def leave(self):
+        with self.lock:
+            self.inflight -= 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counts, "malformed_by_kind": dict(self.malformed_by_kind),
+                    "inflight": self.inflight, "max_inflight": self.max_inflight}
+
+
+def response_object(resp_id: str, model: str, text: str, status: str = "completed") -> dict:
+    return {
+        "id": resp_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": status,
+        "model": model,
+        "output": [{
+            "type": "message",
+            "id": f"msg_{resp_id}",
+            "status": status,
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0},
+    }
+
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def _reply(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _wait_client(self, seconds: float):
+            """
+            応答前の待ち。途中でクライアントが接続を閉じたら ConnectionResetError
+            （非ストリームのヘッジ負け・締切での打ち切りも「切断」として数えるため）。
+            """
+            end = time.monotonic() + seconds
+            while True:
+                left = end - time.monotonic()
+                if left <= 0:
+                    return
+                readable, _, _ = select.select([self.connection], [], [], min(left, 0.05))
+                if not readable:
+                    continue
+                try:
+                    data = self.connection.recv(1, socket.MSG_PEEK)
+                except OSError:
+                    data = b""
+                if not data:
+                    raise ConnectionResetError("client closed")
+                time.sleep(min(left, 0.05))
+
+        def _error(self, status: int, message: str, etype: str, headers: dict = None):
+            self._reply(status, {"error": {"message": message, "type": etype, "param": None, "code": None}}, headers)
+
+        def do_POST(self):
+            if self.path.rstrip("/") not in ("/v1/responses", "/responses"):
+                self._error(404, f"Unknown path: {self.path}", "invalid_request_error")
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._error(400, "invalid json", "invalid_request_error")
+                return
+
+            plan = state.draw()
+            state.enter()
+            try:
+                self._respond(payload, plan)
+            except (BrokenPipeError, ConnectionResetError):
+                # ヘッジ負け・締切でクライアントが切断した
+                with state.lock:
+                    state.counts["disconnected"] += 1
+            finally:
+                state.leave()
+
+        def _respond(self, payload: dict, plan: dict):
+            stream = bool(payload.get("stream"))
+            if plan["outcome"] == "rate_limited":
+                time.sleep(min(plan["latency"], 0.05))
+                self._error(429, "Rate limit reached for requests", "requests",
+                            {"Retry-After": f"{state.retry_after:g}"})
+                return
+            if plan["outcome"] == "server_error":
+                time.sleep(plan["latency"] * 0.5)
+                self._error(500, "The server had an error while processing your request.", "server_error")
+                return
+
+            prediction = make_prediction(prompt_text(payload))
+            encode = output_encoder(payload)
+            text = encode(prediction)
+            if plan["kind"]:
+                text = corrupt(text, prediction, plan["kind"], plan["rng"], encode)
+
+            resp_id = f"resp_mock_{plan['id']}"
+            model = payload.get("model", "mock")
+            if not stream:
+                self._wait_client(plan["latency"])
+                self._reply(200, response_object(resp_id, model, text))
+                return
+
+            with state.lock:
+                state.counts["stream"] += 1
+            self._stream(resp_id, model, text, plan["latency"])
+
+        def _stream(self, resp_id: str, model: str, text: str, latency: float):
+            """最初の断片まで応答時間の 3 割、残りを断片ごとに均等に待つ"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+
+            seq = iter(range(1_000_000))
+
+            def send(event: str, data: dict):
+                data = {"type": event, "sequence_number": next(seq), **data}
+                self.wfile.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            send("response.created", {"response": response_object(resp_id, model, "", "in_progress")})
+            chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+            time.sleep(latency * 0.3)
+            per_chunk = latency * 0.7 / len(chunks)
+            item = {"item_id": f"msg_{resp_id}", "output_index": 0, "content_index": 0}
+            for chunk in chunks:
+                send("response.output_text.delta", {**item, "delta": chunk, "logprobs": []})
+                if per_chunk:
+                    time.sleep(per_chunk)
+            send("response.output_text.done", {**item, "text": text, "logprobs": []})
+            send("response.completed", {"response": response_object(resp_id, model, text)})
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self._reply(200, state.stats())
+            else:
+                self._error(404, f"Unknown path: {self.path}", "invalid_request_error")
+
+    return Handler
+
+
+def start_server(port: int = 0, **config):
+    """バックグラウンドで起動し (server, state) を返す。port=0 で空きポート"""
+    state = MockState(**config)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", default="lognormal:4,0.5",
+                        help="応答時間の分布（fixed:S / uniform:A,B / lognormal:中央値,σ / 0）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500 を返す割合")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="429 を返す割合")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 の Retry-After（秒）")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="出力を破損させる割合")
+    parser.add_argument("--malformed-kinds", default=",".join(MALFORMED_KINDS),
+                        help=f"破損の種類（カンマ区切り: {', '.join(MALFORMED_KINDS)}）")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def config_from_args(args) -> dict:
+    kinds = [k.strip() for k in args.malformed_kinds.split(",") if k.strip()]
+    unknown = [k for k in kinds if k not in MALFORMED_KINDS]
+    if unknown:
+        raise ValueError(f"未対応の破損の種類: {', '.join(unknown)}")
+    parse_latency(args.latency)
+    return {
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+        "retry_after": args.retry_after,
+        "malformed_rate": args.malformed_rate,
+        "malformed_kinds": kinds,
+        "seed": args.seed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI Responses API のローカル代替サーバ")
+    parser.add_argument("--port", type=int, default=8766)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        config = config_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(MockState(**config)))
+    server.daemon_threads = True
+    print(f"[INFO] OpenAI 代替サーバ: http://127.0.0.1:{args.port}/v1 （統計: /stats）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,8 +1,16 @@
-import sys
-import os
+import argparse
+import csv
+import glob
 import json
-import pandas as pd
-import requests
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import metrics
+import profiling
+from notify_outbox import OUTBOX_FILE_NAME, NotificationOutbox
 
 # ==============================
 # 設定
@@ -22,6 +30,18 @@ COURSE_CODE_MAP = {
 }
 DISCORD_WEBHOOK_URL = None
 
+# Discord のサイズ上限
+DISCORD_MESSAGE_LIMIT = 2000
+DISCORD_EMBED_DESCRIPTION_LIMIT = 4096
+DISCORD_EMBEDS_PER_MESSAGE = 10
+DISCORD_EMBED_TOTAL_LIMIT = 6000
+
+PACK_MODES = ("none", "text", "embeds")
+
+# 429 応答時の最大再送回数
+MAX_RATE_LIMIT_RETRIES = 5
+REQUEST_TIMEOUT_SECONDS = 15
+
 # JRA枠番カラー対応（整数キーに変更）
 WAKU_COLOR_MAP = {
     1: "⬜",
@@ -85,13 +105,34 @@ def extract_course_code_from_filename(filename: str) -> str:
     return race_id[8:10]
 
 def load_common_info(csv_path: str) -> dict:
-    df = pd.read_csv(csv_path)
+    # 先頭行の2項目だけ読めばよいので pandas は使わない
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        row = next(csv.DictReader(f), {})
     return {
-        "date_info": str(df["date_info"].iloc[0]),
-        "race_title": str(df["race_title"].iloc[0]),
+        "date_info": str(row.get("date_info", "")),
+        "race_title": str(row.get("race_title", "")),
     }
 
 
+def resolve_webhook_name(json_path: str) -> str:
+    course_code = extract_course_code_from_filename(json_path)
+    if course_code not in COURSE_CODE_MAP:
+        raise RuntimeError(f"未対応の開催場コード: {course_code}")
+    return COURSE_CODE_MAP[course_code]
+
+
+def webhook_url_for(name: str) -> str:
+    env_key = f"DISCORD_WEBHOOK_URL_{name}"
+    url = os.environ.get(env_key)
+    if not url:
+        raise RuntimeError(f"{env_key} が環境変数に設定されていません")
+    return url
+
+
+def resolve_webhook_url(json_path: str) -> str:
+    return webhook_url_for(resolve_webhook_name(json_path))
+
+
 def load_predictions(json_path: str) -> list:
     with open(json_path, "r", encoding="utf-8") as f:
         return json.load(f)
@@ -122,9 +163,121 @@ def format_prediction_table(predictions: list) -> str:
 # ==============================
 # Discord通知
 # ==============================
-def send_to_discord(message: str):
+class RateLimitBucket:
+    """
+    Webhook ごとのレート制限状態。
+    X-RateLimit-Remaining / X-RateLimit-Reset-After を記録し、残数 0 ならリセットまで待つ。
+    """
+
+    def __init__(self):
+        self.remaining = None
+        self.reset_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> float:
+        delay = 0.0
+        if self.remaining == 0:
+            delay = max(self.reset_at - time.monotonic(), 0.0)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def update(self, headers):
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None:
+            self.remaining = int(float(remaining))
+        if reset_after is not None:
+            self.reset_at = time.monotonic() + float(reset_after)
+
+
+def retry_after_seconds(r) -> float:
+    # Retry-After ヘッダ優先、無ければ JSON の retry_after（秒）
+    header = r.headers.get("Retry-After")
+    if header is not None:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    try:
+        return float(r.json().get("retry_after", 1.0))
+    except Exception:
+        return 1.0
+
+
+class DiscordClient:
+    """
+    1プロセスで全レースを送るための送信クライアント。
+    - 送信先ホストごとに requests.Session を共有（接続を再利用）
+    - Webhook ごとにレート制限バケットを保持
+    - 429 は Retry-After だけ待って自動再送
+    """
+
+    def __init__(self, max_retries: int = MAX_RATE_LIMIT_RETRIES, timeout: float = REQUEST_TIMEOUT_SECONDS):
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.sessions = {}
+        self.buckets = {}
+        self.requests_sent = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def _session(self, url: str):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+                session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def _bucket(self, url: str) -> RateLimitBucket:
+        with self._lock:
+            return self.buckets.setdefault(url, RateLimitBucket())
+
+    def post(self, url: str, payload: dict):
+        session = self._session(url)
+        bucket = self._bucket(url)
+
+        with bucket.lock:
+            for attempt in range(self.max_retries + 1):
+                metrics.rate_wait("discord", bucket.wait())
+                r = session.post(url, json=payload, timeout=self.timeout)
+                self.requests_sent += 1
+                bucket.update(r.headers)
+
+                if r.status_code != 429:
+                    r.raise_for_status()
+                    return r
+
+                self.rate_limited += 1
+                metrics.inc("keiba_rate_limited_total", limiter="discord")
+                if attempt == self.max_retries:
+                    r.raise_for_status()
+                delay = retry_after_seconds(r)
+                print(f"[WARN] Discord レート制限 (429): {delay:.2f}s 待機 ({attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+                metrics.rate_wait("discord", delay)
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+
+
+def send_to_discord(message: str, webhook_url: str = None, client: DiscordClient = None):
     payload = {"content": message}
-    r = requests.post(DISCORD_WEBHOOK_URL, json=payload)
+    url = webhook_url or DISCORD_WEBHOOK_URL
+    if client is not None:
+        client.post(url, payload)
+        return
+
+    import requests
+
+    r = requests.post(url, json=payload, timeout=REQUEST_TIMEOUT_SECONDS)
     r.raise_for_status()
 
 
@@ -146,29 +299,114 @@ def build_discord_message(common: dict, race_number: str, predictions: list) ->
 
 
 # ==============================
-# main
+# メッセージ分割・集約
 # ==============================
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: python notify_discord.py <result.json> <race_info.csv>")
-        sys.exit(1)
+FENCE = "```"
 
-    json_path = sys.argv[1]
-    csv_path = sys.argv[2]
 
-    # --- 開催場判定 ---
-    course_code = extract_course_code_from_filename(json_path)
-    if course_code not in COURSE_CODE_MAP:
-        raise RuntimeError(f"未対応の開催場コード: {course_code}")
+def _fence_open(text: str) -> bool:
+    return text.count(FENCE) % 2 == 1
 
-    env_key = f"DISCORD_WEBHOOK_URL_{COURSE_CODE_MAP[course_code]}"
-    global DISCORD_WEBHOOK_URL
-    DISCORD_WEBHOOK_URL = os.environ.get(env_key)
 
-    if not DISCORD_WEBHOOK_URL:
-        raise RuntimeError(f"{env_key} が環境変数に設定されていません")
+def split_message(message: str, limit: int = DISCORD_MESSAGE_LIMIT) -> list:
+    """
+    上限を超えるメッセージを空行（馬ごとの区切り）単位で分割する。
+    表の途中で切れる場合はコードブロックを閉じ、次の塊で開き直す。
+    """
+    if len(message) <= limit:
+        return [message]
+
+    chunks = []
+    cur = ""
+    for unit in message.split("\n\n"):
+        candidate = f"{cur}\n\n{unit}" if cur else unit
+        closing = f"\n{FENCE}" if _fence_open(candidate) else ""
+        if len(candidate) + len(closing) <= limit:
+            cur = candidate
+            continue
+
+        if cur:
+            reopen = _fence_open(cur)
+            chunks.append(cur + (f"\n{FENCE}" if reopen else ""))
+            cur = (f"{FENCE}\n" if reopen else "") + unit
+        else:
+            cur = unit
+
+        # 1塊だけで上限を超える場合は文字数で強制分割
+        while len(cur) > limit:
+            chunks.append(cur[:limit])
+            cur = cur[limit:]
+
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+def _blocks(messages: list, limit: int):
+    # (元メッセージの番号, 分割後の塊)
+    for i, m in enumerate(messages):
+        for block in split_message(m, limit):
+            yield i, block
+
+
+def pack_text(messages: list, limit: int = DISCORD_MESSAGE_LIMIT) -> list:
+    """
+    同一 Webhook 宛ての連続メッセージを content 上限内でできるだけまとめる。
+    戻り値は [(payload, 含まれる元メッセージ番号の集合), ...]
+    """
+    packed = []
+    for i, block in _blocks(messages, limit):
+        if packed and len(packed[-1][0]) + 2 + len(block) <= limit:
+            packed[-1][0] = f"{packed[-1][0]}\n\n{block}"
+            packed[-1][1].add(i)
+        else:
+            packed.append([block, {i}])
+    return [({"content": c}, src) for c, src in packed]
+
 
-    # --- データ読込 ---
+def pack_embeds(messages: list) -> list:
+    """
+    1レース = 1 embed とし、1投稿あたり最大10 embed・合計6000文字まで詰める。
+    戻り値は [(payload, 含まれる元メッセージ番号の集合), ...]
+    """
+    packed = []
+    total = 0
+    for i, block in _blocks(messages, DISCORD_EMBED_DESCRIPTION_LIMIT):
+        embeds = packed[-1][0]["embeds"] if packed else None
+        if (embeds is None or len(embeds) >= DISCORD_EMBEDS_PER_MESSAGE
+                or total + len(block) > DISCORD_EMBED_TOTAL_LIMIT):
+            packed.append(({"embeds": []}, set()))
+            embeds = packed[-1][0]["embeds"]
+            total = 0
+        embeds.append({"description": block})
+        packed[-1][1].add(i)
+        total += len(block)
+    return packed
+
+
+def pack_payloads(messages: list, mode: str = "embeds") -> list:
+    if mode == "text":
+        return pack_text(messages)
+    if mode == "embeds":
+        return pack_embeds(messages)
+    return [({"content": block}, {i}) for i, block in _blocks(messages, DISCORD_MESSAGE_LIMIT)]
+
+
+def group_consecutive(items: list) -> list:
+    """[(url, message), ...] を連続する同一 url ごとにまとめる"""
+    groups = []
+    for url, message in items:
+        if groups and groups[-1][0] == url:
+            groups[-1][1].append(message)
+        else:
+            groups.append((url, [message]))
+    return groups
+
+
+# ==============================
+# レース単位の通知
+# ==============================
+def build_race_message(json_path: str, csv_path: str) -> str:
     race_number = extract_race_number_from_filename(json_path)
     common_info = load_common_info(csv_path)
     predictions = load_predictions(json_path)
@@ -176,8 +414,266 @@ def main():
     # 勝率順にソート
     predictions = sorted(predictions, key=lambda x: x["win_rate"], reverse=True)
 
-    message = build_discord_message(common_info, race_number, predictions)
-    send_to_discord(message)
+    return build_discord_message(common_info, race_number, predictions)
+
+
+def find_race_pairs(date_dir: str) -> list:
+    """日付ディレクトリ内の (json, aiready.csv) の組を時刻順（ファイル名順）で返す"""
+    pairs = []
+    for csv_path in sorted(glob.glob(os.path.join(date_dir, "*_aiready.csv"))):
+        json_path = f"{os.path.splitext(csv_path)[0]}.json"
+        if os.path.exists(json_path):
+            pairs.append((json_path, csv_path))
+        else:
+            print(f"⚠ json が存在しないためスキップ: {json_path}")
+    return pairs
+
+
+def extract_race_id_from_filename(filename: str) -> str:
+    return os.path.basename(filename).split("_")[0]
+
+
+def enqueue_date_dir(date_dir: str, outbox: NotificationOutbox) -> int:
+    """日付ディレクトリの全レースをアウトボックスに登録する。戻り値は作成失敗数"""
+    failed = 0
+    result = {"queued": 0, "update": 0, "skipped": 0}
+
+    for json_path, csv_path in find_race_pairs(date_dir):
+        try:
+            status = outbox.enqueue(
+                extract_race_id_from_filename(json_path),
+                resolve_webhook_name(json_path),
+                build_race_message(json_path, csv_path),
+            )
+            result[status] += 1
+        except Exception as e:
+            failed += 1
+            print(f"[ERROR] 通知作成失敗: {json_path} ({e})")
+
+    print(f"アウトボックス登録: 新規 {result['queued']} / 更新 {result['update']} / "
+          f"送信済みのためスキップ {result['skipped']}")
+    return failed
+
+
+def drain_outbox(outbox: NotificationOutbox, client: DiscordClient, pack: str = "embeds",
+                 webhook: str = None) -> int:
+    """未送信分を Webhook ごとにまとめて送る（webhook 指定時はその開催場だけ）。送れたレースだけ送信済みにする"""
+    entries = [e for e in outbox.pending() if webhook is None or e["webhook"] == webhook]
+    if not entries:
+        return 0
+    failed = 0
+    sent = 0
+    posts = 0
+    saved_total = 0
+
+    for webhook, group in group_consecutive([(e["webhook"], e) for e in entries]):
+        try:
+            url = webhook_url_for(webhook)
+        except RuntimeError as e:
+            failed += len(group)
+            metrics.error("notify")
+            print(f"[ERROR] {e}")
+            continue
+
+        payloads = pack_payloads([e["message"] for e in group], pack)
+        failed_idx = set()
+        posted = []  # 投稿できた payload の src（元レースの添字集合）
+        for payload, src in payloads:
+            if src & failed_idx:
+                # 分割済みレースの後半だけ届くのを避ける
+                failed_idx |= src
+                continue
+            try:
+                client.post(url, payload)
+                posted.append(src)
+            except Exception as e:
+                failed_idx |= src
+                metrics.error("notify")
+                print(f"[ERROR] 通知失敗: {e}")
+
+        delivered = [e for i, e in enumerate(group) if i not in failed_idx]
+        outbox.mark_sent(delivered)
+        # 削減数 = 1レース1投稿なら要った投稿数 − 届いたレースのために実際に行った投稿数
+        # （長いレースの分割投稿も数えるため負になりうるので 0 で止める。429 の再送は HTTP 回数側に出る）
+        venue_posts = sum(1 for src in posted if not src & failed_idx)
+        saved = max(len(delivered) - venue_posts, 0)
+        print(f"  {webhook}: {len(delivered)} レース / 投稿 {venue_posts} 回（{saved} 回削減）/ 失敗 {len(failed_idx)} 件")
+        sent += len(delivered)
+        posts += len(posted)
+        saved_total += saved
+        failed += len(failed_idx)
+        metrics.progress("notified", len(delivered))
+
+    print(f"Discord通知完了: {sent} レース / 投稿 {posts} 回（{saved_total} 回削減）/ 失敗 {failed} 件 / "
+          f"HTTP {client.requests_sent} 回（429: {client.rate_limited} 回）")
+    return failed
+
+
+def enqueue_race(json_path: str, csv_path: str, outbox: NotificationOutbox) -> str:
+    """1レースをアウトボックスに登録する。戻り値は NotificationOutbox.enqueue と同じ"""
+    return outbox.enqueue(
+        extract_race_id_from_filename(json_path),
+        resolve_webhook_name(json_path),
+        build_race_message(json_path, csv_path),
+    )
+
+
+@profiling.profiled("notify", "json_path")
+def notify_race(json_path: str, csv_path: str, outbox: NotificationOutbox, client: DiscordClient,
+                pack: str = "embeds") -> int:
+    """1レースを登録して直ちに送信する。戻り値は失敗数"""
+    enqueue_race(json_path, csv_path, outbox)
+    # 同時に送ると同一レースが二重送信されうるため、送信は1本に絞る
+    with outbox.lock:
+        return drain_outbox(outbox, client, pack)
+
+
+# ==============================
+# オーケストレータ用のまとめ送信
+# ==============================
+DEFAULT_BATCH_SECONDS = 20.0
+
+
+class NotifyBatcher:
+    """
+    notify ステージは登録だけを行い、送信は
+      - 開催場の最後のレース（expect で登録した分）が揃った時点でその開催場を、
+      - それ以前は最初の登録から delay 秒後に未送信分すべてを
+    まとめて行う。1レースずつ送ると pack_payloads が複数レースを1投稿に詰められないため。
+    delay <= 0 なら登録のたびにその開催場を送る（直前更新のデーモン用）。
+    """
+
+    def __init__(self, outbox: NotificationOutbox, client: DiscordClient, pack: str = "embeds",
+                 delay: float = DEFAULT_BATCH_SECONDS):
+        self.outbox = outbox
+        self.client = client
+        self.pack = pack
+        self.delay = delay
+        self.remaining = {}  # 開催場名 → 未登録のレース数
+        self.failed = 0
+        self.timer = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def expect(self, race_id: str):
+        """この実行で通知する予定のレース（開催場ごとの「最後のレース」の判定に使う）"""
+        try:
+            webhook = resolve_webhook_name(race_id)
+        except RuntimeError:
+            return
+        with self.lock:
+            self.remaining[webhook] = self.remaining.get(webhook, 0) + 1
+
+    @profiling.profiled("notify", "json_path")
+    def add(self, json_path: str, csv_path: str) -> str:
+        result = enqueue_race(json_path, csv_path, self.outbox)
+        webhook = resolve_webhook_name(json_path)
+        with self.lock:
+            left = self.remaining.get(webhook)
+            if left is not None:
+                left = self.remaining[webhook] = left - 1
+            venue_done = left is not None and left <= 0
+            if not venue_done and self.delay > 0 and self.timer is None:
+                self.timer = threading.Timer(self.delay, self._on_timer)
+                self.timer.daemon = True
+                self.timer.start()
+        if venue_done or self.delay <= 0:
+            self.flush(webhook)
+        return result
+
+    def _on_timer(self):
+        # close() 後に発火したタイマーは何もしない（最終送信は close() が行う）
+        with self.lock:
+            if self.closed:
+                return
+            self.timer = None
+        self.flush()
+
+    def flush(self, webhook: str = None) -> int:
+        if webhook is None:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+        # 同時に送ると同一レースが二重送信されうるため、送信は1本に絞る
+        with self.outbox.lock:
+            failed = drain_outbox(self.outbox, self.client, self.pack, webhook)
+        with self.lock:
+            self.failed += failed
+        return failed
+
+    def close(self) -> int:
+        """残りをすべて送る。戻り値はこれまでの失敗数の合計
+
+        送信中のタイマーがあれば終わるまで待ってから最終送信するため、
+        戻り値に取りこぼしはない。
+        """
+        with self.lock:
+            self.closed = True
+            timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
+            if timer is not threading.current_thread():
+                timer.join()
+        self.flush()
+        with self.lock:
+            return self.failed
+
+
+@profiling.profiled("notify", "date_dir")
+def notify_batch(date_dir: str, client: DiscordClient = None, pack: str = "embeds",
+                 outbox_path: str = None) -> int:
+    own_client = client is None
+    client = client or DiscordClient()
+    outbox = NotificationOutbox(outbox_path or os.path.join(date_dir, OUTBOX_FILE_NAME))
+
+    try:
+        failed = enqueue_date_dir(date_dir, outbox)
+        failed += drain_outbox(outbox, client, pack)
+    finally:
+        outbox.close()
+        if own_client:
+            client.close()
+    return failed
+
+
+# ==============================
+# main
+# ==============================
+def main():
+    parser = argparse.ArgumentParser(description="予測結果を Discord に通知する")
+    parser.add_argument("json_path", nargs="?", help="予測結果 json")
+    parser.add_argument("csv_path", nargs="?", help="対応する *_aiready.csv")
+    parser.add_argument("--batch", metavar="DATE_DIR", help="日付ディレクトリ内の全レースを1プロセスで送信")
+    parser.add_argument("--pack", choices=PACK_MODES, default="embeds",
+                        help="--batch 時の集約方法（none: 1レース1投稿 / text: 2000文字まで連結 / embeds: embed に詰める）")
+    parser.add_argument("--outbox", default=None,
+                        help=f"--batch 時のアウトボックス（既定: <DATE_DIR>/{OUTBOX_FILE_NAME}）")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"cProfile / tracemalloc の結果を profile/ に出力（{profiling.PROFILE_ENV}=1 と同じ）")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.profile:
+        profiling.enable()
+    metrics.start_from_args(args)
+
+    if args.batch:
+        failed = notify_batch(args.batch, pack=args.pack, outbox_path=args.outbox)
+        sys.exit(1 if failed else 0)
+
+    if not (args.json_path and args.csv_path):
+        print("Usage: python notify_discord.py <result.json> <race_info.csv>")
+        print("       python notify_discord.py --batch race_data_YYYYMMDD")
+        sys.exit(1)
+
+    # --- 開催場判定 ---
+    global DISCORD_WEBHOOK_URL
+    DISCORD_WEBHOOK_URL = resolve_webhook_url(args.json_path)
+
+    with profiling.stage("notify", os.path.dirname(args.json_path) or "."):
+        message = build_race_message(args.json_path, args.csv_path)
+        send_to_discord(message)
 
     print("Discord通知完了")
 
@@ -0,0 +1,130 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+# ==============================
+# 通知アウトボックス（SQLite）
+# ==============================
+# (race_id, webhook, content_hash) を主キーに通知を記録し、
+# 再実行時は未送信分だけを送る。内容が変わったレースは「更新」として再送する。
+# keiba run は送信済みのレースを予測からやり直さない（GitHub Actions ではこのファイルを
+# actions/cache で実行をまたいで引き継ぐ）。
+
+OUTBOX_FILE_NAME = "notify_outbox.sqlite"
+
+UPDATE_PREFIX = "🔄 **予想更新**"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    race_id      TEXT NOT NULL,
+    webhook      TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    message      TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',
+    is_update    INTEGER NOT NULL DEFAULT 0,
+    created_at   REAL NOT NULL,
+    sent_at      REAL,
+    PRIMARY KEY (race_id, webhook, content_hash)
+);
+CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, race_id);
+"""
+
+
+def content_hash(message: str) -> str:
+    return hashlib.sha256(message.encode("utf-8")).hexdigest()
+
+
+class NotificationOutbox:
+    """
+    webhook には URL ではなく開催場名（COURSE_CODE_MAP の値）を保存する。
+    URL は秘密情報のため、送信時に環境変数から解決する。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # オーケストレータでは複数スレッドから使うため、接続は共有しロックで直列化する
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.RLock()
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, race_id: str, webhook: str, message: str) -> str:
+        """
+        戻り値: "skipped"（送信済み/送信待ちと同一）/ "queued" / "update"
+        """
+        h = content_hash(message)
+        with self.lock, self.conn:
+            pending = self.conn.execute(
+                "SELECT 1 FROM outbox WHERE race_id=? AND webhook=? AND content_hash=? AND status='pending'",
+                (race_id, webhook, h),
+            ).fetchone()
+            if pending is not None:
+                return "skipped"
+
+            # 最後に届けた内容と同一なら送らない
+            latest = self.conn.execute(
+                "SELECT content_hash FROM outbox WHERE race_id=? AND webhook=? AND status='sent' "
+                "ORDER BY sent_at DESC LIMIT 1",
+                (race_id, webhook),
+            ).fetchone()
+            if latest is not None and latest["content_hash"] == h:
+                return "skipped"
+            is_update = latest is not None
+
+            # 未送信の古い内容は送らない
+            self.conn.execute(
+                "UPDATE outbox SET status='superseded' WHERE race_id=? AND webhook=? AND status='pending'",
+                (race_id, webhook),
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO outbox (race_id, webhook, content_hash, message, status, is_update, created_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+                (race_id, webhook, h, message, int(is_update), time.time()),
+            )
+        return "update" if is_update else "queued"
+
+    def pending(self) -> list:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT race_id, webhook, content_hash, message, is_update FROM outbox "
+                "WHERE status='pending' ORDER BY webhook, race_id"
+            ).fetchall()
+        out = []
+        for r in rows:
+            message = r["message"]
+            if r["is_update"]:
+                message = f"{UPDATE_PREFIX}\n{message}"
+            out.append({
+                "race_id": r["race_id"],
+                "webhook": r["webhook"],
+                "content_hash": r["content_hash"],
+                "message": message,
+            })
+        return out
+
+    def mark_sent(self, entries: list):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE outbox SET status='sent', sent_at=? WHERE race_id=? AND webhook=? AND content_hash=?",
+                [(now, e["race_id"], e["webhook"], e["content_hash"]) for e in entries],
+            )
+
+    def delivered_races(self) -> set:
+        """1件でも送信済みの race_id（keiba run の再実行ではこれらのレースを予測・通知し直さない）"""
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT race_id FROM outbox WHERE status='sent'").fetchall()
+        return {r["race_id"] for r in rows}
+
+    def counts(self) -> dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    def depth_metrics(self) -> list:
+        """metrics.set_collector 用。status ごとの件数"""
+        return [("keiba_queue_depth", {"queue": "outbox", "state": status}, n) for status, n in self.counts().items()]
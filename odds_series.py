@@ -0,0 +1,334 @@
+import argparse
+import glob
+import os
+import re
+import struct
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+
+from race_day_daemon import JST, post_datetime, read_post_time
+
+# ==============================
+# オッズ時系列（差分符号化のバイナリ）
+# ==============================
+# 使い方:
+#   python odds_series.py poll --date 20251207 --interval 60 --window-minutes 90
+#   python odds_series.py show race_data_20251207/odds/202512070611.odds
+#
+# 新聞ページの umaboddsBox（単勝オッズ・人気）を一定間隔で取得し、レースごとに
+#   race_data_YYYYMMDD/odds/{race_id}.odds
+# へ追記する。1スナップショットは「前回からの経過秒」と各馬の「前回値との差」を
+# zigzag + varint で並べただけのレコードで、オッズが動かない馬は 1 バイトで済む
+# （18頭・1分間隔・3時間で 1 レース 8KB 前後、1日 36 レースでも 1MB 未満）。
+# 読み込みは numpy で varint をまとめて復号し、(時刻数, 頭数) の行列で返す。
+
+ODDS_DIR_NAME = "odds"
+ODDS_SUFFIX = ".odds"
+
+MAGIC = b"KODS"
+VERSION = 1
+
+# オッズは 0.1 倍単位の整数で保存（0 は未発売・取消などの欠損）
+ODDS_SCALE = 10
+
+DEFAULT_INTERVAL_SECONDS = 60
+DEFAULT_WINDOW_MINUTES = 90
+
+_HEADER = struct.Struct("<4sBB")
+_BASE_TIME = struct.Struct("<I")
+
+
+# =========================
+# 符号化
+# =========================
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _varint(n: int, out: bytearray):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def encode_header(numbers: list, base_time: int) -> bytes:
+    return _HEADER.pack(MAGIC, VERSION, len(numbers)) + bytes(numbers) + _BASE_TIME.pack(base_time)
+
+
+def encode_record(dt: int, odds: list, popularity: list, prev_odds: list, prev_pop: list) -> bytes:
+    out = bytearray()
+    _varint(dt, out)
+    for cur, prev in zip(odds, prev_odds):
+        _varint(_zigzag(cur - prev), out)
+    for cur, prev in zip(popularity, prev_pop):
+        _varint(_zigzag(cur - prev), out)
+    return bytes(out)
+
+
+def decode_varints(buf: np.ndarray) -> tuple:
+    """
+    uint8 配列の varint 列をまとめて復号する（末尾の途中で切れた値は捨てる）。
+    (値, 各値の終端バイト位置) を返す。
+    """
+    ends = np.flatnonzero(buf < 0x80)
+    if not len(ends):
+        return np.zeros(0, dtype=np.int64), ends
+    buf = buf[:ends[-1] + 1]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shift = (np.arange(len(buf)) - starts[group]) * 7
+    parts = (buf & 0x7F).astype(np.int64) << shift
+    return np.bincount(group, weights=parts, minlength=len(ends)).astype(np.int64), ends
+
+
+# =========================
+# 読み書き
+# =========================
+@dataclass(slots=True)
+class OddsSeries:
+    race_id: str
+    numbers: np.ndarray      # (頭数,) 馬番
+    times: np.ndarray        # (時刻数,) UNIX 秒
+    odds: np.ndarray         # (時刻数, 頭数) 単勝オッズ（欠損は NaN）
+    popularity: np.ndarray   # (時刻数, 頭数) 人気（欠損は 0）
+
+    def at(self, when: float) -> np.ndarray:
+        """when 時点で最新のオッズ（それ以前のスナップショットがなければ NaN）"""
+        i = int(np.searchsorted(self.times, when, side="right")) - 1
+        return self.odds[i] if i >= 0 else np.full(len(self.numbers), np.nan, dtype=np.float32)
+
+
+def series_path(day_dir: str, race_id: str) -> str:
+    return os.path.join(day_dir, ODDS_DIR_NAME, f"{race_id}{ODDS_SUFFIX}")
+
+
+def load_series(path: str) -> OddsSeries:
+    return _read_series(path)[0]
+
+
+def _read_series(path: str) -> tuple:
+    """(OddsSeries, 完全なレコードまでのバイト数)"""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, n = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"オッズ時系列ファイルではありません: {path}")
+    numbers = np.frombuffer(data, dtype=np.uint8, count=n, offset=_HEADER.size).astype(np.int16)
+    body = _HEADER.size + n
+    (base_time,) = _BASE_TIME.unpack_from(data, body)
+
+    start = body + _BASE_TIME.size
+    values, ends = decode_varints(np.frombuffer(data, dtype=np.uint8, offset=start))
+    width = 1 + 2 * n
+    # 書き込み途中で止まった最後のレコードは捨てる
+    used = len(values) // width * width
+    records = values[:used].reshape(-1, width)
+    valid_bytes = start + (int(ends[used - 1]) + 1 if used else 0)
+
+    times = base_time + np.cumsum(records[:, 0])
+    deltas = records[:, 1:]
+    deltas = (deltas >> 1) ^ -(deltas & 1)
+    levels = np.cumsum(deltas, axis=0)
+
+    odds = levels[:, :n].astype(np.float32) / ODDS_SCALE
+    odds[levels[:, :n] == 0] = np.nan
+    race_id = os.path.basename(path)[:-len(ODDS_SUFFIX)]
+    return OddsSeries(race_id, numbers, times, odds, levels[:, n:].astype(np.int16)), valid_bytes
+
+
+def load_day(day_dir: str) -> dict:
+    """{race_id: OddsSeries}"""
+    out = {}
+    for path in sorted(glob.glob(os.path.join(day_dir, ODDS_DIR_NAME, f"*{ODDS_SUFFIX}"))):
+        series = load_series(path)
+        out[series.race_id] = series
+    return out
+
+
+def _to_int(s: str, scale: int = 1) -> int:
+    try:
+        return max(int(round(float(s) * scale)), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class OddsRecorder:
+    """レースごとの直前値を覚えておき、スナップショットを差分で追記する"""
+
+    def __init__(self, day_dir: str):
+        self.day_dir = day_dir
+        self.last = {}   # race_id -> (numbers, 時刻, オッズ, 人気)
+
+    def _state(self, race_id: str, path: str):
+        if race_id not in self.last and os.path.exists(path):
+            s, valid_bytes = _read_series(path)
+            if valid_bytes < os.path.getsize(path):
+                # 前回の書き込みが途中で止まっていたら、続きを正しい位置から書けるよう切り詰める
+                print(f"[WARN] 途中で切れたレコードを削除: {path}")
+                os.truncate(path, valid_bytes)
+            if len(s.times):
+                odds = [_to_int(v, ODDS_SCALE) if v == v else 0 for v in s.odds[-1].tolist()]
+                self.last[race_id] = (s.numbers.tolist(), int(s.times[-1]), odds, s.popularity[-1].tolist())
+            else:
+                self.last[race_id] = (s.numbers.tolist(), None, [0] * len(s.numbers), [0] * len(s.numbers))
+        return self.last.get(race_id)
+
+    def append(self, race_id: str, when: float, snapshot: dict) -> int:
+        """
+        snapshot: {馬番: (人気, オッズ)}（parse_odds_cells の文字列のまま）
+        ファイルの先頭で馬番の並びを固定し、以後に現れない馬は欠損として記録する。
+        書き込んだバイト数を返す。
+        """
+        path = series_path(self.day_dir, race_id)
+        state = self._state(race_id, path)
+        when = int(when)
+
+        header = b""
+        if state is None:
+            numbers = sorted(int(k) for k in snapshot if str(k).isdigit())
+            if not numbers:
+                return 0
+            header = encode_header(numbers, when)
+            state = (numbers, when, [0] * len(numbers), [0] * len(numbers))
+        numbers, last_time, prev_odds, prev_pop = state
+        last_time = when if last_time is None else last_time
+
+        odds, pops = [], []
+        for n in numbers:
+            pop, o = snapshot.get(n, snapshot.get(str(n), ("", "")))
+            odds.append(_to_int(o, ODDS_SCALE))
+            pops.append(_to_int(pop))
+
+        record = encode_record(max(when - last_time, 0), odds, pops, prev_odds, prev_pop)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(header + record)
+        self.last[race_id] = (numbers, max(when, last_time), odds, pops)
+        return len(header) + len(record)
+
+
+# =========================
+# ポーリング
+# =========================
+def parse_odds_snapshot(content: str) -> dict:
+    """新聞 HTML から {馬番: (人気, オッズ)}"""
+    from bs4 import BeautifulSoup
+
+    from race_info_collect import HORSE_CONTAINER_SELECTOR, get_text, parse_odds_cells
+
+    soup = BeautifulSoup(content, "lxml")
+    out = {}
+    for container in soup.select(HORSE_CONTAINER_SELECTOR):
+        number = get_text(container, "td.umabanBox")
+        if number.isdigit():
+            popularity, odds, _, _ = parse_odds_cells(container)
+            out[int(number)] = (popularity, odds)
+    return out
+
+
+def open_races(day_dir: str, date_str: str) -> list:
+    """[(race_id, 発走 datetime or None)]。出馬表（*_common.csv）から読む"""
+    races = []
+    for common_path in sorted(glob.glob(os.path.join(day_dir, "*_common.csv"))):
+        m = re.match(r"(\d{12})_", os.path.basename(common_path))
+        if m:
+            races.append((m.group(1), post_datetime(date_str, read_post_time(common_path))))
+    return races
+
+
+def poll(date_str: str, day_dir: str, interval: float, window_minutes: float, until: str,
+         min_delay: float = None) -> int:
+    """
+    発走 window_minutes 分前から発走までのレースを interval 秒ごとに取得する。
+    発走時刻が分からないレースは until（HH:MM）まで取得する。
+    """
+    import race_info_collect
+
+    min_delay = race_info_collect.REQUEST_DELAY_SECONDS if min_delay is None else min_delay
+    races = open_races(day_dir, date_str)
+    if not races:
+        print(f"[ERROR] 出馬表がありません（先に race_info_collect.py {date_str} を実行）: {day_dir}")
+        return 1
+
+    stop_at = post_datetime(date_str, until)
+    recorder = OddsRecorder(day_dir)
+    driver, wait = race_info_collect.create_driver()
+    written = 0
+    try:
+        while True:
+            now = datetime.now(JST)
+            targets = [
+                race_id for race_id, post in races
+                if (post is None and (stop_at is None or now < stop_at))
+                or (post is not None and post.timestamp() - window_minutes * 60 <= now.timestamp() < post.timestamp())
+            ]
+            remaining = [post for _, post in races if post is None or post > now]
+            if not remaining or (stop_at is not None and now >= stop_at):
+                break
+
+            sweep_started = time.time()
+            for race_id in targets:
+                url = race_info_collect.NEWSPAPER_URL_TEMPLATE.format(race_id=race_id)
+                content = race_info_collect.get_html_content_with_selenium(url, driver, wait, delay=min_delay)
+                if not content:
+                    print(f"[WARN] 取得失敗: {race_id}")
+                    continue
+                written += recorder.append(race_id, time.time(), parse_odds_snapshot(content))
+
+            elapsed = time.time() - sweep_started
+            if targets:
+                print(f"[OK] {now:%H:%M:%S} {len(targets)} レース取得 ({elapsed:.1f}s / 累計 {written / 1024:.1f} KiB)")
+            if elapsed > interval:
+                print(f"[WARN] 1巡 {elapsed:.0f}s が間隔 {interval:.0f}s を超えています（--window-minutes を短く）")
+            time.sleep(max(interval - elapsed, 0))
+    finally:
+        driver.quit()
+
+    print(f"=== ポーリング終了: {written / 1024:.1f} KiB ===")
+    return 0
+
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="単勝オッズの時系列取得")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("poll", help="一定間隔でオッズを取得して追記")
+    p.add_argument("--date", required=True, help="YYYYMMDD")
+    p.add_argument("--output-dir", default=None, help="既定: race_data_YYYYMMDD")
+    p.add_argument("--interval", type=float, default=DEFAULT_INTERVAL_SECONDS, help="1巡の間隔（秒）")
+    p.add_argument("--window-minutes", type=float, default=DEFAULT_WINDOW_MINUTES,
+                   help="発走の何分前から取得するか")
+    p.add_argument("--until", default="16:45", help="発走時刻不明のレースを取得する終了時刻（HH:MM）")
+    p.add_argument("--min-delay", type=float, default=None, help="ページ取得ごとの待機秒（既定: REQUEST_DELAY_SECONDS）")
+
+    s = sub.add_parser("show", help="保存済みの時系列を表示")
+    s.add_argument("paths", nargs="+")
+
+    args = parser.parse_args(argv)
+    if args.command == "poll":
+        return poll(args.date, args.output_dir or f"race_data_{args.date}", args.interval,
+                    args.window_minutes, args.until, args.min_delay)
+
+    for path in args.paths:
+        series = load_series(path)
+        print(f"=== {series.race_id}: {len(series.times)} 時点 × {len(series.numbers)} 頭 "
+              f"({os.path.getsize(path)} bytes) ===")
+        if len(series.times):
+            first = datetime.fromtimestamp(int(series.times[0]), JST)
+            last = datetime.fromtimestamp(int(series.times[-1]), JST)
+            print(f"  {first:%H:%M:%S} → {last:%H:%M:%S}")
+            for i, n in enumerate(series.numbers.tolist()):
+                print(f"  {n:>2}番  {series.odds[0, i]:7.1f} → {series.odds[-1, i]:7.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,86 @@
+import numpy as np
+
+# =========================
+# 設定
+# =========================
+PLACEMENT_METHODS = ("harville", "plackett_luce")
+
+# plackett_luce: 2着・3着争いの強さを p**λ で平坦化する指数
+# （λ=1 で Harville と一致。本命馬の 2・3 着率の過大評価を抑える）
+PL_DISCOUNT = (0.81, 0.65)
+
+_EPS = 1e-12
+
+
+# =========================
+# 勝率 → 連対率・3着内率（厳密計算）
+# =========================
+def _normalize(x: np.ndarray) -> np.ndarray:
+    total = x.sum(axis=-1, keepdims=True)
+    return np.divide(x, total, out=np.zeros_like(x), where=total > _EPS)
+
+
+def _safe_div(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den > _EPS)
+
+
+def placement_probs(win, method: str = "harville", discount=PL_DISCOUNT) -> np.ndarray:
+    """
+    勝率分布から各馬の [勝率, 連対率, 3着内率] を厳密に求める。
+    win は (頭数,) または (レース数, 頭数)。頭数が揃わない場合は 0 埋めでよい。
+    戻り値は (..., 頭数, 3) で、各列の合計は 1 / 2 / 3（頭数が足りる場合）。
+    """
+    if method not in PLACEMENT_METHODS:
+        raise ValueError(f"未対応の method: {method}")
+
+    p = np.asarray(win, dtype=float)
+    squeeze = p.ndim == 1
+    if squeeze:
+        p = p[None, :]
+
+    p = _normalize(np.clip(np.nan_to_num(p), 0.0, None))
+
+    if method == "harville":
+        s2, s3 = p, p
+    else:
+        s2 = _normalize(p ** discount[0])
+        s3 = _normalize(p ** discount[1])
+
+    n = p.shape[-1]
+    off_diag = ~np.eye(n, dtype=bool)
+
+    # 1着 j・2着 k の同時確率: p_j * s2_k / (1 - s2_j)
+    pair = _safe_div(p[:, :, None] * s2[:, None, :], (1.0 - s2)[:, :, None]) * off_diag
+    second = pair.sum(axis=1)
+
+    # 3着 i: Σ_{j≠k, i∉{j,k}} pair[j,k] * s3_i / (1 - s3_j - s3_k)
+    w = _safe_div(pair, 1.0 - s3[:, :, None] - s3[:, None, :]) * off_diag
+    total = w.sum(axis=(1, 2))[:, None]
+    third = s3 * (total - w.sum(axis=2) - w.sum(axis=1))
+
+    top2 = p + second
+    top3 = top2 + third
+    out = np.clip(np.stack([p, top2, top3], axis=-1), 0.0, 1.0)
+    return out[0] if squeeze else out
+
+
+# =========================
+# モデル出力とのブレンド
+# =========================
+def blend_rates(model_rates, derived, weight: float = 0.5) -> np.ndarray:
+    """
+    モデル自身の連対率・3着内率（合計 2 / 3 に正規化）と導出値を重み付き平均する。
+    勝率はモデル値をそのまま使い、win <= top2 <= top3 を保証して返す。
+    """
+    model_rates = np.clip(np.nan_to_num(np.asarray(model_rates, dtype=float)), 0.0, None)
+    derived = np.asarray(derived, dtype=float)
+
+    out = derived.copy()
+    for k in (1, 2):
+        model_k = _normalize(model_rates[..., k]) * (k + 1)
+        out[..., k] = (1.0 - weight) * model_k + weight * derived[..., k]
+
+    out = np.clip(out, 0.0, 1.0)
+    out[..., 1] = np.maximum(out[..., 1], out[..., 0])
+    out[..., 2] = np.maximum(out[..., 2], out[..., 1])
+    return out
@@ -1,93 +1,65 @@
 import argparse
-import pandas as pd
+import numpy as np
 import json
+import math
 import os
 import re
-from openai import OpenAI
+from typing import TYPE_CHECKING
+
+from ensemble import POOL_METHODS, combine, member_label, parse_members, run_members
+import metrics
+from feature_registry import NUM_PREV, PLAN, grade_to_score, normalize_distance
+from placement_probs import blend_rates, placement_probs
+from profiling import enable as enable_profiling, profiled
+from request_policy import (
+    RequestCancelled,
+    RequestPolicy,
+    format_histograms,
+    load_histograms,
+    run_with_policy,
+    save_histograms,
+)
+
+# pandas / openai は読み込みに 0.3〜0.5 秒かかるため、使う関数の中で import する
+if TYPE_CHECKING:
+    import pandas as pd
 
 DEFAULT_MODEL = "gpt-4.1-mini"
 
-COMMON_COLS = [
-    "date_info",
-    "race_title",
-    "weather",
-    "track_condition",
-    "surface",
-    "distance",
-]
+# 日付ディレクトリに蓄積する LLM 応答時間の履歴（ヘッジ閾値の算出に使用）
+LATENCY_FILE_NAME = "llm_latency.json"
 
-# =========================
-# レースグレード数値化
-# =========================
-
-def grade_to_score(g):
-    # ===== 既存ロジック（完全保持） =====
-    if isinstance(g, str):
-        if "GⅠ" in g or "G1" in g or "ＧⅠ" in g:
-            return  1.00
-        elif "GⅡ" in g or "G2" in g or "ＧⅡ" in g:
-            return  0.8
-        elif "GⅢ" in g or "G3" in g or "ＧⅢ" in g:
-            return  0.6
-        elif "L" in g or "OP" in g :
-            return  0.4
-        elif "3勝" in g:
-            return  0.35
-        elif "2勝" in g:
-            return  0.3
-        elif "1勝" in g:
-             return  0.12
-        elif "新馬" in g:
-             return  0.08
-        elif "未勝利" in g:
-            return  0.05
-        else:
-            return  0.4
-
-    return 0
+# aiready CSV のうちレース共通の列（feature_registry.py で scope="race" と宣言したもの）
+COMMON_COLS = PLAN.race_columns
 
 
 # =========================
 # CSV読込
 # =========================
-def load_csv(path: str) -> pd.DataFrame:
-    return pd.read_csv(path)
-
+def load_csv(path: str) -> "pd.DataFrame":
+    import pandas as pd
 
-# =========================
-# 距離単位正規化
-# =========================
-def normalize_distance(v):
-    if pd.isna(v):
-        return v
-    try:
-        v = int(float(v))
-        if v < 100:
-            return v * 100
-        return v
-    except Exception:
-        return v
+    return pd.read_csv(path)
 
 
 # =========================
 # 共通情報 / 馬データ分離
 # =========================
-def split_common_and_horses(df: pd.DataFrame):
+def split_common_and_horses(df: "pd.DataFrame"):
     common_info = {}
 
     for col in ["date_info", "weather", "track_condition", "surface", "distance"]:
         if col in df.columns:
             common_info[col] = df[col].iloc[0]
 
-    if "race_title" in df.columns:
-        common_info["race_grade"] = grade_to_score(df["race_title"].iloc[0])
-    else:
-        common_info["race_grade"] = 0
+    # 格付けは prevX_grade と同じ対応表（feature_registry.grade_to_score）。レース名がなければ 0
+    race_title = df["race_title"].iloc[0] if "race_title" in df.columns else None
+    common_info["race_grade"] = grade_to_score(race_title) or 0
 
     horse_df = df.drop(columns=[c for c in COMMON_COLS if c in df.columns])
 
     # ★ 距離系正規化
-    for x in [1, 2, 3]:
+    for x in range(1, NUM_PREV + 1):
         col = f"prev{x}_distance"
         if col in horse_df.columns:
             horse_df[col] = horse_df[col].apply(normalize_distance)
@@ -96,18 +68,36 @@ def split_common_and_horses(df: pd.DataFrame):
     return common_info, horses
 
 
+def horse_number_of(horse: dict):
+    """馬番を int で返す。取得途中の行などで欠損・数値でない場合は None"""
+    try:
+        v = float(horse.get("horse_number"))
+    except (TypeError, ValueError):
+        return None
+    return int(v) if math.isfinite(v) else None
+
+
+# =========================
+# 競馬場名抽出
+# =========================
+VENUES = ["中山", "東京", "京都", "阪神", "中京", "新潟", "福島", "小倉", "札幌", "函館"]
+
+
+def detect_venue(date_info) -> str:
+    if not isinstance(date_info, str):
+        return ""
+    for v in VENUES:
+        if v in date_info:
+            return v
+    return ""
+
+
 # =========================
 # プロンプト生成（100点完全・全ロジック統合版）
 # =========================
 def build_prompt(common_info: dict, horses: list) -> str:
     # --- 1. 競馬場名の抽出と場別ロジック ---
-    date_info = common_info.get('date_info', '')
-    venue = ""
-    venues = ["中山", "東京", "京都", "阪神", "中京", "新潟", "福島", "小倉", "札幌", "函館"]
-    for v in venues:
-        if v in date_info:
-            venue = v
-            break
+    venue = detect_venue(common_info.get('date_info', ''))
 
     venue_logic = ""
     if venue == "東京":
@@ -266,21 +256,22 @@ distance: {common_info.get('distance')}
 {json.dumps(horses, ensure_ascii=False)}
 
 【出力条件】
-- JSON配列のみ
+- 指定の JSON Schema（race_prediction）に従う
 - horse_number 昇順
 - 全馬必須
 - JSON以外の文字列は禁止
 
 【出力形式】
-[
-  {{
-    "horse_number": number,
-    "horse_name": "string",
-    "win_rate": number,
-    "top2_rate": number,
-    "top3_rate": number
-  }}
-]
+{{
+  "horses": [
+    {{
+      "horse_number": number,
+      "win_rate": number,
+      "top2_rate": number,
+      "top3_rate": number
+    }}
+  ]
+}}
 """
     return prompt.strip()
 
@@ -288,59 +279,450 @@ distance: {common_info.get('distance')}
 # =========================
 # GPT問い合わせ
 # =========================
-def ask_gpt(prompt: str, model_name: str) -> list:
-    client = OpenAI()
+SYSTEM_PROMPT = "あなたはJRA競馬予想AIです。JSON以外は一切返さないでください。"
+
 
+def build_request(prompt: str, model_name: str, temperature: float = None, expected_numbers=None) -> dict:
     # =========================
     # モデル別 generation 設定
     # =========================
     kwargs = {}
 
-    if not model_name.startswith("gpt-5"):
+    if temperature is not None:
+        kwargs["temperature"] = temperature
+    elif not model_name.startswith("gpt-5"):
         kwargs["temperature"] = 0.7
     else:
         kwargs["temperature"] = 0.2
 
-    resp = client.responses.create(
+    return dict(
         model=model_name,
         input=[
             {
                 "role": "system",
-                "content": "あなたはJRA競馬予想AIです。JSON以外は一切返さないでください。"
+                "content": SYSTEM_PROMPT
             },
             {
                 "role": "user",
                 "content": prompt
             }
         ],
+        text={"format": prediction_format(expected_numbers)},
         **kwargs
     )
 
 
-    text = resp.output_text
+# =========================
+# 構造化出力（JSON Schema）
+# =========================
+# 出力の形はモデル側で JSON Schema（strict）に固定し、受け取った JSON は
+# PREDICTION_DTYPE の構造化配列へ直接詰める。以降の検証・正規化・並べ替えは配列の列演算で行い、
+# 馬名は書き出し時に CSV 側から付ける（モデルには馬番と確率だけを返させる）。
+SCHEMA_NAME = "race_prediction"
+
+PREDICTION_DTYPE = np.dtype([
+    ("horse_number", "i4"),
+    ("win_rate", "f8"),
+    ("top2_rate", "f8"),
+    ("top3_rate", "f8"),
+])
+
+
+def prediction_schema(expected_numbers=None) -> dict:
+    """{"horses": [{horse_number, win_rate, top2_rate, top3_rate}, ...]}。出走馬が分かれば馬番と頭数も固定する"""
+    number = {"type": "integer"}
+    horses = {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "horse_number": number,
+                "win_rate": {"type": "number", "minimum": 0},
+                "top2_rate": {"type": "number", "minimum": 0},
+                "top3_rate": {"type": "number", "minimum": 0},
+            },
+            "required": list(PREDICTION_DTYPE.names),
+            "additionalProperties": False,
+        },
+    }
+    if expected_numbers:
+        number["enum"] = sorted(int(n) for n in expected_numbers)
+        horses["minItems"] = horses["maxItems"] = len(number["enum"])
+
+    return {
+        "type": "object",
+        "properties": {"horses": horses},
+        "required": ["horses"],
+        "additionalProperties": False,
+    }
+
+
+def prediction_format(expected_numbers=None) -> dict:
+    return {
+        "type": "json_schema",
+        "name": SCHEMA_NAME,
+        "strict": True,
+        "schema": prediction_schema(expected_numbers),
+    }
+
+
+def parse_prediction(text: str, expected_numbers=None) -> np.ndarray:
+    """出力テキスト → 検証済みの構造化配列（スキーマ外の出力は抽出を試みず MalformedOutputError）"""
+    try:
+        obj = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise MalformedOutputError(f"JSONが不正です: {e}") from e
+    if not isinstance(obj, dict) or not isinstance(obj.get("horses"), list):
+        raise MalformedOutputError("horses 配列がありません")
+    return prediction_array(obj["horses"], expected_numbers)
+
+
+def prediction_array(horses: list, expected_numbers=None) -> np.ndarray:
+    """馬オブジェクトの list を PREDICTION_DTYPE の配列に詰めて検証する"""
+    names = PREDICTION_DTYPE.names
+    try:
+        arr = np.fromiter(
+            (tuple(_number(h[k], k) for k in names) for h in horses),
+            dtype=PREDICTION_DTYPE, count=len(horses),
+        )
+    except (KeyError, TypeError, OverflowError) as e:
+        raise MalformedOutputError(f"馬データの形式が不正です: {e!r}") from e
+    validate_array(arr, expected_numbers)
+    return arr
+
+
+def _number(v, key: str):
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        raise MalformedOutputError(f"{key} が数値ではありません: {v!r}")
+    if key == "horse_number" and not float(v).is_integer():
+        raise MalformedOutputError(f"horse_number が整数ではありません: {v!r}")
+    return v
+
+
+def validate_array(arr: np.ndarray, expected_numbers=None):
+    if not len(arr):
+        raise MalformedOutputError("馬データが空です")
+
+    for key in RATE_KEYS:
+        bad = ~np.isfinite(arr[key]) | (arr[key] < 0)
+        if bad.any():
+            raise MalformedOutputError(f"{key} が範囲外です: {float(arr[key][bad][0])!r}")
+
+    numbers = np.unique(arr["horse_number"])
+    if len(numbers) != len(arr):
+        values, counts = np.unique(arr["horse_number"], return_counts=True)
+        raise MalformedOutputError(f"馬番が重複しています: {int(values[counts > 1][0])}")
+
+    if expected_numbers is not None:
+        expected = np.fromiter(expected_numbers, dtype="i4", count=len(expected_numbers))
+        extra = np.setdiff1d(numbers, expected)
+        if len(extra):
+            raise MalformedOutputError(f"出走馬に存在しない馬番です: {int(extra[0])}")
+        missing = np.setdiff1d(expected, numbers)
+        if len(missing):
+            raise MalformedOutputError(f"出力されていない馬がいます: {missing.tolist()}")
+
+
+def to_prediction_array(prediction) -> np.ndarray:
+    """ベースライン・アンサンブル集約の dict の list も同じ配列にそろえる（検証はしない）"""
+    if isinstance(prediction, np.ndarray):
+        return prediction
+    names = PREDICTION_DTYPE.names
+    return np.fromiter(
+        (tuple(p.get(k, 0) or 0 for k in names) for p in prediction),
+        dtype=PREDICTION_DTYPE, count=len(prediction),
+    )
+
+
+def prediction_records(arr: np.ndarray, horse_names: dict = None) -> list:
+    """構造化配列 → 出力 JSON 用の dict の list（馬名は horse_names {馬番: 馬名} から付ける）"""
+    horse_names = horse_names or {}
+    return [
+        {
+            "horse_number": number,
+            "horse_name": horse_names.get(number, ""),
+            "win_rate": win,
+            "top2_rate": top2,
+            "top3_rate": top3,
+        }
+        for number, win, top2, top3 in arr.tolist()
+    ]
+
+
+def ask_gpt(prompt: str, model_name: str, stream: bool = False, expected_numbers=None,
+            policy: RequestPolicy = None, histograms: dict = None, temperature: float = None) -> np.ndarray:
+    from openai import OpenAI
+
+    client = OpenAI()
+    request = build_request(prompt, model_name, temperature, expected_numbers)
+
+    def call(cancel, timeout):
+        return request_once(client, request, cancel, timeout, stream, expected_numbers)
+
+    return run_with_policy(call, policy or RequestPolicy(), histograms)
+
+
+def request_once(client, request: dict, cancel, timeout: float, stream: bool = False,
+                 expected_numbers=None) -> np.ndarray:
+    # 締切までの残り時間をそのまま HTTP タイムアウトにする（SDK 内部の再試行は無効化し、
+    # 429・5xx・接続断の再送は run_with_policy が Retry-After と締切を見て行う）
+    client = client.with_options(timeout=timeout, max_retries=0)
+
+    if stream:
+        return ask_gpt_stream(client, request, cancel, expected_numbers)
+
+    return parse_prediction(collect_output_text(client, request, cancel), expected_numbers)
+
+
+def collect_output_text(client, request: dict, cancel) -> str:
+    """
+    非ストリーム時の問い合わせ。転送だけはストリームで受け、全文がそろってから parse_prediction する。
+    通常の create は応答待ちでブロックしたまま打ち切れず、ヘッジ負け・締切後も生成が最後まで走って
+    課金されるため、イベントごとに cancel を見て接続を閉じる。
+    """
+    parts = []
+    stream = client.responses.create(stream=True, **request)
+    try:
+        for event in stream:
+            if cancel.is_set():
+                raise RequestCancelled()
+            etype = getattr(event, "type", "")
+            if etype == "response.output_text.delta":
+                parts.append(event.delta)
+            elif etype in ("response.failed", "error"):
+                raise MalformedOutputError(f"ストリームエラー: {etype}")
+    finally:
+        stream.close()
+    if cancel.is_set():
+        raise RequestCancelled()
+    return "".join(parts)
+
+
+# =========================
+# ストリーミング問い合わせ（馬ごとの逐次パース）
+# =========================
+PREDICTION_KEYS = ("horse_number", "win_rate", "top2_rate", "top3_rate")
+
+
+class MalformedOutputError(ValueError):
+    """出力形式の破損（スキーマ違反・ストリーム途中の破損）を検出した場合に送出する"""
+
+
+def validate_horse(obj, expected_numbers=None, seen=None) -> dict:
+    if not isinstance(obj, dict):
+        raise MalformedOutputError(f"馬データがオブジェクトではありません: {obj!r}")
+
+    for key in PREDICTION_KEYS:
+        v = obj.get(key)
+        if isinstance(v, bool) or not isinstance(v, (int, float)):
+            raise MalformedOutputError(f"{key} が数値ではありません: {v!r}")
+        # NaN・Infinity は int() や正規化の前に弾く（非ストリームの validate_array と同じ条件）
+        if not math.isfinite(v) or v < 0:
+            raise MalformedOutputError(f"{key} が範囲外です: {v!r}")
+
+    number = obj["horse_number"]
+    if number != int(number):
+        raise MalformedOutputError(f"horse_number が整数ではありません: {number!r}")
+    number = int(number)
+    obj["horse_number"] = number
+
+    if expected_numbers is not None and number not in expected_numbers:
+        raise MalformedOutputError(f"出走馬に存在しない馬番です: {number}")
+    if seen is not None:
+        if number in seen:
+            raise MalformedOutputError(f"馬番が重複しています: {number}")
+        seen.add(number)
+
+    return obj
+
+
+class IncrementalHorseParser:
+    """
+    出力テキストを断片ごとに受け取り、JSON配列内の馬オブジェクトが
+    閉じた時点で1頭ずつ取り出して検証する。
+    配列開始前の前置き（構造化出力の {"horses": や ```json 等）は max_preamble 文字まで許容する。
+    """
+
+    def __init__(self, expected_numbers=None, max_preamble: int = 200):
+        self.expected_numbers = expected_numbers
+        self.max_preamble = max_preamble
+        self.horses = []
+        self._seen = set()
+        self._buf = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._finished = False
+        self._preamble = 0
+
+    def feed(self, chunk: str) -> list:
+        new_horses = []
+
+        for ch in chunk:
+            if self._finished:
+                break
+
+            # --- 配列開始前 ---
+            if not self._started:
+                if ch == "[":
+                    self._started = True
+                elif not ch.isspace():
+                    self._preamble += 1
+                    if self._preamble > self.max_preamble:
+                        raise MalformedOutputError("JSON配列が開始されません")
+                continue
+
+            # --- 配列直下（オブジェクト間） ---
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._buf = [ch]
+                elif ch == "]":
+                    self._finished = True
+                elif not (ch.isspace() or ch == ","):
+                    raise MalformedOutputError(f"配列内に不正な文字があります: {ch!r}")
+                continue
+
+            # --- オブジェクト内 ---
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    new_horses.append(self._close_object())
+
+        return new_horses
+
+    def _close_object(self) -> dict:
+        text = "".join(self._buf)
+        self._buf = []
+        try:
+            obj = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise MalformedOutputError(f"馬データのJSONが不正です: {e}") from e
+
+        horse = validate_horse(obj, self.expected_numbers, self._seen)
+        self.horses.append(horse)
+        return horse
+
+    def close(self) -> list:
+        if not self._finished:
+            raise MalformedOutputError("JSON配列が閉じられていません")
+        check_complete(self._seen, self.expected_numbers)
+        return self.horses
+
+
+def check_complete(seen: set, expected_numbers=None):
+    if not seen:
+        raise MalformedOutputError("馬データが空です")
+    if expected_numbers is not None and seen != set(expected_numbers):
+        missing = sorted(set(expected_numbers) - seen)
+        raise MalformedOutputError(f"出力されていない馬がいます: {missing}")
+
+
+def consume_stream(events, parser: IncrementalHorseParser, cancel=None) -> list:
+    for event in events:
+        if cancel is not None and cancel.is_set():
+            raise RequestCancelled()
+        etype = getattr(event, "type", "")
+        if etype == "response.output_text.delta":
+            for horse in parser.feed(event.delta):
+                print(f"[STREAM] {horse['horse_number']}番 受信")
+        elif etype in ("response.failed", "error"):
+            raise MalformedOutputError(f"ストリームエラー: {etype}")
+    return parser.close()
+
+
+def ask_gpt_stream(client, request: dict, cancel=None, expected_numbers=None) -> np.ndarray:
+    parser = IncrementalHorseParser(expected_numbers)
+    stream = client.responses.create(stream=True, **request)
     try:
-        return json.loads(text)
-    except Exception:
-        print("[WARN] JSON抽出を試行")
-        text = text[text.find("["): text.rfind("]") + 1]
-        return json.loads(text)
+        return prediction_array(consume_stream(stream, parser, cancel), expected_numbers)
+    except MalformedOutputError as e:
+        print(f"[WARN] 出力破損のため打ち切り: {e}")
+        raise
+    finally:
+        # 打ち切り・ヘッジ負け時は残りの生成を待たずに接続を閉じる
+        stream.close()
+
+# =========================
+# アンサンブル問い合わせ
+# =========================
+def ask_ensemble(ask, spec: str, horses: list, pool: str, out_dir: str, base_name: str) -> list:
+    members = parse_members(spec)
+    print(f"アンサンブル: {', '.join(member_label(m, t) for m, t in members)} / 集約: {pool}")
+
+    # メンバーごとに個別正規化してから集約する（members.json に書けるよう dict の list に戻す）
+    names = horse_name_map(horses)
+    results = run_members(lambda m, t: prediction_records(normalize_rates(ask(m, t)), names), members)
+
+    members_path = os.path.join(out_dir, f"{base_name}_members.json")
+    with open(members_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"[OK] メンバー別結果出力: {members_path}")
+
+    return combine(results, [h for h in horses if horse_number_of(h) is not None], pool)
+
 
 # =========================
 # 正規化処理 ★追加
 # =========================
-def normalize_rates(prediction: list) -> list:
-    def norm(key, total_target):
-        total = sum(p.get(key, 0) for p in prediction)
+RATE_KEYS = ("win_rate", "top2_rate", "top3_rate")
+PLACEMENT_CHOICES = ("independent", "harville", "plackett_luce", "blend")
+
+
+RATE_TOTALS = (100.0, 200.0, 300.0)
+
+
+def normalize_rates(prediction, placement: str = "independent", blend_weight: float = 0.5) -> np.ndarray:
+    """構造化配列（dict の list なら変換して）の確率列をその場で正規化して返す"""
+    prediction = to_prediction_array(prediction)
+    if placement != "independent":
+        return derive_placement_rates(prediction, placement, blend_weight)
+
+    for key, total_target in zip(RATE_KEYS, RATE_TOTALS):
+        total = prediction[key].sum()
         if total == 0:
-            return
-        for p in prediction:
-            p[key] = round(p[key] / total * total_target, 2)
+            continue
+        prediction[key] = np.round(prediction[key] / total * total_target, 2)
+
+    return prediction
 
-    norm("win_rate", 100.0)
-    norm("top2_rate", 200.0)
-    norm("top3_rate", 300.0)
+
+def derive_placement_rates(prediction: np.ndarray, placement: str, blend_weight: float = 0.5) -> np.ndarray:
+    # 勝率のみを信頼し、連対率・3着内率は着順モデルで厳密に導出する
+    rates = np.stack([prediction[k] for k in RATE_KEYS], axis=1)
+    method = "harville" if placement == "blend" else placement
+    derived = placement_probs(rates[:, 0], method=method)
+    if placement == "blend":
+        derived = blend_rates(rates, derived, blend_weight)
+
+    for j, key in enumerate(RATE_KEYS):
+        prediction[key] = np.round(derived[:, j] * 100, 2)
 
     return prediction
+
+
+def sort_by_win_rate(prediction: np.ndarray) -> np.ndarray:
+    """勝率降順（同率は元の順）"""
+    return prediction[np.argsort(-prediction["win_rate"], kind="stable")]
+
+
+def horse_name_map(horses: list) -> dict:
+    numbers = map(horse_number_of, horses)
+    return {n: h.get("horse_name", "") for n, h in zip(numbers, horses) if n is not None}
+
 # =========================
 # 出力パス生成
 # =========================
@@ -353,7 +735,10 @@ def build_base_name(csv_path: str) -> str:
 # =========================
 # メイン処理
 # =========================
-def main(csv_path: str, model_name: str):
+@profiled("predict", "csv_path")
+def main(csv_path: str, model_name: str, stream: bool = False, fallback: bool = False,
+         placement: str = "independent", policy: RequestPolicy = None,
+         ensemble: str = None, pool: str = "mean", histograms: dict = None, similar_index=None) -> str:
     if not os.path.exists(csv_path):
         raise FileNotFoundError(csv_path)
 
@@ -365,6 +750,14 @@ def main(csv_path: str, model_name: str):
 
     prompt = build_prompt(common_info, horses)
 
+    # 類似した過去レースの結果を参考情報として付ける（race_index.RaceIndex）
+    if similar_index is not None:
+        from race_index import csv_race_id, similar_races, similar_races_section
+
+        section = similar_races_section(similar_races(similar_index, df, csv_race_id(csv_path)))
+        if section:
+            prompt = f"{prompt}\n\n{section}"
+
     base_name = build_base_name(csv_path)
     out_dir = os.path.dirname(csv_path)
 
@@ -376,13 +769,40 @@ def main(csv_path: str, model_name: str):
     print(f"[OK] プロンプト出力: {prompt_path}")
 
     # --- AI予測 ---
-    prediction = ask_gpt(prompt, model_name)
+    # 馬番が欠けた行（取得途中など）は出力を求めない
+    expected_numbers = {n for n in map(horse_number_of, horses) if n is not None}
+    # 呼び出し側がヒストグラムを共有する場合は保存も呼び出し側が行う
+    own_histograms = histograms is None
+    latency_path = os.path.join(out_dir, LATENCY_FILE_NAME)
+    if own_histograms:
+        histograms = load_histograms(latency_path)
+    def ask(model, temperature=None):
+        return ask_gpt(prompt, model, stream=stream, expected_numbers=expected_numbers or None,
+                       policy=policy, histograms=histograms, temperature=temperature)
+
+    try:
+        if ensemble:
+            prediction = ask_ensemble(ask, ensemble, horses, pool, out_dir, base_name)
+        else:
+            prediction = ask(model_name)
+    except Exception as e:
+        metrics.error("llm")
+        if not fallback:
+            raise
+        # API 障害時はローカルのベースライン予測で代替
+        print(f"[WARN] AI予測失敗のためベースラインで代替: {e}")
+        from baseline_predictor import predict_df
+        prediction = predict_df(df)
+    finally:
+        if own_histograms:
+            save_histograms(latency_path, histograms)
+            print(f"[INFO] レイテンシ: {format_histograms(histograms)}")
 
     # ★ 正規化
-    prediction = normalize_rates(prediction)
+    prediction = normalize_rates(prediction, placement)
 
-    # 勝率降順で整列
-    prediction_sorted = sorted(prediction, key=lambda x: -x["win_rate"])
+    # 勝率降順で整列し、馬名は CSV 側から付ける
+    prediction_sorted = prediction_records(sort_by_win_rate(prediction), horse_name_map(horses))
 
     out_json = os.path.join(out_dir, f"{base_name}.json")
     with open(out_json, "w", encoding="utf-8") as f:
@@ -390,6 +810,8 @@ def main(csv_path: str, model_name: str):
 
     print(f"[OK] 予測結果出力: {out_json}")
     print("=== 完了 ===")
+    metrics.progress("predicted")
+    return out_json
 
 
 if __name__ == "__main__":
@@ -401,6 +823,78 @@ if __name__ == "__main__":
         default=DEFAULT_MODEL,
         help="使用するOpenAIモデル（省略可）"
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="ストリーミングで受信し、馬ごとに逐次検証する（破損時は即再試行）"
+    )
+    parser.add_argument(
+        "--fallback",
+        action="store_true",
+        help="API 失敗時に baseline_predictor の予測で代替する"
+    )
+    parser.add_argument(
+        "--placement",
+        choices=PLACEMENT_CHOICES,
+        default="independent",
+        help="連対率・3着内率の算出方法（independent: 従来の個別正規化）"
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=RequestPolicy.deadline_seconds,
+        help="1レースあたりの締切秒数"
+    )
+    parser.add_argument(
+        "--hedge-after",
+        type=float,
+        default=None,
+        help="ヘッジ送信までの秒数（省略時は応答時間履歴の p90）"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=RequestPolicy.max_retries,
+        help="出力不正時の再試行回数"
+    )
+    parser.add_argument(
+        "--ensemble",
+        default=None,
+        help="複数モデルを同時実行して集約（例: gpt-5.2,gpt-4.1-mini@0.9,gpt-4.1-mini@0.9）"
+    )
+    parser.add_argument(
+        "--pool",
+        choices=POOL_METHODS,
+        default="mean",
+        help="アンサンブルの集約方法（mean: 算術平均 / logpool: 対数意見プール）"
+    )
+    parser.add_argument(
+        "--similar-index",
+        default=None,
+        help="race_index.py build で作ったインデックス。類似した過去レースの結果をプロンプトに付ける"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="cProfile / tracemalloc の結果を <CSVのディレクトリ>/profile に出力（環境変数 KEIBA_PROFILE=1 と同じ）"
+    )
+    metrics.add_arguments(parser)
     args = parser.parse_args()
 
-    main(args.csv_path, args.model)
+    if args.profile:
+        enable_profiling()
+    metrics.start_from_args(args)
+
+    policy = RequestPolicy(
+        deadline_seconds=args.deadline,
+        hedge_after_seconds=args.hedge_after,
+        max_retries=args.retries,
+    )
+    similar_index = None
+    if args.similar_index:
+        from race_index import RaceIndex
+        similar_index = RaceIndex.load(args.similar_index)
+
+    main(args.csv_path, args.model, stream=args.stream, fallback=args.fallback,
+         placement=args.placement, policy=policy, ensemble=args.ensemble, pool=args.pool,
+         similar_index=similar_index)
@@ -0,0 +1,217 @@
+import atexit
+import functools
+import inspect
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# ==============================
+# 任意のプロファイリング（cProfile + tracemalloc）
+# ==============================
+# 使い方:
+#   KEIBA_PROFILE=1 python prepare_ai_input.py 20251207
+#   python -m keiba run --date 20251207 --profile
+#
+# 有効時のみ各ステージ（collect / prepare / predict / notify）を cProfile と tracemalloc で包み、
+# プロセス終了時に <日付ディレクトリ>/profile/ へ以下を書き出す。
+#   {stage}_{時刻}_{pid}.prof : pstats / snakeviz で開けるプロファイル
+#   {stage}_{時刻}_{pid}.txt  : 累積時間上位とメモリ確保箇所上位のテキスト要約
+# 無効時は何もしない（cProfile 等の import も行わない）。
+
+PROFILE_ENV = "KEIBA_PROFILE"
+PROFILE_DIR_NAME = "profile"
+
+TOP_N = 30
+
+_TRUE_VALUES = ("1", "true", "yes", "on")
+
+_lock = threading.Lock()
+_forced = False
+_stages = {}      # name -> {"out_dir", "profiles", "calls", "seconds", "peak", "alloc"}
+_registered = False
+_active = 0       # tracemalloc を使用中のステージ数
+
+_IGNORED_FRAMES = ("<frozen importlib", os.path.dirname(threading.__file__) + os.sep + "tracemalloc.py")
+
+
+def enable():
+    """コマンドラインの --profile から有効化する"""
+    global _forced
+    _forced = True
+
+
+def enabled() -> bool:
+    return _forced or os.environ.get(PROFILE_ENV, "").strip().lower() in _TRUE_VALUES
+
+
+def _stage_state(name: str, out_dir: str) -> dict:
+    global _registered
+    with _lock:
+        if not _registered:
+            atexit.register(write_reports)
+            _registered = True
+        return _stages.setdefault(name, {
+            "out_dir": out_dir,
+            "profiles": [],
+            "calls": 0,
+            "seconds": 0.0,
+            "peak": 0,
+            "alloc": {},
+        })
+
+
+def _start_tracemalloc():
+    """最初のステージ開始時にトレースを始める（それ以前の確保は対象外にし、スナップショットを小さく保つ）"""
+    global _active
+    import tracemalloc
+
+    with _lock:
+        if _active == 0:
+            tracemalloc.start()
+        _active += 1
+
+
+def _stop_tracemalloc() -> tuple:
+    """(トレース開始以降に確保され、まだ解放されていない行単位の統計, ピーク) を返す"""
+    global _active
+    import tracemalloc
+
+    snapshot = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    with _lock:
+        _active -= 1
+        if _active == 0:
+            tracemalloc.stop()
+
+    stats = [
+        st for st in snapshot.statistics("lineno")
+        if not st.traceback[0].filename.startswith(_IGNORED_FRAMES)
+    ]
+    return stats, peak
+
+
+@contextmanager
+def stage(name: str, out_dir: str):
+    """
+    有効時のみ、ブロック内の処理を計測してステージ name に積算する。
+    ステージは並列スレッドから呼ばれうるため、プロファイラは呼び出しごとに作り最後に合算する。
+    tracemalloc はプロセス全体で1つのため、並列実行中の他ステージの確保も重なって計上される。
+    """
+    if not enabled():
+        yield
+        return
+
+    import cProfile
+
+    state = _stage_state(name, out_dir)
+    _start_tracemalloc()
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12 以降は同時に1つしか有効にできない（並列ステージ）
+        profiler = None
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+        stats, peak = _stop_tracemalloc()
+
+        with _lock:
+            state["calls"] += 1
+            state["seconds"] += elapsed
+            state["peak"] = max(state["peak"], peak)
+            if profiler is not None:
+                state["profiles"].append(profiler)
+            for st in stats[:TOP_N * 2]:
+                key = str(st.traceback[0])
+                size, count = state["alloc"].get(key, (0, 0))
+                state["alloc"][key] = (size + st.size, count + st.count)
+
+
+def profiled(name: str, path_arg: str):
+    """
+    関数全体を stage(name) で包むデコレータ。
+    path_arg の引数（ファイルならその親、ディレクトリならそのもの）を出力先とする。
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            path = signature.bind(*args, **kwargs).arguments.get(path_arg) or "."
+            out_dir = path if os.path.isdir(path) else os.path.dirname(path) or "."
+            with stage(name, out_dir):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# =========================
+# レポート出力
+# =========================
+def _format_alloc(alloc: dict) -> list:
+    lines = []
+    top = sorted(alloc.items(), key=lambda kv: -kv[1][0])[:TOP_N]
+    for site, (size, count) in top:
+        lines.append(f"  {size / 1024:12.1f} KiB  {count:8d} blocks  {site}")
+    return lines
+
+
+def write_reports() -> list:
+    """積算済みのステージを書き出して破棄する。書き出したパスを返す"""
+    import pstats
+
+    with _lock:
+        stages = dict(_stages)
+        _stages.clear()
+
+    stamp = f"{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}"
+    written = []
+    for name, state in stages.items():
+        out_dir = os.path.join(state["out_dir"], PROFILE_DIR_NAME)
+        os.makedirs(out_dir, exist_ok=True)
+        base = os.path.join(out_dir, f"{name}_{stamp}")
+
+        lines = [
+            f"=== stage: {name} ===",
+            f"呼び出し {state['calls']} 回 / 合計 {state['seconds']:.3f}s / "
+            f"tracemalloc ピーク {state['peak'] / 1024 / 1024:.1f} MiB",
+            "",
+        ]
+
+        if state["profiles"]:
+            stream = io.StringIO()
+            stats = pstats.Stats(state["profiles"][0], stream=stream)
+            for p in state["profiles"][1:]:
+                stats.add(p)
+            stats.dump_stats(f"{base}.prof")
+            written.append(f"{base}.prof")
+
+            stats.sort_stats("cumulative").print_stats(TOP_N)
+            lines.append(f"--- 累積時間 上位 {TOP_N} ---")
+            lines.append(stream.getvalue().strip())
+            lines.append("")
+
+        lines.append(f"--- メモリ確保箇所（ステージ終了時点で未解放・全呼び出しの合計） 上位 {TOP_N} ---")
+        lines.extend(_format_alloc(state["alloc"]))
+
+        with open(f"{base}.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        written.append(f"{base}.txt")
+
+    for path in written:
+        print(f"[INFO] プロファイル出力: {path}")
+    return written
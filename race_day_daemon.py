@@ -0,0 +1,81 @@
+import csv
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# =========================
+# 発走時刻ベースのタイマーキュー
+# =========================
+JST = ZoneInfo("Asia/Tokyo")
+
+DEFAULT_LEAD_MINUTES = 10
+
+
+def read_post_time(common_csv: str) -> str:
+    with open(common_csv, "r", encoding="utf-8-sig", newline="") as f:
+        row = next(csv.DictReader(f), {})
+    return str(row.get("post_time", "") or "")
+
+
+def post_datetime(date_str: str, post_time: str):
+    """"20251207", "15:25" → JST の datetime（不明なら None）"""
+    if not post_time:
+        return None
+    try:
+        hh, mm = post_time.split(":")
+        day = datetime.strptime(date_str, "%Y%m%d")
+        return day.replace(hour=int(hh), minute=int(mm), tzinfo=JST)
+    except ValueError:
+        return None
+
+
+def trigger_time(date_str: str, post_time: str, lead_minutes: float):
+    post = post_datetime(date_str, post_time)
+    if post is None:
+        return None, None
+    return post - timedelta(minutes=lead_minutes), post
+
+
+class TimerQueue:
+    """
+    (実行時刻, ジョブ) の min-heap。時刻が来たジョブを順に起動する。
+    ジョブは共有ワーカープールへの投入だけを行い、すぐ戻ること。
+    """
+
+    def __init__(self, clock=time.time):
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.clock = clock
+        self.stopped = False
+
+    def schedule(self, when: float, name: str, job):
+        with self.cond:
+            heapq.heappush(self.heap, (when, next(self.counter), name, job))
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def run(self):
+        """ヒープが空になる（または stop される）まで待機・起動を繰り返す"""
+        while True:
+            with self.cond:
+                while not self.stopped and self.heap and self.heap[0][0] > self.clock():
+                    self.cond.wait(timeout=min(self.heap[0][0] - self.clock(), 60.0))
+                if self.stopped or not self.heap:
+                    return
+                when, _, name, job = heapq.heappop(self.heap)
+                remaining = len(self.heap)
+
+            print(f"[DAEMON] 起動: {name}（予定との差 {self.clock() - when:+.1f}s / 残り {remaining} 件）")
+            job()
+
+    def pending(self) -> list:
+        with self.cond:
+            return sorted((when, name) for when, _, name, _ in self.heap)
@@ -0,0 +1,369 @@
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from feature_registry import grade_to_score, normalize_distance
+from notify_discord import COURSE_CODE_MAP
+from race_results_collect import RESULT_FILE_SUFFIX
+
+# ==============================
+# 類似レース検索（近傍インデックス）
+# ==============================
+# 使い方:
+#   python history_store.py ingest --start 20250101 --end 20251231
+#   python race_index.py build --store history --results-root . --out history/race_index.npz
+#   python race_index.py query race_data_20251207/202512070611_..._aiready.csv -k 5
+#
+# 過去レースを「開催場・芝ダ・距離・馬場・格（grade_to_score）・出走メンバーの傾向」の
+# 数値ベクトルにし、標準化・重み付けした上で二乗ユークリッド距離の総当たり（BLAS の行列ベクトル積）
+# で k 件を返す。数万レースでも 1 問い合わせ 1ms 未満に収まるため木構造は使わない。
+# 各レースには勝ち馬の馬番・脚質など結果の要約を添えて保存し、予測時のプロンプトに渡せる。
+
+INDEX_FILE_NAME = "race_index.npz"
+
+VENUE_CODES = sorted(COURSE_CODE_MAP)
+
+CONDITION_LEVELS = {"良": 0.0, "稍": 1 / 3, "稍重": 1 / 3, "重": 2 / 3, "不": 1.0, "不良": 1.0}
+
+# 先行型とみなす running_style_score_0to1 の下限（build_prompt の短ダート条件と同じ）
+FRONT_RUNNER_STYLE = 0.6
+
+# 数値特徴（レース単位）。開催場の one-hot は別に持つ
+NUMERIC_FEATURES = [
+    "is_dirt", "distance", "condition", "grade", "field_size",
+    "jockey_rate", "style_mean", "style_std", "front_share", "prev_rank", "prev_margin", "prev_agari",
+]
+
+# 標準化後に掛ける重み（大きいほど距離計算で効く）
+FEATURE_WEIGHTS = {
+    "venue": 1.0,
+    "is_dirt": 2.0,
+    "distance": 1.5,
+    "condition": 0.8,
+    "grade": 1.0,
+    "field_size": 0.5,
+    "jockey_rate": 0.4,
+    "style_mean": 0.6,
+    "style_std": 0.3,
+    "front_share": 0.6,
+    "prev_rank": 0.3,
+    "prev_margin": 0.3,
+    "prev_agari": 0.4,
+}
+
+FEATURE_NAMES = [f"venue_{c}" for c in VENUE_CODES] + NUMERIC_FEATURES
+
+# 特徴の算出に読む aiready の列
+SOURCE_COLUMNS = [
+    "race_id", "date_info", "race_title", "track_condition", "surface", "distance",
+    "horse_number", "running_style_score_0to1", "jockey_course_win_rate",
+    "prev1_rank", "prev1_margin", "prev1_agari",
+]
+
+
+# =========================
+# 特徴ベクトル
+# =========================
+def _numeric(df, col: str) -> np.ndarray:
+    import pandas as pd
+
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+
+def race_features(df) -> tuple:
+    """
+    aiready の行（race_id 列付き、複数レース可）から (race_ids, 特徴行列) を作る。
+    行列は FEATURE_NAMES 順の生の値（未標準化、欠損は NaN）。
+    """
+    import pandas as pd
+
+    style = _numeric(df, "running_style_score_0to1")
+    horse = pd.DataFrame({
+        "race_id": df["race_id"].astype(str).to_numpy(),
+        "style": style,
+        "front": np.where(np.isnan(style), np.nan, style >= FRONT_RUNNER_STYLE),
+        "jockey_rate": _numeric(df, "jockey_course_win_rate") / 100.0,
+        "prev_rank": _numeric(df, "prev1_rank"),
+        "prev_margin": _numeric(df, "prev1_margin"),
+        "prev_agari": _numeric(df, "prev1_agari"),
+        "horse_number": _numeric(df, "horse_number"),
+    })
+    grouped = horse.groupby("race_id", sort=True)
+    means = grouped.mean()
+    race_ids = means.index.to_numpy(dtype=str)
+
+    # 共通情報は各レースの先頭行から取る
+    first = df.assign(race_id=horse["race_id"]).groupby("race_id", sort=True).first()
+
+    def common(col, default=""):
+        return first[col].tolist() if col in first.columns else [default] * len(first)
+
+    venue = np.zeros((len(race_ids), len(VENUE_CODES)))
+    for r, rid in enumerate(race_ids):
+        code = rid[8:10]
+        if code in COURSE_CODE_MAP:
+            venue[r, VENUE_CODES.index(code)] = 1.0
+
+    distance = [normalize_distance(d) for d in common("distance", np.nan)]
+    numeric = np.column_stack([
+        [1.0 if s == "ダ" else 0.0 for s in common("surface")],
+        np.array([d if isinstance(d, (int, float)) else np.nan for d in distance], dtype=float) / 1000.0,
+        [CONDITION_LEVELS.get(str(c), np.nan) for c in common("track_condition")],
+        [grade_to_score(t) if isinstance(t, str) else np.nan for t in common("race_title")],
+        grouped.size().to_numpy(dtype=float),
+        means["jockey_rate"].to_numpy(),
+        means["style"].to_numpy(),
+        grouped["style"].std(ddof=0).to_numpy(),
+        means["front"].to_numpy(),
+        means["prev_rank"].to_numpy(),
+        means["prev_margin"].to_numpy(),
+        means["prev_agari"].to_numpy(),
+    ])
+    return race_ids, np.hstack([venue, numeric])
+
+
+def _weights() -> np.ndarray:
+    return np.array(
+        [FEATURE_WEIGHTS["venue"]] * len(VENUE_CODES) + [FEATURE_WEIGHTS[n] for n in NUMERIC_FEATURES],
+        dtype=np.float32,
+    )
+
+
+# =========================
+# 結果の要約
+# =========================
+def race_outcome(result: dict, styles: dict) -> tuple:
+    """(勝ち馬の馬番, 勝ち馬の脚質スコア, 3着内の馬番×3)。不明は 0 / NaN"""
+    top3 = [0, 0, 0]
+    for row in result.get("order", []):
+        rank = row.get("rank") or 0
+        if 1 <= rank <= 3 and row.get("horse_number"):
+            top3[rank - 1] = int(row["horse_number"])
+    return top3[0], styles.get(top3[0], np.nan), top3
+
+
+# =========================
+# インデックス
+# =========================
+class RaceIndex:
+    def __init__(self, race_ids, raw, winner_number, winner_style, top3, mean=None, std=None):
+        # 日付順に並べておき、「この日より前」を先頭からの連続区間（スライス）で取れるようにする
+        race_ids = np.asarray(race_ids, dtype=str)
+        order = np.argsort(race_ids, kind="stable")
+        self.race_ids = race_ids[order]
+        self.dates = np.array([int(r[:8]) for r in self.race_ids], dtype=np.int32)
+        self.raw = np.asarray(raw, dtype=np.float32).reshape(len(order), -1)[order]
+        self.winner_number = np.asarray(winner_number, dtype=np.int16)[order]
+        self.winner_style = np.asarray(winner_style, dtype=np.float32)[order]
+        self.top3 = np.asarray(top3, dtype=np.int16).reshape(-1, 3)[order]
+        self.rows = {rid: i for i, rid in enumerate(self.race_ids.tolist())}
+
+        if mean is None:
+            mean = np.nanmean(self.raw, axis=0) if len(self.raw) else np.zeros(self.raw.shape[1])
+            std = np.nanstd(self.raw, axis=0) if len(self.raw) else np.ones(self.raw.shape[1])
+        self.mean = np.nan_to_num(np.asarray(mean, dtype=np.float32))
+        self.std = np.where(np.nan_to_num(std) > 1e-6, np.nan_to_num(std), 1.0).astype(np.float32)
+        self.weights = _weights()
+
+        # 距離計算用の行列（C 連続 float32）と各行の二乗ノルムを前計算
+        self.vectors = np.ascontiguousarray(self.embed(self.raw))
+        self.sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+
+    def __len__(self):
+        return len(self.race_ids)
+
+    def embed(self, raw: np.ndarray) -> np.ndarray:
+        """標準化 → 欠損は平均（0）→ 重み付け"""
+        z = (np.asarray(raw, dtype=np.float32) - self.mean) / self.std
+        return np.nan_to_num(z) * self.weights
+
+    def query(self, raw: np.ndarray, k: int = 5, before: int = None, exclude: str = None) -> list:
+        """
+        raw（race_features の1行）に近い過去レース k 件を [(行番号, 距離)] で返す。
+        before  : この日付（YYYYMMDD）より前のレースに限る（当日・未来の結果を使わない）
+        exclude : 除外する race_id（自分自身）
+        """
+        n = len(self.race_ids) if before is None else int(np.searchsorted(self.dates, before))
+        k = min(k, n)
+        if k <= 0:
+            return []
+
+        q = self.embed(raw.reshape(1, -1))[0]
+        dist = self.sq_norms[:n] - 2.0 * (self.vectors[:n] @ q)
+        row = self.rows.get(exclude, n)
+        if row < n:
+            dist[row] = np.inf
+
+        idx = np.argpartition(dist, k - 1)[:k] if k < n else np.arange(n)
+        idx = idx[np.argsort(dist[idx])]
+        # ‖q‖² は順位に影響しないため、距離を返すときだけ足す
+        qq = float(q @ q)
+        return [(int(i), float(np.sqrt(max(dist[i] + qq, 0.0)))) for i in idx if np.isfinite(dist[i])]
+
+    def query_batch(self, raw: np.ndarray, k: int = 5) -> tuple:
+        """複数レースをまとめて検索（行列積1回）。(インデックス (n, k), 距離 (n, k))"""
+        q = self.embed(raw)
+        dist = self.sq_norms[None, :] - 2.0 * (q @ self.vectors.T) + np.einsum("ij,ij->i", q, q)[:, None]
+        k = min(k, dist.shape[1])
+        idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(dist, idx, axis=1), axis=1)
+        idx = np.take_along_axis(idx, order, axis=1)
+        return idx, np.sqrt(np.maximum(np.take_along_axis(dist, idx, axis=1), 0.0))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(
+            path, race_ids=self.race_ids, raw=self.raw, winner_number=self.winner_number,
+            winner_style=self.winner_style, top3=self.top3, mean=self.mean, std=self.std,
+            feature_names=np.array(FEATURE_NAMES),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "RaceIndex":
+        with np.load(path) as z:
+            if list(z["feature_names"]) != FEATURE_NAMES:
+                raise ValueError(f"特徴量の定義が変わっています。インデックスを作り直してください: {path}")
+            return cls(z["race_ids"], z["raw"], z["winner_number"], z["winner_style"], z["top3"],
+                       mean=z["mean"], std=z["std"])
+
+
+def build_index(store_root: str, results_root: str, start: str = None, end: str = None) -> RaceIndex:
+    """履歴ストアの特徴と race_data_YYYYMMDD/*_result.json の結果からインデックスを作る"""
+    from history_store import HistoryStore
+
+    df = HistoryStore(store_root).to_pandas(SOURCE_COLUMNS, start=start, end=end)
+    if df.empty:
+        return RaceIndex([], np.zeros((0, len(FEATURE_NAMES))), [], [], np.zeros((0, 3)))
+
+    race_ids, raw = race_features(df)
+
+    styles_by_race = {}
+    numbers = _numeric(df, "horse_number")
+    styles = _numeric(df, "running_style_score_0to1")
+    for rid, n, s in zip(df["race_id"].astype(str), numbers, styles):
+        if n == n:
+            styles_by_race.setdefault(rid, {})[int(n)] = s
+
+    keep, winners, winner_styles, top3s = [], [], [], []
+    for i, rid in enumerate(race_ids):
+        path = os.path.join(results_root, f"race_data_{rid[:8]}", f"{rid}{RESULT_FILE_SUFFIX}")
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            winner, style, top3 = race_outcome(json.load(f), styles_by_race.get(rid, {}))
+        if not winner:
+            continue
+        keep.append(i)
+        winners.append(winner)
+        winner_styles.append(style)
+        top3s.append(top3)
+
+    return RaceIndex(race_ids[keep], raw[keep], winners, winner_styles, np.array(top3s).reshape(-1, 3))
+
+
+# =========================
+# プロンプト用の要約
+# =========================
+def _style_label(style: float) -> str:
+    if style != style:
+        return "不明"
+    if style >= FRONT_RUNNER_STYLE:
+        return "先行"
+    if style >= 0.3:
+        return "中団"
+    return "差し・追込"
+
+
+def csv_race_id(csv_path: str) -> str:
+    m = re.match(r"(\d{12})_", os.path.basename(csv_path))
+    return m.group(1) if m else ""
+
+
+def similar_races(index: RaceIndex, df, race_id: str, k: int = 5) -> list:
+    """aiready の DataFrame（1レース）に近い過去レースの要約 dict を返す"""
+    if not len(index) or not race_id:
+        return []
+    _, raw = race_features(df.assign(race_id=race_id))
+    hits = index.query(raw[0], k=k, before=int(race_id[:8]), exclude=race_id)
+
+    out = []
+    for i, dist in hits:
+        rid = index.race_ids[i]
+        row = dict(zip(FEATURE_NAMES, index.raw[i].tolist()))
+        out.append({
+            "race_id": rid,
+            "venue": COURSE_CODE_MAP.get(rid[8:10], ""),
+            "surface": "ダ" if row["is_dirt"] >= 0.5 else "芝",
+            "distance": int(round(row["distance"] * 1000)) if row["distance"] == row["distance"] else None,
+            "field_size": int(row["field_size"]),
+            "winner_number": int(index.winner_number[i]),
+            "winner_style": _style_label(float(index.winner_style[i])),
+            "top3": [int(n) for n in index.top3[i] if n],
+            "distance_score": round(dist, 3),
+        })
+    return out
+
+
+def similar_races_section(races: list) -> str:
+    """build_prompt の後ろに付ける短い参考情報"""
+    if not races:
+        return ""
+    lines = ["【類似した過去レースの結果（参考）】"]
+    for r in races:
+        lines.append(
+            f"- {r['race_id']} {r['venue']} {r['surface']}{r['distance'] or '?'}m {r['field_size']}頭: "
+            f"勝ち馬 {r['winner_number']}番（{r['winner_style']}） / 3着内 {r['top3']}"
+        )
+    lines.append("- 過去の傾向の参考に留め、各馬の評価は出走馬データを優先すること")
+    return "\n".join(lines)
+
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="類似レース検索インデックス")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="履歴ストアからインデックスを作る")
+    build.add_argument("--store", default="history", help="history_store のルート")
+    build.add_argument("--results-root", default=".", help="race_data_YYYYMMDD（*_result.json）の場所")
+    build.add_argument("--start", default=None)
+    build.add_argument("--end", default=None)
+    build.add_argument("--out", default=os.path.join("history", INDEX_FILE_NAME))
+
+    query = sub.add_parser("query", help="aiready CSV に近い過去レースを表示")
+    query.add_argument("csv_paths", nargs="+")
+    query.add_argument("--index", default=os.path.join("history", INDEX_FILE_NAME))
+    query.add_argument("-k", type=int, default=5)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        started = time.perf_counter()
+        index = build_index(args.store, args.results_root, args.start, args.end)
+        index.save(args.out)
+        print(f"[OK] 類似レースインデックス出力: {args.out} ({len(index)} レース / "
+              f"{time.perf_counter() - started:.1f}s)")
+        return 0
+
+    import pandas as pd
+
+    index = RaceIndex.load(args.index)
+    for csv_path in args.csv_paths:
+        started = time.perf_counter()
+        races = similar_races(index, pd.read_csv(csv_path), csv_race_id(csv_path), k=args.k)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"=== {os.path.basename(csv_path)} ({elapsed_ms:.2f} ms) ===")
+        print(similar_races_section(races) or "[WARN] 類似レースなし")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
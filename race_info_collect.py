@@ -1,21 +1,16 @@
 import sys
 import time
-import pandas as pd
 import random
 import os
-from datetime import date
-from bs4 import BeautifulSoup
+from datetime import datetime
 import re
 
-# --- Selenium/WebDriver 関連のインポート ---
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service 
-from webdriver_manager.chrome import ChromeDriverManager
-# ----------------------------------------
+import metrics
+import profiling
+from race_records import Horse, PrevRun, RaceCommon, common_to_frame, horses_to_frame
+
+# pandas / bs4 / Selenium / webdriver_manager は起動時間が大きいため、
+# 使う関数の中で import する（--help やキャッシュ済み HTML の再解析では読み込まない）
 
 # --- 設定 ---
 REQUEST_DELAY_SECONDS = 5 
@@ -63,7 +58,8 @@ def get_race_ids_from_list_page(date_str: str, driver, wait) -> list[str]:
 
     try:
         driver.get(list_url)
-        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "table.table-bordered")))
+        wait_for(wait, "table.table-bordered")
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(driver.page_source, "lxml")
 
         race_ids = []
@@ -80,8 +76,8 @@ def get_race_ids_from_list_page(date_str: str, driver, wait) -> list[str]:
         return []
 
 
-def get_all_race_card_urls(driver, wait):
-    all_race_ids = get_race_ids_from_list_page(TODAY_STR, driver, wait)
+def get_all_race_card_urls(driver, wait, date_str=None):
+    all_race_ids = get_race_ids_from_list_page(date_str or TODAY_STR, driver, wait)
     if not all_race_ids:
         print("レースID無し")
         return [], []
@@ -95,13 +91,25 @@ def get_all_race_card_urls(driver, wait):
 # ■ STEP2: 新聞HTML取得
 # ----------------------------------------
 
-def get_html_content_with_selenium(url, driver, wait):
-    time.sleep(REQUEST_DELAY_SECONDS)
+def wait_for(wait, css_selector):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, css_selector)))
+
+
+def get_html_content_with_selenium(url, driver, wait, ready_selector="table.yokobashiraTable",
+                                   delay=REQUEST_DELAY_SECONDS):
+    if delay:
+        time.sleep(delay)
+        metrics.rate_wait("fetch", delay)
     try:
-        driver.get(url)
-        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "table.yokobashiraTable")))
+        with metrics.timed("keiba_fetch_seconds"):
+            driver.get(url)
+            wait_for(wait, ready_selector)
         return driver.page_source
     except:
+        metrics.error("fetch")
         return None
 
 
@@ -181,6 +189,7 @@ def extract_race_common_info(soup, race_id):
     distance = ""
     surface = ""
     headcount = ""
+    post_time = ""
 
     info_list = soup.select("ul.classCourseSyokin li")
     for li in info_list:
@@ -190,38 +199,43 @@ def extract_race_common_info(soup, race_id):
             surface = m.group(1)
             distance = m.group(2)
             headcount = m.group(3)
+            m_time = re.search(r"(\d{1,2}:\d{2})発走", text)
+            post_time = m_time.group(1) if m_time else ""
             break
 
-    return {
-        "race_id": race_id,
-        "race_number": race_number,
-        "date_info": date_info,
-        "race_title": race_title,
-        "weather": weather,
-        "track_condition": track_condition,
-        "surface": surface,
-        "distance": distance,
-        "headcount": headcount
-    }
+    return RaceCommon(
+        race_id=race_id,
+        race_number=race_number,
+        date_info=date_info,
+        race_title=race_title,
+        weather=weather,
+        track_condition=track_condition,
+        surface=surface,
+        distance=distance,
+        headcount=headcount,
+        post_time=post_time,
+    )
+
+def parse_odds_cells(container):
+    """umaboddsBox から (人気, オッズ, 馬体重, 増減) を取り出す"""
+    odd_dd = container.select("td.umaboddsBox .umaboddsDl dd")
+    popularity = odd_dd[0].get_text(strip=True).replace("人気", "") if len(odd_dd) > 0 else ""
+    odds = odd_dd[1].get_text(strip=True) if len(odd_dd) > 1 else ""
+    horse_weight = odd_dd[2].get_text(strip=True).replace("kg", "") if len(odd_dd) > 2 else ""
+    weight_diff = re.sub(r"[()＋－kg]", "", odd_dd[3].get_text(strip=True)) if len(odd_dd) > 3 else ""
+    return popularity, odds, horse_weight, weight_diff
 
 # ----------------------------------------
 # ■ 前走詳細データ抽出（完全版）
 # ----------------------------------------
 def blank_prev():
-    return {
-        "rank": "", "date": "", "distance": "",
-        "weather": "", "condition": "", "race_name": "",
-        "corner_order": [], "field_size": "", "horse_num": "",
-        "popularity": "", "time": "", "agari": "", "pace": "",
-        "weight": "", "weight_diff": "", "jockey": "",
-        "margin": ""
-    }
+    return PrevRun()
 
 def parse_prev_race(z):
     """
     keibalab 前走欄(td.zensouBox) を確実に解析する
     """
-    dl = z.select_one(".zensouDl")
+    dl = z.select_one(".zensouDl") if z is not None else None
     if not dl:
         return blank_prev()
 
@@ -294,25 +308,25 @@ def parse_prev_race(z):
     margin = m_margin.group(1) if m_margin else ""
 
 
-    return {
-        "rank": rank,
-        "date": date,
-        "distance": distance,
-        "weather": weather,
-        "condition": condition,
-        "race_name": race_name,
-        "corner_order": corner_order,
-        "field_size": field_size,
-        "horse_num": horse_num,
-        "popularity": popularity,
-        "time": time,
-        "agari": agari,
-        "pace": pace,
-        "weight": weight,
-        "weight_diff": weight_diff,
-        "jockey": jockey,
-        "margin": margin
-    }
+    return PrevRun(
+        rank=rank,
+        date=date,
+        distance=distance,
+        weather=weather,
+        condition=condition,
+        race_name=race_name,
+        corner_order=tuple(corner_order),
+        field_size=field_size,
+        horse_num=horse_num,
+        popularity=popularity,
+        time=time,
+        agari=agari,
+        pace=pace,
+        weight=weight,
+        weight_diff=weight_diff,
+        jockey=jockey,
+        margin=margin,
+    )
 
 
 
@@ -323,218 +337,319 @@ def parse_prev_race(z):
 # ■ 新聞データ抽出（メイン）
 # ----------------------------------------
 
-def collect_and_format_race_data(race_urls, driver, wait):
+def collect_and_format_race_data(race_urls, driver, wait, output_dir=None):
+    for _ in iter_race_data(race_urls, driver, wait, output_dir):
+        pass
+
+
+def iter_race_data(race_urls, driver, wait, output_dir=None):
+    """
+    1レース取得するごとに (data_path, common_path) を返すジェネレータ。
+    後段（整形・予測・通知）へ全レースの取得完了を待たずに渡せる。
+    """
     print("\n[STEP 2/2] 新聞データ抽出開始")
 
     for url in race_urls:
-        print("\n▶", url)
+        paths = scrape_race(url, driver, wait, output_dir)
+        if paths:
+            yield paths
+
+
+def scrape_race(url, driver, wait, output_dir=None, delay=REQUEST_DELAY_SECONDS, save_dir=None):
+    """
+    1レース分の新聞を取得・解析して _data.csv / _common.csv を保存する。
+    戻り値は (data_path, common_path)。取得失敗・馬データなしは None。
+    delay は取得前の待機秒数（work_queue のワーカーはキュー側で間隔を制御するため 0）。
+    save_dir を指定すると CSV はそこへ保存する（プロファイルの出力先は output_dir のまま）。
+    """
+    print("\n▶", url)
 
-        content = get_html_content_with_selenium(url, driver, wait)
+    output_dir = output_dir or OUTPUT_DIR
+    with profiling.stage("collect", output_dir):
+        content = get_html_content_with_selenium(url, driver, wait, delay=delay)
         if not content:
-            continue
+            return None
+        metrics.progress("fetched")
+
+        return parse_and_save_race(content, url, save_dir or output_dir)
+
+
+def parse_and_save_race(content, url, output_dir):
+    parsed = parse_race(content, url)
+    if parsed is None:
+        metrics.error("parse")
+        return None
+    race_name, race_id, horses, common_info = parsed
+
+    df = horses_to_frame(horses)
+    os.makedirs(output_dir, exist_ok=True)
+    safe_race_name = re.sub(r'[\\/:*?"<>|]', "", race_name)
+    out_path = os.path.join(output_dir, f"{race_id}_{safe_race_name}_data.csv")
+    df.to_csv(out_path, index=False, encoding="utf-8-sig")
+    print("保存:", out_path)
+    df_common = common_to_frame(common_info)
+    common_path = os.path.join(output_dir, f"{race_id}_{safe_race_name}_common.csv")
+    df_common.to_csv(common_path, index=False, encoding="utf-8-sig")
+    print("共通情報保存:", common_path)
+    metrics.progress("parsed")
+    return out_path, common_path
+
+
+def parse_race(content, url):
+    """
+    新聞 HTML を解析し (レース名, race_id, [Horse], RaceCommon) を返す。馬データなしは None。
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, "html.parser")
+
+    # race name / id
+    race_table_tag = soup.select_one("table.yokobashiraTable")
+    summary_text = race_table_tag["summary"] if race_table_tag else ""
+    race_name = summary_text.replace("の横型馬柱", "").strip()
 
-        soup = BeautifulSoup(content, "html.parser")
+    race_id = re.search(r"/db/race/(\d{12})/", url).group(1)
 
-        # race name / id
-        race_table_tag = soup.select_one("table.yokobashiraTable")
-        summary_text = race_table_tag["summary"] if race_table_tag else ""
-        race_name = summary_text.replace("の横型馬柱", "").strip()
+    # 全馬ブロック
+    horse_rows = soup.select(HORSE_CONTAINER_SELECTOR)
+    if not horse_rows:
+        print("馬データなし")
+        return None
+
+    race_data = []
+
+    for container in horse_rows:
+
+        # ----------------------
+        # 基本情報
+        # ----------------------
+        wakuban = get_text(container, "td.wakubanBox")
+        horse_number = get_text(container, "td.umabanBox")
+        horse_name = get_text(container, "td.bameiBox .bamei3 a")
+        horse_link = container.select_one("td.bameiBox .bamei3 a")
+        m_horse = re.search(r"/db/horse/(\d+)/", horse_link.get("href", "") if horse_link else "")
+        horse_id = m_horse.group(1) if m_horse else ""
+
+        # 性齢・間隔
+        kisyu_list = container.select("td.bameiBox .kisyu3")
+        basic_info = kisyu_list[1].get_text(" ", strip=True) if len(kisyu_list) >= 2 else ""
+        sex_age = re.findall(r"(牡|牝|セ)\d", basic_info)
+        sex_age = sex_age[0] if sex_age else ""
+        kankaku = re.findall(r"(中\d+週|新馬)", basic_info)
+        kankaku = kankaku[0] if kankaku else ""
+
+        jockey_name = get_text(container, "td.bameiBox .kisyu3 a")
+        kinryou = get_text(container, "td.bameiBox .dbkinryou").replace("(", "").replace(")", "")
+
+        # 脚質（◁◁◀◀）
+        legs_style = "".join([s.get_text("") for s in container.select("td.bameiBox .dbrunstyle2yoko span")])
+        # 数値化（0.0〜1.0）へ変換
+        legs_style_score = legs_score(legs_style)
+        # ----------------------
+        # 人気・オッズ・体重
+        # ----------------------
+        popularity, odds, horse_weight, weight_diff = parse_odds_cells(container)
+
+        # ----------------------
+        # 血統
+        # ----------------------
+        father_name = get_text(container, ".chichi3 a")
+        mother_name = get_text(container, ".haha4")
+
+        # ---------------------------
+        # 騎手データの抽出（完全版 / 改良版）
+        # ---------------------------
+
+        jockey_course_win_rate = ""
+        horse_num_course_win_rate = ""
+        father_course_win_rate = ""
+        trainer_jockey_win_rate = ""
+
+        all_jd = container.select("td.jockeydata")
+
+        # 「成績テーブルではないほう」を取得
+        target_jd = None
+        for jd in all_jd:
+            classes = jd.get("class", [])
+            if not any("dbSeisekiData" in c for c in classes):
+                target_jd = jd
+                break
+
+        if target_jd:
+            html = target_jd.decode_contents()
+
+            # ★ すべての <br> タグで分割（<br>, <br/>, <br />）
+            lines = re.split(r"<br\s*/?>", html)
+
+            for line in lines:
+                # タグを解析しつつテキスト抽出
+                s = BeautifulSoup(line, "html.parser")
+                text = s.get_text(" ", strip=True)
+
+                if "：" not in text:
+                    continue
+
+                label, value = text.split("：", 1)
+                label = label.strip()
+                value = value.strip()
+
+                clean_value = extract_percent_only(value)
+
+                if label == "騎手":
+                    jockey_course_win_rate = clean_value
+                elif label == "馬番":
+                    horse_num_course_win_rate = clean_value
+                elif label == "父馬":
+                    father_course_win_rate = clean_value
+                elif label == "コンビ":
+                    trainer_jockey_win_rate = clean_value
+
+
+
+        # ----------------------
+        # 成績表（距離 / コース / 馬場）
+        # ----------------------
+        seiseki = container.select("td.dbSeisekiData table")
+        def parse_block(tbl):
+            out = {}
+            for tr in tbl.select("tr"):
+                th = tr.select_one("th").get_text(strip=True)
+                tds = [td.get_text(strip=True) for td in tr.select("td")]
+                out[th] = tds
+            return out
+
+        dist_stats = parse_block(seiseki[0]) if len(seiseki) >= 1 else {}
+        course_stats = parse_block(seiseki[1]) if len(seiseki) >= 2 else {}
+        surface_stats = parse_block(seiseki[2]) if len(seiseki) >= 3 else {}
+
+        # ----------------------
+        # 前走1〜5 詳細データ
+        # ----------------------
+        prev_boxes = container.select("td.zensouBox")
+        prevs = tuple(
+            parse_prev_race(prev_boxes[i] if i < len(prev_boxes) else None)
+            for i in range(5)
+        )
+
+        # ----------------------
+        # レコード（前走は prev1_〜prev5_ 列として展開される）
+        # ----------------------
+        race_data.append(Horse(
+            wakuban=wakuban,
+            horse_number=horse_number,
+            horse_name=horse_name,
+            jockey_name=jockey_name,
+            sex_age=sex_age,
+            kankaku=kankaku,
+            kinryou=kinryou,
+            running_style_score_0to1=legs_style_score,
+            popularity=popularity,
+            odds=odds,
+            horse_weight=horse_weight,
+            weight_diff=weight_diff,
+            father_name=father_name,
+            mother_name=mother_name,
+            jockey_course_win_rate=jockey_course_win_rate,
+            horse_num_course_win_rate=horse_num_course_win_rate,
+            father_course_win_rate=father_course_win_rate,
+            trainer_jockey_win_rate=trainer_jockey_win_rate,
+            dist_stats=dist_stats,
+            course_stats=course_stats,
+            surface_stats=surface_stats,
+            horse_id=horse_id,
+            prevs=prevs,
+        ))
+
+    if not race_data:
+        return None
 
-        race_id = re.search(r"/db/race/(\d{12})/", url).group(1)
+    return race_name, race_id, race_data, extract_race_common_info(soup, race_id)
 
-        # 全馬ブロック
-        horse_rows = soup.select(HORSE_CONTAINER_SELECTOR)
-        if not horse_rows:
-            print("馬データなし")
+
+# ----------------------------------------
+# ■ 直前更新（オッズ・馬体重・馬場のみ）
+# ----------------------------------------
+
+REFRESH_COLS = ["popularity", "odds", "horse_weight", "weight_diff"]
+
+
+def refresh_race_data(url, driver, wait, data_path, common_path):
+    """
+    新聞ページを再取得し、既存 CSV のオッズ・人気・馬体重と天気・馬場だけを書き換える。
+    前走などの重い解析は行わない。更新できた馬の数を返す。
+    """
+    content = get_html_content_with_selenium(url, driver, wait)
+    if not content:
+        return 0
+
+    import pandas as pd
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, "html.parser")
+    latest = {}
+    for container in soup.select(HORSE_CONTAINER_SELECTOR):
+        horse_number = get_text(container, "td.umabanBox")
+        if horse_number:
+            latest[horse_number] = parse_odds_cells(container)
+
+    df = pd.read_csv(data_path, dtype=str, keep_default_na=False)
+    updated = 0
+    for idx, number in df["horse_number"].items():
+        vals = latest.get(str(number).strip())
+        if vals is None:
             continue
+        for col, v in zip(REFRESH_COLS, vals):
+            if v:
+                df.at[idx, col] = v
+        updated += 1
+    df.to_csv(data_path, index=False, encoding="utf-8-sig")
+
+    df_common = pd.read_csv(common_path, dtype=str, keep_default_na=False)
+    race_id = str(df_common["race_id"].iloc[0]) if "race_id" in df_common.columns else ""
+    fresh = extract_race_common_info(soup, race_id)
+    for col in ("weather", "track_condition"):
+        if getattr(fresh, col):
+            df_common[col] = getattr(fresh, col)
+    df_common.to_csv(common_path, index=False, encoding="utf-8-sig")
 
-        race_data = []
-
-        for container in horse_rows:
-
-            # ----------------------
-            # 基本情報
-            # ----------------------
-            wakuban = get_text(container, "td.wakubanBox")
-            horse_number = get_text(container, "td.umabanBox")
-            horse_name = get_text(container, "td.bameiBox .bamei3 a")
-
-            # 性齢・間隔
-            kisyu_list = container.select("td.bameiBox .kisyu3")
-            basic_info = kisyu_list[1].get_text(" ", strip=True) if len(kisyu_list) >= 2 else ""
-            sex_age = re.findall(r"(牡|牝|セ)\d", basic_info)
-            sex_age = sex_age[0] if sex_age else ""
-            kankaku = re.findall(r"(中\d+週|新馬)", basic_info)
-            kankaku = kankaku[0] if kankaku else ""
-
-            jockey_name = get_text(container, "td.bameiBox .kisyu3 a")
-            kinryou = get_text(container, "td.bameiBox .dbkinryou").replace("(", "").replace(")", "")
-
-            # 脚質（◁◁◀◀）
-            legs_style = "".join([s.get_text("") for s in container.select("td.bameiBox .dbrunstyle2yoko span")])
-            # 数値化（0.0〜1.0）へ変換
-            legs_style_score = legs_score(legs_style)
-            # ----------------------
-            # 人気・オッズ・体重
-            # ----------------------
-            odd_dd = container.select("td.umaboddsBox .umaboddsDl dd")
-            popularity = odd_dd[0].get_text(strip=True).replace("人気", "") if len(odd_dd) > 0 else ""
-            odds = odd_dd[1].get_text(strip=True) if len(odd_dd) > 1 else ""
-            horse_weight = odd_dd[2].get_text(strip=True).replace("kg", "") if len(odd_dd) > 2 else ""
-            weight_diff = re.sub(r"[()＋－kg]", "", odd_dd[3].get_text(strip=True)) if len(odd_dd) > 3 else ""
-
-            # ----------------------
-            # 血統
-            # ----------------------
-            father_name = get_text(container, ".chichi3 a")
-            mother_name = get_text(container, ".haha4")
-
-            # ---------------------------
-            # 騎手データの抽出（完全版 / 改良版）
-            # ---------------------------
-
-            jockey_course_win_rate = ""
-            horse_num_course_win_rate = ""
-            father_course_win_rate = ""
-            trainer_jockey_win_rate = ""
-
-            all_jd = container.select("td.jockeydata")
-
-            # 「成績テーブルではないほう」を取得
-            target_jd = None
-            for jd in all_jd:
-                classes = jd.get("class", [])
-                if not any("dbSeisekiData" in c for c in classes):
-                    target_jd = jd
-                    break
-
-            if target_jd:
-                html = target_jd.decode_contents()
-
-                # ★ すべての <br> タグで分割（<br>, <br/>, <br />）
-                lines = re.split(r"<br\s*/?>", html)
-
-                for line in lines:
-                    # タグを解析しつつテキスト抽出
-                    s = BeautifulSoup(line, "html.parser")
-                    text = s.get_text(" ", strip=True)
-
-                    if "：" not in text:
-                        continue
-
-                    label, value = text.split("：", 1)
-                    label = label.strip()
-                    value = value.strip()
-
-                    clean_value = extract_percent_only(value)
-
-                    if label == "騎手":
-                        jockey_course_win_rate = clean_value
-                    elif label == "馬番":
-                        horse_num_course_win_rate = clean_value
-                    elif label == "父馬":
-                        father_course_win_rate = clean_value
-                    elif label == "コンビ":
-                        trainer_jockey_win_rate = clean_value
-   
-
-
-            # ----------------------
-            # 成績表（距離 / コース / 馬場）
-            # ----------------------
-            seiseki = container.select("td.dbSeisekiData table")
-            def parse_block(tbl):
-                out = {}
-                for tr in tbl.select("tr"):
-                    th = tr.select_one("th").get_text(strip=True)
-                    tds = [td.get_text(strip=True) for td in tr.select("td")]
-                    out[th] = tds
-                return out
-
-            dist_stats = parse_block(seiseki[0]) if len(seiseki) >= 1 else {}
-            course_stats = parse_block(seiseki[1]) if len(seiseki) >= 2 else {}
-            surface_stats = parse_block(seiseki[2]) if len(seiseki) >= 3 else {}
-
-            # ----------------------
-            # 前走1〜5 詳細データ
-            # ----------------------
-            prev_boxes = container.select("td.zensouBox")
-            prev_detail = {}
-
-            for i in range(5):
-                key = f"prev{i+1}_"
-                if i < len(prev_boxes):
-                    p = parse_prev_race(prev_boxes[i])
-                else:
-                    p = parse_prev_race(None)
-
-                # 詳細カラム展開
-                for k, v in p.items():
-                    prev_detail[key + k] = v
-
-            # ----------------------
-            # DataFrame用レコード
-            # ----------------------
-            data = {
-                "wakuban": wakuban,
-                "horse_number": horse_number,
-                "horse_name": horse_name,
-                "jockey_name": jockey_name,
-                "sex_age": sex_age,
-                "kankaku": kankaku,
-                "kinryou": kinryou,
-                "running_style_score_0to1": legs_style_score,
-                "popularity": popularity,
-                "odds": odds,
-                "horse_weight": horse_weight,
-                "weight_diff": weight_diff,
-                "father_name": father_name,
-                "mother_name": mother_name,
-                "jockey_course_win_rate": jockey_course_win_rate,
-                "horse_num_course_win_rate": horse_num_course_win_rate,
-                "father_course_win_rate": father_course_win_rate,
-                "trainer_jockey_win_rate": trainer_jockey_win_rate,
-                "dist_stats": dist_stats,
-                "course_stats": course_stats,
-                "surface_stats": surface_stats
-            }
-
-            data.update(prev_detail)
-            race_data.append(data)
-
-        # 保存
-        if race_data:
-            df = pd.DataFrame(race_data)
-            os.makedirs(OUTPUT_DIR, exist_ok=True)
-            safe_race_name = re.sub(r'[\\/:*?"<>|]', "", race_name)
-            out_path = os.path.join(OUTPUT_DIR, f"{race_id}_{safe_race_name}_data.csv")
-            df.to_csv(out_path, index=False, encoding="utf-8-sig")
-            print("保存:", out_path)
-            common_info = extract_race_common_info(soup, race_id)
-            df_common = pd.DataFrame([common_info])
-            common_path = os.path.join(OUTPUT_DIR, f"{race_id}_{safe_race_name}_common.csv")
-            df_common.to_csv(common_path, index=False, encoding="utf-8-sig")
-            print("共通情報保存:", common_path)
+    print(f"直前更新: {data_path} ({updated} 頭)")
+    return updated
 
 
 # ----------------------------------------
-# ■ MAIN
+# ■ WebDriver 起動
 # ----------------------------------------
 
-if __name__ == "__main__":
+def create_driver():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.support.ui import WebDriverWait
+    from webdriver_manager.chrome import ChromeDriverManager
 
-    TODAY_STR = get_today_str()
-    OUTPUT_DIR = f"race_data_{TODAY_STR}"
     user_agent = random.choice(USER_AGENTS)
     options = Options()
     options.add_argument("--headless")
     options.add_argument(f"user-agent={user_agent}")
 
+    service = Service(ChromeDriverManager().install())
+    driver = webdriver.Chrome(service=service, options=options)
+    wait = WebDriverWait(driver, 45)
+    return driver, wait
+
+
+# ----------------------------------------
+# ■ MAIN
+# ----------------------------------------
+
+if __name__ == "__main__":
+
+    TODAY_STR = get_today_str()
+    OUTPUT_DIR = f"race_data_{TODAY_STR}"
+
     driver = None
     try:
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=options)
-        wait = WebDriverWait(driver, 45)
+        driver, wait = create_driver()
 
         all_ids, urls = get_all_race_card_urls(driver, wait)
         if urls:
@@ -0,0 +1,215 @@
+import sys
+from dataclasses import dataclass, field, fields
+
+# ==============================
+# 省メモリなレース・馬レコード
+# ==============================
+# 解析結果を「列名 → 文字列」の dict ではなく __slots__ 付きの dataclass で保持する。
+# 騎手名・父名・天候・馬場など何度も現れる文字列は sys.intern で1つに共有し、
+# DataFrame 化の際は category 型と数値の downcast で列を詰める。
+# CSV に書き出す列名・並びは従来（dict から作っていた頃）と同じ。
+
+NUM_PREV = 5
+
+# 同じ値が繰り返し現れる列（DataFrame では category 型にする）
+CATEGORY_COLS = ["jockey_name", "father_name", "sex_age", "kankaku"] + [
+    f"prev{i}_{k}"
+    for i in range(1, NUM_PREV + 1)
+    for k in ("weather", "condition", "pace", "jockey", "race_name")
+]
+
+# 数値化しない列（dict / list の文字列表現・日付・タイム等）
+OBJECT_COLS = {"dist_stats", "course_stats", "surface_stats", "horse_id"} | {
+    f"prev{i}_{k}" for i in range(1, NUM_PREV + 1) for k in ("corner_order", "date", "time")
+}
+
+
+def intern(s: str) -> str:
+    return sys.intern(s) if s else ""
+
+
+@dataclass(slots=True)
+class PrevRun:
+    rank: str = ""
+    date: str = ""
+    distance: str = ""
+    weather: str = ""
+    condition: str = ""
+    race_name: str = ""
+    corner_order: tuple = ()
+    field_size: str = ""
+    horse_num: str = ""
+    popularity: str = ""
+    time: str = ""
+    agari: str = ""
+    pace: str = ""
+    weight: str = ""
+    weight_diff: str = ""
+    jockey: str = ""
+    margin: str = ""
+
+    def __post_init__(self):
+        self.weather = intern(self.weather)
+        self.condition = intern(self.condition)
+        self.race_name = intern(self.race_name)
+        self.pace = intern(self.pace)
+        self.jockey = intern(self.jockey)
+
+
+PREV_FIELDS = [f.name for f in fields(PrevRun)]
+
+
+@dataclass(slots=True)
+class Horse:
+    wakuban: str = ""
+    horse_number: str = ""
+    horse_name: str = ""
+    jockey_name: str = ""
+    sex_age: str = ""
+    kankaku: str = ""
+    kinryou: str = ""
+    running_style_score_0to1: float = 0.0
+    popularity: str = ""
+    odds: str = ""
+    horse_weight: str = ""
+    weight_diff: str = ""
+    father_name: str = ""
+    mother_name: str = ""
+    jockey_course_win_rate: str = ""
+    horse_num_course_win_rate: str = ""
+    father_course_win_rate: str = ""
+    trainer_jockey_win_rate: str = ""
+    dist_stats: dict = field(default_factory=dict)
+    course_stats: dict = field(default_factory=dict)
+    surface_stats: dict = field(default_factory=dict)
+    horse_id: str = ""
+    prevs: tuple = ()
+
+    def __post_init__(self):
+        self.jockey_name = intern(self.jockey_name)
+        self.father_name = intern(self.father_name)
+        self.sex_age = intern(self.sex_age)
+        self.kankaku = intern(self.kankaku)
+
+
+HORSE_FIELDS = [f.name for f in fields(Horse) if f.name != "prevs"]
+
+HORSE_COLUMNS = HORSE_FIELDS + [f"prev{i}_{k}" for i in range(1, NUM_PREV + 1) for k in PREV_FIELDS]
+
+
+@dataclass(slots=True)
+class RaceCommon:
+    race_id: str = ""
+    race_number: str = ""
+    date_info: str = ""
+    race_title: str = ""
+    weather: str = ""
+    track_condition: str = ""
+    surface: str = ""
+    distance: str = ""
+    headcount: str = ""
+    post_time: str = ""
+
+    def __post_init__(self):
+        self.date_info = intern(self.date_info)
+        self.weather = intern(self.weather)
+        self.track_condition = intern(self.track_condition)
+        self.surface = intern(self.surface)
+
+    def to_dict(self) -> dict:
+        return {f: getattr(self, f) for f in COMMON_FIELDS}
+
+
+COMMON_FIELDS = [f.name for f in fields(RaceCommon)]
+
+
+# =========================
+# 列指向への変換
+# =========================
+def _prev_value(prev: PrevRun, name: str):
+    v = getattr(prev, name)
+    # 従来 CSV と同じ表現（list の repr）にそろえる
+    return list(v) if name == "corner_order" else v
+
+
+def horses_to_columns(horses: list) -> dict:
+    """行 dict を作らず、列ごとの list を直接組み立てる"""
+    blank = PrevRun()
+    columns = {name: [getattr(h, name) for h in horses] for name in HORSE_FIELDS}
+    for i in range(NUM_PREV):
+        prevs = [h.prevs[i] if i < len(h.prevs) else blank for h in horses]
+        for name in PREV_FIELDS:
+            columns[f"prev{i + 1}_{name}"] = [_prev_value(p, name) for p in prevs]
+    return columns
+
+
+def horses_to_frame(horses: list, compact: bool = True):
+    import pandas as pd
+
+    columns = horses_to_columns(horses)
+    if compact:
+        columns = {name: compact_column(name, values) for name, values in columns.items()}
+    return pd.DataFrame(columns, columns=HORSE_COLUMNS)
+
+
+def common_to_frame(common: RaceCommon):
+    import pandas as pd
+
+    return pd.DataFrame([common.to_dict()], columns=COMMON_FIELDS)
+
+
+# =========================
+# 列の圧縮
+# =========================
+def _smallest_int_dtype(lo: int, hi: int) -> str:
+    for dtype, limit in (("Int8", 2 ** 7), ("Int16", 2 ** 15), ("Int32", 2 ** 31)):
+        if -limit <= lo and hi < limit:
+            return dtype
+    return "Int64"
+
+
+def _parse_numbers(values: list):
+    """空欄以外がすべて数値なら float（空欄は None）の list、そうでなければ None"""
+    out = []
+    for v in values:
+        if v is None or v == "":
+            out.append(None)
+            continue
+        if isinstance(v, bool) or not isinstance(v, (str, int, float)):
+            return None
+        try:
+            f = float(v)
+        except ValueError:
+            return None
+        out.append(None if f != f else f)
+    return out
+
+
+def compact_column(name: str, values: list):
+    """
+    category_cols は category 型、数値として読める列は欠損対応の最小整数型か float32 にする。
+    CSV に書き出した結果は従来と同じ値として読める（"+4" は 4、"57.0" は 57 になる）。
+    pandas の文字列処理を列ごとに呼ぶと遅いため、判定は Python の list 上で行う。
+    """
+    import numpy as np
+    import pandas as pd
+
+    if name in CATEGORY_COLS:
+        return pd.Categorical(values)
+    if name in OBJECT_COLS:
+        return values
+
+    numbers = _parse_numbers(values)
+    present = [f for f in (numbers or []) if f is not None]
+    if not present:
+        return values
+
+    if all(f.is_integer() for f in present):
+        dtype = _smallest_int_dtype(int(min(present)), int(max(present)))
+        return pd.array([None if f is None else int(f) for f in numbers], dtype=dtype)
+    return np.array([np.nan if f is None else f for f in numbers], dtype=np.float32)
+
+
+def compact_frame(df):
+    """既存の DataFrame（read_csv の結果など）を compact_column と同じ規則で詰める"""
+    return df.__class__({col: compact_column(col, df[col].tolist()) for col in df.columns}, index=df.index)
@@ -0,0 +1,200 @@
+import argparse
+import glob
+import json
+import os
+import re
+
+import race_info_collect
+
+# ==============================
+# 確定結果（着順・払戻）の取得
+# ==============================
+# 使い方:
+#   python race_results_collect.py 20251207
+#   python race_results_collect.py 20251207 --output-dir race_data_20251207 --force
+#
+# レース一覧・新聞と同じ Selenium 取得層を使い、結果ページから
+# 着順と払戻を {race_id}_result.json として日付ディレクトリに保存する。
+# 既に保存済みのレースは再取得しない（--force で上書き）。
+
+RESULT_URL_TEMPLATE = "https://keibalab.jp/db/race/{race_id}/raceresult.html"
+RESULT_READY_SELECTOR = "table"
+
+RESULT_FILE_SUFFIX = "_result.json"
+
+# 払戻表の券種 → JSON のキー
+BET_TYPES = {
+    "単勝": "win",
+    "複勝": "place",
+    "枠連": "bracket_quinella",
+    "馬連": "quinella",
+    "ワイド": "quinella_place",
+    "馬単": "exacta",
+    "3連複": "trio",
+    "三連複": "trio",
+    "3連単": "trifecta",
+    "三連単": "trifecta",
+}
+
+
+def result_path(output_dir: str, race_id: str) -> str:
+    return os.path.join(output_dir, f"{race_id}{RESULT_FILE_SUFFIX}")
+
+
+def _to_int(text: str):
+    m = re.search(r"\d[\d,]*", text or "")
+    return int(m.group(0).replace(",", "")) if m else None
+
+
+def _to_float(text: str):
+    m = re.search(r"\d+(?:\.\d+)?", text or "")
+    return float(m.group(0)) if m else None
+
+
+# ----------------------------------------
+# ■ 解析
+# ----------------------------------------
+
+def _header_index(table) -> dict:
+    header = table.select_one("thead tr") or table.select_one("tr")
+    cells = header.find_all(["th", "td"]) if header else []
+    return {c.get_text(strip=True): i for i, c in enumerate(cells)}
+
+
+def parse_finishing_order(soup) -> list:
+    """ヘッダに「着順」「馬番」を持つ表を結果表とみなし、列名で値を拾う"""
+    for table in soup.find_all("table"):
+        cols = _header_index(table)
+        if "着順" not in cols or "馬番" not in cols:
+            continue
+
+        def cell(cells, name):
+            i = cols.get(name)
+            return cells[i].get_text(strip=True) if i is not None and i < len(cells) else ""
+
+        order = []
+        for tr in table.select("tbody tr") or table.find_all("tr")[1:]:
+            cells = tr.find_all("td")
+            if not cells:
+                continue
+            rank_text = cell(cells, "着順")
+            horse_number = _to_int(cell(cells, "馬番"))
+            if horse_number is None:
+                continue
+            order.append({
+                # 中止・除外・取消は None
+                "rank": int(rank_text) if rank_text.isdigit() else None,
+                "horse_number": horse_number,
+                "horse_name": cell(cells, "馬名"),
+                "odds": _to_float(cell(cells, "単勝") or cell(cells, "オッズ")),
+                "popularity": _to_int(cell(cells, "人気")),
+            })
+        return order
+    return []
+
+
+def parse_payouts(soup) -> dict:
+    """
+    払戻表（行見出しが券種）を {"win": [{"numbers": "13", "yen": 250}], ...} に変換する。
+    複勝・ワイドのように複数行ある券種は <br> 区切りを順に対応させる。
+    """
+    payouts = {}
+    for tr in soup.find_all("tr"):
+        head = tr.find("th")
+        if head is None:
+            continue
+        key = BET_TYPES.get(head.get_text(strip=True))
+        if key is None or key in payouts:
+            continue
+
+        cells = tr.find_all("td")
+        if len(cells) < 2:
+            continue
+        numbers = [t.strip() for t in cells[0].get_text("\n").split("\n") if t.strip()]
+        yens = [_to_int(t) for t in cells[1].get_text("\n").split("\n") if t.strip()]
+
+        payouts[key] = [
+            {"numbers": re.sub(r"\s+", "", n), "yen": y}
+            for n, y in zip(numbers, yens) if y is not None
+        ]
+    return payouts
+
+
+def parse_result_html(content: str, race_id: str) -> dict:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, "html.parser")
+    return {
+        "race_id": race_id,
+        "order": parse_finishing_order(soup),
+        "payouts": parse_payouts(soup),
+    }
+
+
+# ----------------------------------------
+# ■ 取得・保存
+# ----------------------------------------
+
+def collect_result(race_id: str, driver, wait, output_dir: str):
+    url = RESULT_URL_TEMPLATE.format(race_id=race_id)
+    print("\n▶", url)
+
+    content = race_info_collect.get_html_content_with_selenium(url, driver, wait, RESULT_READY_SELECTOR)
+    if not content:
+        print(f"[WARN] 結果ページ取得失敗: {race_id}")
+        return None
+
+    result = parse_result_html(content, race_id)
+    if not any(r["rank"] for r in result["order"]):
+        print(f"[WARN] 着順未確定のため保存しません: {race_id}")
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = result_path(output_dir, race_id)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print("保存:", path)
+    return path
+
+
+def race_ids_in_dir(output_dir: str) -> list:
+    """スクレイピング済みの *_data.csv からレースIDを得る（一覧ページへのアクセスを省く）"""
+    ids = set()
+    for path in glob.glob(os.path.join(output_dir, "*_data.csv")):
+        m = re.match(r"(\d{12})_", os.path.basename(path))
+        if m:
+            ids.add(m.group(1))
+    return sorted(ids)
+
+
+def collect_day(date_str: str, output_dir: str, force: bool = False) -> int:
+    driver = None
+    saved = 0
+    try:
+        driver, wait = race_info_collect.create_driver()
+
+        race_ids = race_ids_in_dir(output_dir) or race_info_collect.get_race_ids_from_list_page(date_str, driver, wait)
+        for race_id in race_ids:
+            if not force and os.path.exists(result_path(output_dir, race_id)):
+                continue
+            if collect_result(race_id, driver, wait, output_dir):
+                saved += 1
+    finally:
+        if driver:
+            driver.quit()
+
+    print(f"\n=== 完了: {saved} レース保存 ===")
+    return saved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="確定した着順・払戻を取得して保存")
+    parser.add_argument("date", help="YYYYMMDD")
+    parser.add_argument("--output-dir", default=None, help="既定: race_data_YYYYMMDD")
+    parser.add_argument("--force", action="store_true", help="保存済みのレースも再取得する")
+    args = parser.parse_args()
+
+    if not re.match(r"^\d{8}$", args.date):
+        parser.error("日付はYYYYMMDD形式で指定してください")
+
+    collect_day(args.date, args.output_dir or f"race_data_{args.date}", args.force)
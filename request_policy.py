@@ -0,0 +1,291 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Optional
+
+import metrics
+
+# =========================
+# 設定
+# =========================
+# LLM 応答時間向けのバケット上限（秒）
+LATENCY_BUCKETS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+
+# 履歴が少ないうちは分位点を信用せず固定値でヘッジする
+MIN_SAMPLES_FOR_QUANTILE = 20
+DEFAULT_HEDGE_AFTER_SECONDS = 45.0
+
+
+class DeadlineExceeded(TimeoutError):
+    """レース単位の締切までに有効な応答が得られなかった"""
+
+
+class RequestCancelled(Exception):
+    """ヘッジ側が先に成功したため打ち切られた"""
+
+
+# 429・5xx・接続断・タイムアウトは締切まで間隔をあけて再送する（出力不正の max_retries とは別枠）
+TRANSIENT_ERROR_NAMES = ("RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError")
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 20.0
+
+
+# =========================
+# レイテンシヒストグラム
+# =========================
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 末尾は +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        idx = len(self.buckets)
+        for i, upper in enumerate(self.buckets):
+            if seconds <= upper:
+                idx = i
+                break
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        # 該当バケットの上限を返す（+Inf バケットは観測最大値）
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cum = 0
+        for i, c in enumerate(self.counts):
+            cum += c
+            if cum >= target:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self) -> str:
+        if self.count == 0:
+            return "n=0"
+        parts = [f"n={self.count}", f"mean={self.total / self.count:.1f}s"]
+        for q in (0.5, 0.9, 0.99):
+            parts.append(f"p{int(q * 100)}<={self.quantile(q):.1f}s")
+        return " ".join(parts)
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": list(self.buckets),
+            "counts": self.counts,
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "LatencyHistogram":
+        h = cls(d.get("buckets", LATENCY_BUCKETS))
+        counts = d.get("counts", [])
+        if len(counts) == len(h.counts):
+            h.counts = list(counts)
+            h.count = d.get("count", sum(counts))
+            h.total = d.get("sum", 0.0)
+            h.max = d.get("max", 0.0)
+        return h
+
+
+def load_histograms(path: str) -> dict:
+    """{"request": ..., "race": ...} 形式の JSON を読み込む（無ければ空）"""
+    hists = {"request": LatencyHistogram(), "race": LatencyHistogram()}
+    if path and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for name, d in json.load(f).items():
+                    hists[name] = LatencyHistogram.from_dict(d)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] レイテンシ履歴を読めません: {path} ({e})")
+    return hists
+
+
+def save_histograms(path: str, hists: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({k: h.to_dict() for k, h in hists.items()}, f, indent=2)
+    os.replace(tmp, path)
+
+
+# =========================
+# リクエスト方針
+# =========================
+@dataclass
+class RequestPolicy:
+    deadline_seconds: float = 180.0
+    hedge_quantile: float = 0.9
+    hedge_after_seconds: Optional[float] = None  # 指定時は分位点より優先
+    min_hedge_after_seconds: float = 5.0
+    max_hedges: int = 1
+    max_retries: int = 2
+
+    def hedge_delay(self, histogram: Optional[LatencyHistogram]) -> float:
+        if self.hedge_after_seconds is not None:
+            return self.hedge_after_seconds
+        delay = DEFAULT_HEDGE_AFTER_SECONDS
+        if histogram is not None and histogram.count >= MIN_SAMPLES_FOR_QUANTILE:
+            delay = histogram.quantile(self.hedge_quantile)
+        return max(delay, self.min_hedge_after_seconds)
+
+
+def run_with_policy(call, policy: RequestPolicy, histograms: Optional[dict] = None):
+    """
+    call(cancel_event, timeout_seconds) を方針に従って実行する。
+    - 締切を過ぎたら DeadlineExceeded
+    - 応答が p90 を超えたら同一リクエストを追加送信し、先に成功した方を採用
+    - 出力不正（ValueError）は max_retries 回まで再試行
+    - 一時的な API エラー（429・5xx・接続断）は Retry-After または指数バックオフで締切まで再送
+    """
+    histograms = histograms or {}
+    request_hist = histograms.get("request")
+    race_hist = histograms.get("race")
+
+    start = time.monotonic()
+    deadline = start + policy.deadline_seconds
+    pool = ThreadPoolExecutor(max_workers=1 + policy.max_hedges)
+    transient = None
+    last_error = None
+    attempt = 0
+    resends = 0
+
+    try:
+        while attempt <= policy.max_retries:
+            try:
+                result = _attempt(call, policy, pool, deadline, request_hist)
+            except ValueError as e:
+                last_error = e
+                attempt += 1
+                if attempt <= policy.max_retries:
+                    print(f"[WARN] 再試行 {attempt}/{policy.max_retries}: {e}")
+                    metrics.inc("keiba_llm_retries_total")
+                continue
+            except Exception as e:
+                transient = transient if transient is not None else transient_errors()
+                if not isinstance(e, transient):
+                    raise
+                delay = backoff_delay(e, resends)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                resends += 1
+                print(f"[WARN] 一時的なエラーのため {delay:.1f}s 後に再送 ({resends}回目): {type(e).__name__}: {e}")
+                metrics.inc("keiba_llm_retries_total")
+                if is_rate_limited(e):
+                    metrics.inc("keiba_rate_limited_total", limiter="openai")
+                metrics.rate_wait("openai", delay)
+                time.sleep(delay)
+                continue
+            if race_hist is not None:
+                race_hist.observe(time.monotonic() - start)
+            metrics.observe("keiba_llm_race_seconds", time.monotonic() - start)
+            return result
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    raise last_error
+
+
+def transient_errors() -> tuple:
+    """再送してよい openai の例外クラス（openai 未導入なら空）。失敗時にだけ呼ぶので import は遅延"""
+    try:
+        import openai
+    except ImportError:
+        return ()
+    return tuple(getattr(openai, name) for name in TRANSIENT_ERROR_NAMES if hasattr(openai, name))
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """応答の retry-after-ms / Retry-After ヘッダ（秒）。無ければ None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(float(value) * scale, 0.0)
+        except ValueError:
+            pass
+    return None
+
+
+def backoff_delay(error: Exception, resends: int) -> float:
+    """Retry-After があればそれに従い、無ければ 1, 2, 4 … 秒（上限あり・ジッタ付き）"""
+    delay = retry_after_seconds(error)
+    if delay is not None:
+        return delay
+    return min(BACKOFF_BASE_SECONDS * 2 ** resends, BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1.0)
+
+
+def _attempt(call, policy: RequestPolicy, pool, deadline: float, request_hist):
+    running = {}
+
+    def launch():
+        cancel = threading.Event()
+        t0 = time.monotonic()
+        fut = pool.submit(call, cancel, max(deadline - t0, 0.001))
+        running[fut] = (cancel, t0)
+        return fut
+
+    pending = {launch()}
+    hedge_at = time.monotonic() + policy.hedge_delay(request_hist)
+    hedges = 0
+    last_error = None
+
+    while pending:
+        now = time.monotonic()
+        if now >= deadline:
+            for fut in pending:
+                running[fut][0].set()
+            raise DeadlineExceeded(f"{policy.deadline_seconds:.1f} 秒以内に応答がありません")
+
+        wait_until = deadline
+        if hedges < policy.max_hedges:
+            wait_until = min(wait_until, hedge_at)
+        done, pending = wait(pending, timeout=max(wait_until - now, 0), return_when=FIRST_COMPLETED)
+
+        for fut in done:
+            cancel, t0 = running[fut]
+            try:
+                result = fut.result()
+            except RequestCancelled:
+                continue
+            except Exception as e:
+                last_error = e
+                continue
+
+            if request_hist is not None:
+                request_hist.observe(time.monotonic() - t0)
+            metrics.observe("keiba_llm_request_seconds", time.monotonic() - t0)
+            for other in pending:
+                running[other][0].set()
+            return result
+
+        if not done and hedges < policy.max_hedges and time.monotonic() >= hedge_at:
+            hedges += 1
+            metrics.inc("keiba_llm_hedges_total")
+            print(f"[INFO] 応答遅延のためヘッジ送信 ({time.monotonic() - running[next(iter(running))][1]:.1f}s)")
+            pending.add(launch())
+
+    raise last_error if last_error is not None else ValueError("有効な応答がありません")
+
+
+def format_histograms(histograms: dict) -> str:
+    return " / ".join(f"{name}: {h.summary()}" for name, h in histograms.items())
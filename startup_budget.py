@@ -0,0 +1,114 @@
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+
+# ==============================
+# CLI 起動時間の予算チェック
+# ==============================
+# 使い方:
+#   python startup_budget.py            # 予算超過・重いモジュールの混入で終了コード 1
+#   python startup_budget.py --runs 9 --verbose
+#
+# 各エントリポイントを `python -X importtime -c "import <module>"` で読み込み、
+# 自モジュールの累積 import 時間（中央値）を予算と比較する。
+# あわせて、遅延 import にしている重いモジュールがトップレベルで読み込まれていないか確認する。
+
+# エントリポイント → (予算 ms, トップレベル import を許可する重いモジュール)
+BUDGETS = {
+    "keiba": (250, ()),
+    "predict_race_ai": (250, ()),
+    "prepare_ai_input": (60, ()),
+    "feature_registry": (40, ()),
+    "race_info_collect": (60, ()),
+    "notify_discord": (80, ()),
+    "notify_outbox": (60, ()),
+    "race_day_daemon": (60, ()),
+    "mock_discord_server": (120, ()),
+    "mock_openai_server": (120, ()),
+    "history_store": (60, ()),
+    "race_index": (250, ()),
+    "work_queue": (60, ()),
+    "odds_series": (250, ()),
+    "horse_history": (100, ()),
+    "race_results_collect": (80, ()),
+    # バックテストは numpy の配列で集計するため numpy の読み込み分を見込む
+    "backtest": (400, ()),
+    # ベースライン予測は DataFrame 前提のため pandas（と pandas が読み込む pyarrow）を許可
+    "baseline_predictor": (800, ("pandas", "pyarrow")),
+}
+
+# 使う関数の中でのみ import するモジュール
+HEAVY_MODULES = ("pandas", "openai", "requests", "bs4", "selenium", "webdriver_manager", "pyarrow")
+
+DEFAULT_RUNS = 5
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def import_profile(module: str) -> dict:
+    """-X importtime の出力を {モジュール名: 累積マイクロ秒} に変換する"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{module} の import に失敗しました:\n{proc.stderr[-2000:]}")
+
+    profile = {}
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            profile[m.group(4)] = int(m.group(2))
+    return profile
+
+
+def measure(module: str, runs: int) -> tuple:
+    """(累積 import 時間の中央値 ms, 読み込まれた重いモジュール)"""
+    times = []
+    heavy = set()
+    for _ in range(runs):
+        profile = import_profile(module)
+        times.append(profile.get(module, 0) / 1000.0)
+        heavy |= {name for name in profile if name in HEAVY_MODULES}
+    return statistics.median(times), sorted(heavy)
+
+
+def check(modules: list, runs: int, verbose: bool = False) -> int:
+    failures = 0
+    for module in modules:
+        budget_ms, allowed = BUDGETS[module]
+        elapsed_ms, heavy = measure(module, runs)
+        unexpected = [name for name in heavy if name not in allowed]
+
+        ok = elapsed_ms <= budget_ms and not unexpected
+        status = "OK" if ok else "ERROR"
+        line = f"[{status}] {module:<20} {elapsed_ms:7.1f} ms / 予算 {budget_ms} ms"
+        if unexpected:
+            line += f" / トップレベルで重いモジュールを読み込み: {', '.join(unexpected)}"
+        elif verbose and heavy:
+            line += f" / 許可済み: {', '.join(heavy)}"
+        print(line)
+
+        if not ok:
+            failures += 1
+
+    if failures:
+        print(f"[ERROR] 起動時間の予算超過: {failures} 件")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CLI エントリポイントの起動時間を予算と比較する")
+    parser.add_argument("modules", nargs="*", help="対象モジュール（省略時は全エントリポイント）")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="計測回数（中央値を採用）")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    unknown = [m for m in args.modules if m not in BUDGETS]
+    if unknown:
+        parser.error(f"未登録のエントリポイント: {', '.join(unknown)}")
+
+    sys.exit(check(args.modules or list(BUDGETS), args.runs, args.verbose))
@@ -0,0 +1,378 @@
+import argparse
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# ==============================
+# 取得ワークキュー（SQLite / リース方式）
+# ==============================
+# 使い方:
+#   python work_queue.py enqueue --queue backfill.sqlite 20250105 20250106 ...
+#   python work_queue.py work    --queue backfill.sqlite --min-interval 5     （同じファイルを見るワーカーを複数起動）
+#   python work_queue.py status  --queue backfill.sqlite
+#
+# get_race_ids_from_list_page の race_id を1行ずつ登録し、ワーカーはリース（期限付きの占有）を取って取得する。
+#   - 取得中はハートビートでリースを延長する。ワーカーが落ちて延長が止まると期限切れ後に他のワーカーが再取得する
+#   - 試行回数が max_attempts に達したレースは failed にして、それ以上は配らない
+#   - 新聞ページへのアクセス間隔はキュー内の1行（next_at）で全ワーカー共通に制御する
+# 複数ホストで共有する場合はロックが正しく効く共有ファイルシステム上に置き、--no-wal を付ける
+# （WAL は同一ホスト内のプロセス間でしか使えない）。
+
+QUEUE_FILE_NAME = "scrape_queue.sqlite"
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    race_id       TEXT PRIMARY KEY,
+    status        TEXT NOT NULL DEFAULT 'pending',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    lease_owner   TEXT,
+    lease_expires REAL,
+    last_error    TEXT,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, race_id);
+CREATE TABLE IF NOT EXISTS rate_limit (
+    name    TEXT PRIMARY KEY,
+    next_at REAL NOT NULL
+);
+"""
+
+
+class LeaseLost(Exception):
+    """リース期限切れ後に他のワーカーへ配り直された"""
+
+
+class WorkQueue:
+    def __init__(self, path: str, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, wal: bool = True, clock=time.time):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+        # 取得スレッドとハートビートスレッドで共有するため、ロックで直列化する
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        if wal:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.RLock()
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def _write(self):
+        """他プロセスと競合しないよう、最初に書き込みロックを取るトランザクション"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    # --- 登録 ---
+    def enqueue(self, race_ids) -> int:
+        """未登録の race_id だけを追加し、追加件数を返す"""
+        now = self.clock()
+        with self._write() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (race_id, created_at, updated_at) VALUES (?, ?, ?)",
+                [(rid, now, now) for rid in race_ids],
+            )
+            return conn.total_changes - before
+
+    # --- リース ---
+    def claim(self, owner: str):
+        """
+        未処理、またはリース期限切れのレースを1件占有して race_id を返す。なければ None。
+        期限切れで試行回数を使い切ったものはここで failed にする。
+        """
+        now = self.clock()
+        with self._write() as conn:
+            conn.execute(
+                "UPDATE tasks SET status='failed', lease_owner=NULL, updated_at=?, "
+                "last_error=COALESCE(last_error, 'リース期限切れ') "
+                "WHERE status='leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT race_id FROM tasks "
+                "WHERE status='pending' OR (status='leased' AND lease_expires < ?) "
+                "ORDER BY race_id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE tasks SET status='leased', lease_owner=?, lease_expires=?, attempts=attempts+1, updated_at=? "
+                "WHERE race_id=?",
+                (owner, now + self.lease_seconds, now, row["race_id"]),
+            )
+            return row["race_id"]
+
+    def heartbeat(self, race_id: str, owner: str) -> bool:
+        """リースを延長する。すでに他のワーカーのものなら False"""
+        now = self.clock()
+        with self._write() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET lease_expires=?, updated_at=? WHERE race_id=? AND status='leased' AND lease_owner=?",
+                (now + self.lease_seconds, now, race_id, owner),
+            )
+            return cur.rowcount == 1
+
+    def complete(self, race_id: str, owner: str):
+        with self._write() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET status='done', lease_owner=NULL, lease_expires=NULL, last_error=NULL, updated_at=? "
+                "WHERE race_id=? AND status='leased' AND lease_owner=?",
+                (self.clock(), race_id, owner),
+            )
+            if cur.rowcount != 1:
+                raise LeaseLost(race_id)
+
+    def fail(self, race_id: str, owner: str, error: str):
+        """試行回数が残っていれば pending に戻し、使い切っていれば failed にする"""
+        with self._write() as conn:
+            conn.execute(
+                "UPDATE tasks SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_owner=NULL, lease_expires=NULL, last_error=?, updated_at=? "
+                "WHERE race_id=? AND status='leased' AND lease_owner=?",
+                (self.max_attempts, str(error)[:500], self.clock(), race_id, owner),
+            )
+
+    def retry_failed(self) -> int:
+        """failed をすべて pending に戻す（試行回数もリセット）"""
+        with self._write() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET status='pending', attempts=0, updated_at=? WHERE status='failed'", (self.clock(),)
+            )
+            return cur.rowcount
+
+    @contextmanager
+    def lease(self, race_id: str, owner: str, interval: float = None):
+        """ブロック内の処理中、別スレッドでハートビートを送り続ける"""
+        interval = interval or max(self.lease_seconds / 3, 1.0)
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                if not self.heartbeat(race_id, owner):
+                    print(f"[WARN] リースを失いました: {race_id}")
+                    return
+
+        thread = threading.Thread(target=beat, name=f"heartbeat-{race_id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    # --- 全体のアクセス間隔 ---
+    def acquire_rate_slot(self, min_interval: float, name: str = "keibalab"):
+        """
+        全ワーカー共通で min_interval 秒に1回の枠を予約し、その時刻まで待つ。
+        予約はトランザクション内で next_at を進めるだけなので、待機中はロックを持たない。
+        """
+        now = self.clock()
+        with self._write() as conn:
+            row = conn.execute("SELECT next_at FROM rate_limit WHERE name=?", (name,)).fetchone()
+            slot = max(now, row["next_at"] if row else now)
+            conn.execute(
+                "INSERT INTO rate_limit (name, next_at) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET next_at=excluded.next_at",
+                (name, slot + min_interval),
+            )
+        wait = slot - self.clock()
+        if wait > 0:
+            time.sleep(wait)
+            metrics.rate_wait(f"queue:{name}", wait)
+
+    # --- 集計 ---
+    def counts(self) -> dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) AS n FROM tasks GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    def depth_metrics(self) -> list:
+        """metrics.set_collector 用。status ごとの件数（0 件の status も出す）"""
+        counts = self.counts()
+        return [
+            ("keiba_queue_depth", {"queue": "work_queue", "state": state}, counts.get(state, 0))
+            for state in ("pending", "leased", "done", "failed")
+        ]
+
+    def failures(self, limit: int = 20) -> list:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT race_id, attempts, last_error FROM tasks WHERE status='failed' ORDER BY race_id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+
+# =========================
+# ワーカー
+# =========================
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def run_worker(queue: WorkQueue, root: str = ".", owner: str = None, min_interval: float = None,
+               max_tasks: int = None, idle_exit: bool = True, poll_seconds: float = 10.0) -> dict:
+    """
+    キューからレースを取り出して新聞を取得し、<root>/race_data_YYYYMMDD/ に保存する。
+    CSV は作業用ディレクトリに書き、complete() が通ってから移すため、
+    リースを失ったレースの結果は保存先に残らない（他のワーカーの結果と混ざらない）。
+    Chrome はワーカーごとに1つ。取得で例外が出たらドライバを作り直す。
+    """
+    import race_info_collect
+
+    owner = owner or default_worker_id()
+    min_interval = race_info_collect.REQUEST_DELAY_SECONDS if min_interval is None else min_interval
+    stats = {"done": 0, "failed": 0, "lease_lost": 0}
+    driver = wait = None
+    os.makedirs(root, exist_ok=True)
+
+    print(f"[INFO] ワーカー開始: {owner} / 間隔 {min_interval}s / リース {queue.lease_seconds}s")
+    metrics.set_collector("work_queue", queue.depth_metrics)
+    try:
+        while max_tasks is None or stats["done"] + stats["failed"] < max_tasks:
+            race_id = queue.claim(owner)
+            if race_id is None:
+                if idle_exit:
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            url = race_info_collect.NEWSPAPER_URL_TEMPLATE.format(race_id=race_id)
+            output_dir = os.path.join(root, f"race_data_{race_id[:8]}")
+            staging = tempfile.mkdtemp(prefix=f".{race_id}_", dir=root)
+            try:
+                with queue.lease(race_id, owner):
+                    if driver is None:
+                        driver, wait = race_info_collect.create_driver()
+                    queue.acquire_rate_slot(min_interval)
+                    # 待機はキュー側で行ったので、取得関数の固定スリープは使わない
+                    paths = race_info_collect.scrape_race(url, driver, wait, output_dir, delay=0, save_dir=staging)
+                if paths is None:
+                    queue.fail(race_id, owner, "取得失敗または馬データなし")
+                    stats["failed"] += 1
+                    continue
+                queue.complete(race_id, owner)
+                os.makedirs(output_dir, exist_ok=True)
+                for path in paths:
+                    os.replace(path, os.path.join(output_dir, os.path.basename(path)))
+                stats["done"] += 1
+            except LeaseLost:
+                print(f"[WARN] 期限切れで他のワーカーに配り直されたため結果を破棄: {race_id}")
+                stats["lease_lost"] += 1
+            except Exception as e:
+                print(f"[ERROR] {race_id}: {e}")
+                queue.fail(race_id, owner, repr(e))
+                stats["failed"] += 1
+                if driver is not None:
+                    try:
+                        driver.quit()
+                    except Exception:
+                        pass
+                    driver = wait = None
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+    finally:
+        metrics.remove_collector("work_queue")
+        if driver is not None:
+            driver.quit()
+
+    print(f"=== ワーカー終了: {owner} / 完了 {stats['done']} / 失敗 {stats['failed']} / "
+          f"リース喪失 {stats['lease_lost']} ===")
+    return stats
+
+
+def enqueue_dates(queue: WorkQueue, dates: list) -> int:
+    """各日のレース一覧ページから race_id を集めて登録する"""
+    import race_info_collect
+
+    driver, wait = race_info_collect.create_driver()
+    added = 0
+    try:
+        for date_str in dates:
+            race_ids = race_info_collect.get_race_ids_from_list_page(date_str, driver, wait)
+            n = queue.enqueue(race_ids)
+            added += n
+            print(f"[OK] {date_str}: {len(race_ids)} レース（新規 {n}）")
+            time.sleep(race_info_collect.REQUEST_DELAY_SECONDS)
+    finally:
+        driver.quit()
+    return added
+
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="新聞取得のワークキュー")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--queue", default=QUEUE_FILE_NAME, help="キューの SQLite ファイル")
+    common.add_argument("--no-wal", action="store_true", help="共有ファイルシステム上で複数ホストから使う場合")
+    common.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS)
+    common.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    enqueue = sub.add_parser("enqueue", parents=[common], help="日付のレース一覧から race_id を登録")
+    enqueue.add_argument("dates", nargs="*", help="YYYYMMDD")
+    enqueue.add_argument("--race-ids", nargs="*", default=[], help="race_id を直接登録")
+
+    work = sub.add_parser("work", parents=[common], help="キューから取り出して取得する")
+    work.add_argument("--root", default=".", help="race_data_YYYYMMDD の出力先")
+    work.add_argument("--worker-id", default=None, help="既定: ホスト名-PID")
+    work.add_argument("--min-interval", type=float, default=None,
+                      help="全ワーカー合計でのアクセス間隔（秒、既定: REQUEST_DELAY_SECONDS）")
+    work.add_argument("--max-tasks", type=int, default=None)
+    work.add_argument("--wait", action="store_true", help="キューが空でも終了せず待機する")
+    metrics.add_arguments(work)
+
+    status = sub.add_parser("status", parents=[common], help="件数と失敗を表示")
+    status.add_argument("--retry-failed", action="store_true", help="failed を pending に戻す")
+
+    args = parser.parse_args(argv)
+    queue = WorkQueue(args.queue, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts,
+                      wal=not args.no_wal)
+    try:
+        if args.command == "enqueue":
+            added = queue.enqueue(args.race_ids)
+            if args.dates:
+                added += enqueue_dates(queue, args.dates)
+            print(f"=== 登録: 新規 {added} 件 / {queue.counts()} ===")
+        elif args.command == "work":
+            metrics.start_from_args(args)
+            run_worker(queue, root=args.root, owner=args.worker_id, min_interval=args.min_interval,
+                       max_tasks=args.max_tasks, idle_exit=not args.wait)
+        else:
+            if args.retry_failed:
+                print(f"[OK] 再試行に戻した件数: {queue.retry_failed()}")
+            print(f"=== {args.queue}: {queue.counts()} ===")
+            for f in queue.failures():
+                print(f"  {f['race_id']}  試行 {f['attempts']}  {f['last_error']}")
+    finally:
+        queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())